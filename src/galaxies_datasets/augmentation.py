@@ -0,0 +1,183 @@
+"""Batched rotation invariant augmentations for galaxy images.
+
+Every function works on whole batches of square images, ``(batch, height,
+width, channels)`` or ``(batch, views, height, width, channels)`` for the
+stacked configs, as produced by :mod:`galaxies_datasets.pipelines`, using a
+fixed number of vectorized ops instead of a per-image map.
+"""
+import math
+import time
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
+import tensorflow as tf
+
+Augmentation = Callable[[tf.Tensor], tf.Tensor]
+
+
+def _dihedral_permutations(size: int) -> tf.Tensor:
+    """Source pixel of every output pixel, for each element of D4."""
+    index = tf.reshape(tf.range(size * size), [size, size, 1])
+    flipped = tf.image.flip_left_right(index)
+    elements = [tf.image.rot90(index, k) for k in range(4)]
+    elements += [tf.image.rot90(flipped, k) for k in range(4)]
+    return tf.stack([tf.reshape(element, [-1]) for element in elements])
+
+
+def dihedral(images: tf.Tensor, elements: tf.Tensor) -> tf.Tensor:
+    """Apply an element of the dihedral group D4 to each image.
+
+    ``elements`` holds one integer in ``[0, 8)`` per image: ``k % 4`` counter
+    clockwise quarter turns, after a horizontal flip when ``k >= 4``. The
+    whole batch is permuted by a single gather over the flattened pixels.
+    """
+    shape = tf.shape(images)
+    size = images.shape[-2]
+    flat = tf.reshape(images, tf.concat([shape[:-3], [size * size], shape[-1:]], 0))
+
+    permutations = tf.gather(_dihedral_permutations(size), elements)
+    flat = tf.gather(flat, permutations, axis=-2, batch_dims=1)
+
+    return tf.reshape(flat, shape)
+
+
+def random_dihedral(images: tf.Tensor, seed: Optional[int] = None) -> tf.Tensor:
+    """Apply a random element of the dihedral group D4 to each image."""
+    elements = tf.random.uniform(
+        tf.shape(images)[:1], maxval=8, dtype=tf.int32, seed=seed
+    )
+    return dihedral(images, elements)
+
+
+def _flatten_views(images: tf.Tensor) -> tf.Tensor:
+    """Merge the leading axes into a single batch axis."""
+    return tf.reshape(images, tf.concat([[-1], tf.shape(images)[-3:]], 0))
+
+
+def central_crop(images: tf.Tensor, size: int) -> tf.Tensor:
+    """Crop a centered square of ``size`` pixels."""
+    height, width = images.shape[-3], images.shape[-2]
+    top = (height - size) // 2
+    left = (width - size) // 2
+    return images[..., top : top + size, left : left + size, :]
+
+
+def rotate(
+    images: tf.Tensor,
+    angles: tf.Tensor,
+    crop_size: Optional[int] = None,
+    interpolation: str = "BILINEAR",
+) -> tf.Tensor:
+    """Rotate each image counter clockwise by an angle in radians.
+
+    All the images go through a single projective transform op. Corners
+    uncovered by the rotation are reflected, use a ``crop_size`` below
+    ``size / sqrt(2)`` to crop them away.
+    """
+    shape = tf.shape(images)
+    flat = _flatten_views(images)
+    height = tf.cast(shape[-3], tf.float32)
+    width = tf.cast(shape[-2], tf.float32)
+
+    # every view of an image shares its angle
+    angles = tf.cast(tf.reshape(angles, [-1]), tf.float32)
+    angles = tf.repeat(angles, tf.shape(flat)[0] // tf.shape(angles)[0])
+
+    # output to input pixel mapping for a rotation about the image center
+    cos, sin = tf.cos(angles), tf.sin(angles)
+    x_offset = ((width - 1) - (cos * (width - 1) - sin * (height - 1))) / 2
+    y_offset = ((height - 1) - (sin * (width - 1) + cos * (height - 1))) / 2
+    zeros = tf.zeros_like(angles)
+    transforms = tf.stack(
+        [cos, -sin, x_offset, sin, cos, y_offset, zeros, zeros], axis=1
+    )
+
+    rotated = tf.raw_ops.ImageProjectiveTransformV2(
+        images=flat,
+        transforms=transforms,
+        output_shape=shape[-3:-1],
+        interpolation=interpolation,
+        fill_mode="REFLECT",
+    )
+    rotated = tf.reshape(rotated, shape)
+    if crop_size is not None:
+        rotated = central_crop(rotated, crop_size)
+
+    return rotated
+
+
+def random_rotation(
+    images: tf.Tensor, crop_size: Optional[int] = None, seed: Optional[int] = None
+) -> tf.Tensor:
+    """Rotate each image by a uniformly random angle."""
+    angles = tf.random.uniform(
+        tf.shape(images)[:1], maxval=2 * math.pi, dtype=tf.float32, seed=seed
+    )
+    return rotate(images, angles, crop_size)
+
+
+def multi_view(images: tf.Tensor, crop_size: int) -> tf.Tensor:
+    """Extract the 16 overlapping views of Dieleman et al. (2015).
+
+    The images, rotated by 45 degrees, and both flipped, give 4 views. Each is
+    split into its 4 overlapping corners of ``crop_size`` pixels, turned so
+    that the galaxy center lies in the bottom right corner of every part. The
+    result has shape ``(batch, 16, crop_size, crop_size, channels)``.
+    """
+    batch = tf.shape(images)[0]
+    views = tf.stack([images, rotate(images, tf.fill([batch], math.pi / 4))], axis=1)
+    views = tf.concat([views, tf.reverse(views, axis=[-2])], axis=1)
+
+    size = crop_size
+    parts = [
+        views[..., :size, :size, :],
+        _rot90(views[..., :size, -size:, :], 1),
+        _rot90(views[..., -size:, -size:, :], 2),
+        _rot90(views[..., -size:, :size, :], 3),
+    ]
+
+    return tf.concat(parts, axis=1)
+
+
+def _rot90(images: tf.Tensor, k: int) -> tf.Tensor:
+    """Rotate every image by ``k`` counter clockwise quarter turns."""
+    return dihedral(images, tf.fill(tf.shape(images)[:1], k))
+
+
+def split_views(views: tf.Tensor) -> tf.Tensor:
+    """Fold the views axis into the batch axis to feed a model."""
+    return _flatten_views(views)
+
+
+def merge_views(features: tf.Tensor, num_views: int = 16) -> tf.Tensor:
+    """Concatenate the features of all the views of each image."""
+    shape = tf.shape(features)
+    size = tf.reduce_prod(shape[1:])
+    return tf.reshape(features, [shape[0] // num_views, num_views * size])
+
+
+def benchmark(
+    augmentation: Augmentation, images: tf.Tensor, num_iter: int = 20
+) -> Dict[str, float]:
+    """Compare a batched augmentation with applying it image by image.
+
+    Returns the mean seconds per batch of the vectorized op, ``"batched"``, and
+    of a ``tf.map_fn`` over single images, ``"per_image"``, both compiled with
+    ``tf.function``.
+    """
+    batched = tf.function(augmentation)
+    per_image = tf.function(
+        lambda x: tf.map_fn(lambda image: augmentation(image[None])[0], x)
+    )
+
+    timings = {}
+    for name, fn in [("batched", batched), ("per_image", per_image)]:
+        fn(images)  # trace and warm up
+        start = time.perf_counter()
+        for _ in range(num_iter):
+            result = fn(images)
+        result.numpy()
+        timings[name] = (time.perf_counter() - start) / num_iter
+
+    return timings
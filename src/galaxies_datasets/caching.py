@@ -0,0 +1,337 @@
+"""Bounded cache of decoded images, shared across epochs.
+
+``tf.data.Dataset.cache`` keeps either every decoded image or none of them.
+An :class:`ImageCache` keeps as many as fit in a memory budget, and
+optionally more in a local disk directory, keyed by example, so that each
+cached image is decoded only once::
+
+    cache = caching.ImageCache(memory_bytes=16 * 1024**3, spill_dir="/scratch/gzd")
+    ds = pipelines.galaxy_zoo_decals(image_cache=cache)
+    ...
+    print(cache.stats())
+
+Both tiers evict with CLOCK, but a new image only replaces the CLOCK victim
+if it was looked up clearly more often, so that repeated scans larger than the
+budget keep a stable set of images and hit in proportion to the cached
+fraction, instead of evicting every image before its reuse.
+"""
+import collections
+import hashlib
+import os
+import pathlib
+import shutil
+import threading
+from typing import Counter
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+
+from galaxies_datasets import codecs
+
+Key = Union[bytes, str, int]
+
+
+class Spill(NamedTuple):
+    """File of the disk tier to write, or to remove if image is None."""
+
+    key: Key
+    version: int
+    image: Optional[np.ndarray]
+
+
+class CacheStats(NamedTuple):
+    """Counters of an image cache."""
+
+    hits: int
+    disk_hits: int
+    misses: int
+    evictions: int
+    memory_bytes: int
+    disk_bytes: int
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of the lookups served from memory or disk."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def __str__(self) -> str:
+        """Human readable summary."""
+        return (
+            f"{self.hit_rate:.1%} hit rate ({self.hits} memory hits, "
+            f"{self.disk_hits} disk hits, {self.misses} misses), "
+            f"{self.memory_bytes / 1024**2:.1f} MB in memory, "
+            f"{self.disk_bytes / 1024**2:.1f} MB on disk"
+        )
+
+
+class ClockIndex:
+    """CLOCK bookkeeping of the entries of a bounded cache tier.
+
+    Lookup counts are halved every ``10`` lookups per counted key, so that
+    admission follows changes of the working set.
+    """
+
+    def __init__(self, capacity: int):
+        """Track entries up to ``capacity`` bytes."""
+        self.capacity = capacity
+        self.size = 0
+        self.frequencies: Counter = collections.Counter()
+        self._lookups = 0
+        self._keys: List[Optional[Key]] = []
+        self._referenced: List[bool] = []
+        self._positions: Dict[Key, int] = {}
+        self._sizes: Dict[Key, int] = {}
+        self._free: List[int] = []
+        self._hand = 0
+
+    def __contains__(self, key: Key) -> bool:
+        """Whether an entry is tracked."""
+        return key in self._positions
+
+    def record(self, key: Key) -> None:
+        """Count a lookup of a key, cached or not."""
+        self.frequencies[key] += 1
+        self._lookups += 1
+        if self._lookups >= 10 * len(self.frequencies):
+            self.frequencies = collections.Counter(
+                {k: n // 2 for k, n in self.frequencies.items() if n > 1}
+            )
+            self._lookups = 0
+
+    def touch(self, key: Key) -> None:
+        """Mark an entry as used."""
+        self._referenced[self._positions[key]] = True
+
+    def admit(self, key: Key, size: int) -> Tuple[bool, List[Key]]:
+        """Make room for a new entry, returning whether it was admitted.
+
+        The hand clears the marks of the used entries it passes and stops at
+        the first unused one, which is evicted if the new entry was looked up
+        at least twice more. Keys read once per epoch in any order differ by
+        at most one lookup, so the cached ones stay. Otherwise the new entry
+        is not admitted. Also returns the evicted keys.
+        """
+        evicted: List[Key] = []
+        if size > self.capacity:
+            return False, evicted
+
+        while self.size + size > self.capacity:
+            position = self._hand
+            victim = self._keys[position]
+            if victim is not None and self._referenced[position]:
+                self._referenced[position] = False
+            elif victim is not None:
+                if self.frequencies[key] <= self.frequencies[victim] + 1:
+                    return False, evicted
+                evicted.append(victim)
+                self._remove(victim)
+            self._hand = (position + 1) % len(self._keys)
+
+        self._insert(key, size)
+        return True, evicted
+
+    def _remove(self, key: Key) -> None:
+        position = self._positions.pop(key)
+        self.size -= self._sizes.pop(key)
+        self._keys[position] = None
+        self._free.append(position)
+
+    def _insert(self, key: Key, size: int) -> None:
+        if self._free:
+            position = self._free.pop()
+            self._keys[position] = key
+            self._referenced[position] = True
+        else:
+            position = len(self._keys)
+            self._keys.append(key)
+            self._referenced.append(True)
+        self._positions[key] = position
+        self._sizes[key] = size
+        self.size += size
+
+
+class ImageCache:
+    """Decoded images in a memory tier and an optional disk tier.
+
+    Images evicted from or not admitted to memory are written as ``.npy``
+    files to ``spill_dir``, up to ``disk_bytes``. Thread safe: the lock only
+    guards the bookkeeping, images are decoded, written and read back outside
+    of it. Cached images are read-only.
+    """
+
+    def __init__(
+        self,
+        memory_bytes: int,
+        spill_dir: Optional[Union[str, pathlib.Path]] = None,
+        disk_bytes: Optional[int] = None,
+    ):
+        """Set the budgets of the tiers, the disk one unbounded by default."""
+        self._memory: Dict[Key, np.ndarray] = {}
+        self._memory_index = ClockIndex(memory_bytes)
+        self._spill_dir = None if spill_dir is None else pathlib.Path(spill_dir)
+        self._disk_index: Optional[ClockIndex] = None
+        if self._spill_dir is not None:
+            self._spill_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_index = ClockIndex(
+                disk_bytes if disk_bytes is not None else np.iinfo(np.int64).max
+            )
+        # every spill of a key gets its own file, so that removing an evicted
+        # file never removes the one of a later spill
+        self._versions: Dict[Key, int] = {}
+        self._next_version = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _spill_path(self, key: Key, version: int) -> pathlib.Path:
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return self._spill_dir / f"{name}.{version}.npy"  # type: ignore
+
+    def get(self, key: Key) -> Optional[np.ndarray]:
+        """Cached image of an example, or None."""
+        with self._lock:
+            self._memory_index.record(key)
+            if self._disk_index is not None:
+                self._disk_index.record(key)
+            if key in self._memory_index:
+                self._memory_index.touch(key)
+                self._hits += 1
+                return self._memory[key]
+            if self._disk_index is None or key not in self._disk_index:
+                self._misses += 1
+                return None
+
+            self._disk_index.touch(key)
+            path = self._spill_path(key, self._versions[key])
+
+        try:
+            image = np.load(path)
+        except (OSError, ValueError):  # not written yet, or evicted meanwhile
+            with self._lock:
+                self._misses += 1
+            return None
+
+        image.flags.writeable = False
+        with self._lock:
+            self._disk_hits += 1
+            if key in self._memory_index:
+                return image
+            spills = self._store_in_memory(key, image)
+        self._write_spills(spills)
+        return image
+
+    def put(self, key: Key, image: np.ndarray) -> None:
+        """Cache the image of an example, if there is room for it."""
+        image = image.view()
+        image.flags.writeable = False
+        with self._lock:
+            if key in self._memory_index:
+                return
+            spills = self._store_in_memory(key, image)
+        self._write_spills(spills)
+
+    def _store_in_memory(self, key: Key, image: np.ndarray) -> List[Spill]:
+        """Admit an image to memory, returning the files to write or remove."""
+        spills: List[Spill] = []
+        admitted, evicted = self._memory_index.admit(key, image.nbytes)
+        self._evictions += len(evicted)
+        for victim in evicted:
+            self._spill(victim, self._memory.pop(victim), spills)
+        if admitted:
+            self._memory[key] = image
+        else:
+            self._spill(key, image, spills)
+
+        return spills
+
+    def _spill(self, key: Key, image: np.ndarray, spills: List[Spill]) -> None:
+        """Reserve room on disk for an image, adding its file to the spills."""
+        if self._disk_index is None or key in self._disk_index:
+            return
+        admitted, evicted = self._disk_index.admit(key, image.nbytes)
+        for victim in evicted:
+            spills.append(Spill(victim, self._versions.pop(victim), None))
+        if admitted:
+            self._next_version += 1
+            self._versions[key] = self._next_version
+            spills.append(Spill(key, self._next_version, image))
+
+    def _write_spills(self, spills: List[Spill]) -> None:
+        """Write and remove spilled files, outside the lock.
+
+        Files are written under a temporary name and renamed, so that readers
+        never see them partially written. A file whose key was evicted while
+        it was written is removed again.
+        """
+        for key, version, image in spills:
+            path = self._spill_path(key, version)
+            if image is None:
+                path.unlink(missing_ok=True)
+                continue
+
+            tmp_path = path.with_suffix(".tmp")
+            try:
+                with open(tmp_path, "wb") as f:
+                    np.save(f, image)
+                os.replace(tmp_path, path)
+            except OSError:  # cleared meanwhile
+                continue
+            with self._lock:
+                current = self._versions.get(key) == version
+            if not current:
+                path.unlink(missing_ok=True)
+
+    def decode(self, key, image) -> np.ndarray:
+        """Decoded image of an example, from the cache or decoded and cached.
+
+        ``image`` holds encoded bytes, or an array of them for sequences of
+        images.
+        """
+        key = key.item() if isinstance(key, np.generic) else key
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        if isinstance(image, np.ndarray) and image.dtype == object:
+            decoded = np.stack([codecs.decode_image(x) for x in image])
+        else:
+            decoded = codecs.decode_image(image)
+        decoded.flags.writeable = False
+        self.put(key, decoded)
+        return decoded
+
+    def stats(self) -> CacheStats:
+        """Current counters."""
+        with self._lock:
+            return CacheStats(
+                self._hits,
+                self._disk_hits,
+                self._misses,
+                self._evictions,
+                self._memory_index.size,
+                0 if self._disk_index is None else self._disk_index.size,
+            )
+
+    def reset_stats(self) -> None:
+        """Reset the hit and miss counters, e.g. at the start of an epoch."""
+        with self._lock:
+            self._hits = self._disk_hits = self._misses = self._evictions = 0
+
+    def clear(self) -> None:
+        """Drop every cached image, removing the spilled files."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_index = ClockIndex(self._memory_index.capacity)
+            self._versions.clear()
+            if self._disk_index is not None:
+                shutil.rmtree(self._spill_dir)  # type: ignore
+                self._spill_dir.mkdir(parents=True)  # type: ignore
+                self._disk_index = ClockIndex(self._disk_index.capacity)
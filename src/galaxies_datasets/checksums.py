@@ -0,0 +1,334 @@
+"""Checksums of the manually downloaded files, verified in parallel.
+
+Builders take a ``verify_checksums`` option that checks the files in
+``manual_dir`` before generating any example, against the builder's
+``checksums.tsv`` and a ``checksums.tsv`` registered next to the files::
+
+    checksums.register("~/tensorflow_datasets/downloads/manual/galaxy_zoo_2")
+    builder = tfds.builder("galaxy_zoo2", verify_checksums=True)
+
+Only the files read by the config are checked, and the registered checksums
+must agree with the published ones. Files are hashed in chunks by a pool of
+processes, largest first and small files in batches, and their digests are
+cached by path, size and modification time, so that only new or modified files
+are hashed again.
+"""
+import concurrent.futures
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import pathlib
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+CHECKSUMS_FILE = "checksums.tsv"
+CHUNK_SIZE = 8 * 1024**2
+# files hashed by a single task of the pool, up to this many bytes
+BATCH_BYTES = 64 * 1024**2
+CACHE_PATH = (
+    pathlib.Path(os.environ.get("XDG_CACHE_HOME", "~/.cache")).expanduser()
+    / "galaxies_datasets"
+    / "checksums.json"
+)
+
+PathLike = Union[str, os.PathLike]
+# file name relative to the data directory: (size, sha256)
+Checksums = Dict[str, Tuple[int, str]]
+
+
+def file_digest(path: PathLike, chunk_size: int = CHUNK_SIZE) -> str:
+    """Hex sha256 of a file, read in chunks.
+
+    sha256 hashes the chunks of a file in order, so a file is hashed by a
+    single process, but the next chunk of a large file is read by a thread
+    while the previous one is hashed, overlapping reads and hashing.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        chunk = f.read(chunk_size)
+        if len(chunk) < chunk_size:
+            digest.update(chunk)
+            return digest.hexdigest()
+
+        with concurrent.futures.ThreadPoolExecutor(1) as reader:
+            while chunk:
+                next_chunk = reader.submit(f.read, chunk_size)
+                digest.update(chunk)
+                chunk = next_chunk.result()
+
+    return digest.hexdigest()
+
+
+def file_digests(paths: List[pathlib.Path]) -> List[str]:
+    """Hex sha256 of several files, hashed by a single task of the pool."""
+    return [file_digest(path) for path in paths]
+
+
+def batch_files(
+    paths: List[pathlib.Path], sizes: List[int], batch_bytes: int = BATCH_BYTES
+) -> List[List[pathlib.Path]]:
+    """Group files in order into batches of about ``batch_bytes``.
+
+    Large files get a batch of their own, and small ones share one, so that
+    each task of the pool is worth its round trip.
+    """
+    batches: List[List[pathlib.Path]] = []
+    batch_size = batch_bytes
+    for path, size in zip(paths, sizes):
+        if batch_size + size > batch_bytes:
+            batches.append([])
+            batch_size = 0
+        batches[-1].append(path)
+        batch_size += size
+
+    return batches
+
+
+def read_checksums(path: PathLike) -> Checksums:
+    """Read a tensorflow_datasets ``checksums.tsv``, empty if it is missing.
+
+    Lines hold the url, size, sha256 and file name of a file, separated by
+    tabs. The file name defaults to the last part of the url.
+    """
+    checksums: Checksums = {}
+    if not os.path.exists(path):
+        return checksums
+
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            url, size, sha256, *filename = line.split("\t")
+            name = filename[0] if filename else url.rsplit("/", 1)[-1]
+            checksums[name] = (int(size), sha256)
+
+    return checksums
+
+
+def write_checksums(path: PathLike, checksums: Checksums) -> None:
+    """Write a ``checksums.tsv`` of local files, using their names as urls."""
+    with open(path, "w") as f:
+        for name, (size, sha256) in sorted(checksums.items()):
+            f.write(f"{name}\t{size}\t{sha256}\t{name}\n")
+
+
+def _load_cache(path: pathlib.Path) -> Dict[str, List]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(path: pathlib.Path, cache: Dict[str, List]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, path)
+
+
+def digests(
+    paths: Iterable[PathLike],
+    cache_path: Optional[PathLike] = CACHE_PATH,
+    jobs: Optional[int] = None,
+) -> Dict[pathlib.Path, str]:
+    """Sha256 of every file, hashing in parallel those not cached.
+
+    Args:
+        paths: files to hash.
+        cache_path: JSON file caching the digests by absolute path, size and
+            modification time, or None not to cache them.
+        jobs: number of processes, by default one per CPU.
+    """
+    cache = {} if cache_path is None else _load_cache(pathlib.Path(cache_path))
+    result = {}
+    missing = []
+    for path in map(pathlib.Path, paths):
+        stat = path.stat()
+        key = str(path.resolve())
+        cached = cache.get(key)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            result[path] = cached[2]
+        else:
+            missing.append((path, key, stat))
+
+    # largest first, so that a large file hashed last does not hold the pool
+    missing.sort(key=lambda item: item[2].st_size, reverse=True)
+    if len(missing) > 1 and jobs != 1:
+        batches = batch_files(
+            [path for path, _, _ in missing], [stat.st_size for _, _, stat in missing]
+        )
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(jobs, mp_context=context) as pool:
+            hashed = [
+                digest for batch in pool.map(file_digests, batches) for digest in batch
+            ]
+    else:
+        hashed = [file_digest(path) for path, _, _ in missing]
+
+    for (path, key, stat), digest in zip(missing, hashed):
+        result[path] = digest
+        cache[key] = [stat.st_size, stat.st_mtime_ns, digest]
+    if missing and cache_path is not None:
+        _save_cache(pathlib.Path(cache_path), cache)
+
+    return result
+
+
+def verify(
+    data_path: PathLike,
+    checksums: Checksums,
+    cache_path: Optional[PathLike] = CACHE_PATH,
+    jobs: Optional[int] = None,
+) -> None:
+    """Check the files of a directory against their sizes and checksums.
+
+    Sizes are checked first, so that truncated files are not hashed.
+
+    Raises:
+        ValueError: listing the missing and mismatching files.
+    """
+    data_path = pathlib.Path(data_path).expanduser()
+    problems = []
+    to_hash = {}
+    for name, (size, sha256) in sorted(checksums.items()):
+        path = data_path / name
+        if not path.is_file():
+            problems.append(f"{name}: missing")
+        elif path.stat().st_size != size:
+            problems.append(f"{name}: {path.stat().st_size} bytes, expected {size}")
+        else:
+            to_hash[path] = (name, sha256)
+
+    for path, digest in digests(to_hash, cache_path, jobs).items():
+        name, sha256 = to_hash[path]
+        if digest != sha256:
+            problems.append(f"{name}: sha256 {digest}, expected {sha256}")
+
+    if problems:
+        raise ValueError(
+            f"Files in {data_path} do not match their checksums:\n"
+            + "\n".join(sorted(problems))
+        )
+
+
+def select_checksums(
+    checksums: Checksums, data_path: PathLike, paths: Iterable[PathLike]
+) -> Checksums:
+    """Checksums of the files at or under the given paths of a data directory.
+
+    Paths are under ``data_path``, or relative to it.
+    """
+    data_path = pathlib.Path(data_path).expanduser()
+    prefixes = []
+    for path in map(pathlib.Path, paths):
+        if data_path in path.parents:
+            path = path.relative_to(data_path)
+        prefixes.append(path.as_posix())
+
+    return {
+        name: value
+        for name, value in checksums.items()
+        if any(name == prefix or name.startswith(f"{prefix}/") for prefix in prefixes)
+    }
+
+
+def register(
+    data_path: PathLike,
+    pattern: str = "**/*",
+    cache_path: Optional[PathLike] = CACHE_PATH,
+    jobs: Optional[int] = None,
+) -> Checksums:
+    """Record the checksums of the files of a directory in its checksums.tsv.
+
+    Run once the downloaded files are known to be intact, e.g. after
+    extracting the archives, so that later preparations verify them.
+    """
+    data_path = pathlib.Path(data_path).expanduser()
+    paths = [
+        path
+        for path in data_path.glob(pattern)
+        if path.is_file() and path.name != CHECKSUMS_FILE
+    ]
+    checksums = {
+        path.relative_to(data_path).as_posix(): (path.stat().st_size, digest)
+        for path, digest in digests(paths, cache_path, jobs).items()
+    }
+    write_checksums(data_path / CHECKSUMS_FILE, checksums)
+    return checksums
+
+
+class ChecksumMixin:
+    """Builder option verifying the manually downloaded files.
+
+    With ``verify_checksums``, :meth:`_verify_checksums` checks the files
+    read by the config against the ``checksums.tsv`` of the builder, holding
+    the published checksums, and the one of the data directory, written by
+    :func:`register`.
+    """
+
+    def __init__(
+        self,
+        *,
+        verify_checksums: bool = False,
+        checksum_jobs: Optional[int] = None,
+        checksum_cache: Optional[PathLike] = CACHE_PATH,
+        **kwargs,
+    ):
+        """Set the checksum options."""
+        super().__init__(**kwargs)  # type: ignore
+        self._checksum_verify = verify_checksums
+        self._checksum_jobs = checksum_jobs
+        self._checksum_cache = checksum_cache
+
+    def _verify_checksums(
+        self, data_path: PathLike, paths: Optional[Iterable[PathLike]] = None
+    ) -> None:
+        """Check the manually downloaded files, if asked to.
+
+        Only the files at or under ``paths``, by default every listed file,
+        are checked.
+
+        Raises:
+            ValueError: if there is nothing to check, if the registered
+                checksums disagree with the published ones, or if the files
+                do not match them.
+        """
+        if not self._checksum_verify:
+            return
+
+        builder_path = pathlib.Path(inspect.getfile(type(self))).parent
+        published = read_checksums(builder_path / CHECKSUMS_FILE)
+        registered = read_checksums(pathlib.Path(data_path) / CHECKSUMS_FILE)
+        if paths is not None:
+            paths = list(paths)
+            published = select_checksums(published, data_path, paths)
+            registered = select_checksums(registered, data_path, paths)
+
+        conflicts = sorted(
+            name
+            for name in published.keys() & registered.keys()
+            if published[name] != registered[name]
+        )
+        if conflicts:
+            raise ValueError(
+                f"Checksums registered in {data_path} disagree with the published "
+                "ones of:\n" + "\n".join(conflicts)
+            )
+
+        checksums = {**published, **registered}
+        if not checksums:
+            raise ValueError(
+                f"No checksums to verify {data_path} against, record them with "
+                "galaxies_datasets.checksums.register"
+            )
+
+        verify(data_path, checksums, self._checksum_cache, self._checksum_jobs)
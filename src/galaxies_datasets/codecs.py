@@ -0,0 +1,227 @@
+"""Storage codecs for the images of the prepared datasets.
+
+- ``png``: lossless.
+- ``jpeg``: lossy, with a configurable quality.
+- ``webp``: lossless WebP.
+- ``raw``: uncompressed uint8 tensors, which need no decoding at all.
+
+Builder configs take a ``codec``, ``None`` storing the source files unchanged.
+Use :func:`with_codec` to derive a config storing images in another codec.
+"""
+import dataclasses
+import io
+import time
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_datasets as tfds
+from PIL import Image as PILImage
+
+CODECS = ("png", "jpeg", "webp", "raw")
+DEFAULT_QUALITY = 95
+
+
+_PIL_MODES = {1: "L", 3: "RGB", 4: "RGBA"}
+
+
+def _decode_with_pil(data, channels) -> np.ndarray:
+    """Decode an encoded image, given as bytes or a numpy scalar, with Pillow."""
+    if isinstance(data, np.ndarray):
+        data = data.item()
+    image = PILImage.open(io.BytesIO(data)).convert(_PIL_MODES[int(channels)])
+    return np.asarray(image).reshape(image.height, image.width, int(channels))
+
+
+class WebPImage(tfds.features.Image):
+    """Image feature stored as WebP.
+
+    Images are decoded by ``tf.io.decode_webp`` where TensorFlow has it (2.20
+    and later), and by Pillow otherwise.
+    """
+
+    def decode_example(self, example):
+        """Decode the single frame of a WebP image."""
+        channels = self.shape[-1]
+        if hasattr(tf.io, "decode_webp"):
+            image = tf.io.decode_webp(example, channels=channels)[0]
+        else:
+            image = tf.numpy_function(
+                _decode_with_pil, [example, channels], tf.uint8, stateful=False
+            )
+        image.set_shape(self.shape)
+        return image
+
+
+def feature_dtype(feature: tfds.features.FeatureConnector) -> tf.DType:
+    """Get the TensorFlow dtype of a feature, across tensorflow_datasets versions."""
+    if hasattr(feature, "tf_dtype"):
+        return feature.tf_dtype
+
+    return feature.dtype
+
+
+def image_feature(
+    shape: Tuple[int, int, int], codec: Optional[str] = None
+) -> tfds.features.FeatureConnector:
+    """Feature storing images with a codec."""
+    if codec is None:
+        return tfds.features.Image(shape=shape)
+    if codec in ("png", "jpeg"):
+        return tfds.features.Image(shape=shape, encoding_format=codec)
+    if codec == "webp":
+        return WebPImage(shape=shape)
+    if codec == "raw":
+        return tfds.features.Tensor(shape=shape, dtype=tf.uint8)
+
+    raise ValueError(f"Unknown codec {codec!r}, expected one of {CODECS}")
+
+
+def is_image_feature(feature: tfds.features.FeatureConnector) -> bool:
+    """Whether a feature holds images, alone or in a sequence, in any codec."""
+    if isinstance(feature, tfds.features.Sequence):
+        feature = feature.feature
+    if isinstance(feature, tfds.features.Image):
+        return True
+
+    return (
+        isinstance(feature, tfds.features.Tensor)
+        and len(feature.shape) == 3
+        and feature.shape[-1] in (1, 3, 4)
+        and feature_dtype(feature) == tf.uint8
+    )
+
+
+def is_encoded(feature: tfds.features.FeatureConnector) -> bool:
+    """Whether an image feature needs decoding, so it can skip decoding."""
+    if isinstance(feature, tfds.features.Sequence):
+        feature = feature.feature
+
+    return isinstance(feature, tfds.features.Image)
+
+
+def decode_image(image) -> np.ndarray:
+    """Decode an image, given as a path, file object, bytes or array, to RGB.
+
+    File objects are read from their current position, which is restored.
+    """
+    if isinstance(image, np.ndarray):
+        return image
+
+    if isinstance(image, bytes):
+        data = image
+    elif hasattr(image, "read"):
+        position = image.tell()
+        data = image.read()
+        image.seek(position)
+    else:
+        with tf.io.gfile.GFile(image, "rb") as f:
+            data = f.read()
+
+    return np.asarray(PILImage.open(io.BytesIO(data)).convert("RGB"))
+
+
+def encode_image(
+    image,
+    codec: Optional[str] = None,
+    source_format: Optional[str] = None,
+    quality: int = DEFAULT_QUALITY,
+):
+    """Encode an image, given as a path, file object, bytes or array.
+
+    Images already in the ``source_format`` of the requested codec, or with no
+    codec, are returned unchanged.
+    """
+    if codec is None or codec == source_format:
+        return image
+
+    pil_image = PILImage.fromarray(decode_image(image))
+
+    if codec == "raw":
+        return np.asarray(pil_image)
+
+    buffer = io.BytesIO()
+    if codec == "png":
+        pil_image.save(buffer, format="PNG")
+    elif codec == "jpeg":
+        pil_image.save(buffer, format="JPEG", quality=quality)
+    elif codec == "webp":
+        pil_image.save(buffer, format="WEBP", lossless=True)
+    else:
+        raise ValueError(f"Unknown codec {codec!r}, expected one of {CODECS}")
+
+    return buffer.getvalue()
+
+
+def with_codec(
+    config: tfds.core.BuilderConfig,
+    codec: str,
+    quality: int = DEFAULT_QUALITY,
+) -> tfds.core.BuilderConfig:
+    """Derive a builder config storing its images with another codec.
+
+    For instance ``tfds.builder("eagle", config=with_codec(config, "webp"))``.
+    """
+    name = f"{config.name}_{codec}"
+    if codec == "jpeg":
+        name = f"{name}{quality}"
+
+    return dataclasses.replace(config, name=name, codec=codec, quality=quality)
+
+
+class CodecReport(NamedTuple):
+    """Storage size and decoding throughput of a codec."""
+
+    codec: str
+    bytes_per_image: float
+    images_per_second: float
+
+
+def benchmark(
+    images: Sequence[np.ndarray],
+    codecs: Sequence[str] = CODECS,
+    quality: int = DEFAULT_QUALITY,
+    num_iter: int = 3,
+) -> List[CodecReport]:
+    """Compare the size on disk and the decoding throughput of codecs.
+
+    Images are serialized as they would be in the prepared records, and
+    decoded in parallel by tf.data, as when reading a dataset.
+    """
+    reports = []
+    for codec in codecs:
+        features = tfds.features.FeaturesDict(
+            {"image": image_feature(images[0].shape, codec)}
+        )
+        records = [
+            features.serialize_example(
+                {"image": encode_image(image, codec, quality=quality)}
+            )
+            for image in images
+        ]
+        ds = (
+            tf.data.Dataset.from_tensor_slices(records)
+            .map(features.deserialize_example, num_parallel_calls=tf.data.AUTOTUNE)
+            .batch(len(records))
+        )
+
+        next(iter(ds))  # warm up
+        start = time.perf_counter()
+        for _ in range(num_iter):
+            for _ in ds:
+                pass
+        seconds = time.perf_counter() - start
+
+        reports.append(
+            CodecReport(
+                codec,
+                float(np.mean([len(r) for r in records])),
+                len(records) * num_iter / seconds,
+            )
+        )
+
+    return reports
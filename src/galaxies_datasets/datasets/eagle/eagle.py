@@ -1,9 +1,29 @@
 """eagle dataset."""
+import contextlib
 import csv
+import dataclasses
+import hashlib
+import io
+import itertools
+import json
+from typing import Optional
+from typing import Tuple
 
+import numpy as np
+import pandas as pd
 import tensorflow as tf
 import tensorflow_datasets as tfds
 
+from galaxies_datasets import checksums
+from galaxies_datasets import codecs
+from galaxies_datasets import distributed
+from galaxies_datasets import eagle_columns
+from galaxies_datasets import shards
+from galaxies_datasets import sidecar
+from galaxies_datasets import splits
+from galaxies_datasets import stats
+from galaxies_datasets import subsets
+
 _DESCRIPTION = """
 This dataset contains mock galaxy images generated from the [EAGLE collection of
 hydrodynamic cosmological simulations](http://icc.dur.ac.uk/Eagle/).
@@ -23,6 +43,17 @@ Available simulations are:
 - RefL0025N0752
 - RefL0025N0376
 - RecalL0025N0752
+
+Datasets containing a single orientation are available as `eagle/simulation_box`,
+`eagle/simulation_edge` and `eagle/simulation_face` (e.g.
+`eagle/RefL0100N1504_face`), so that only the needed images are stored and
+decoded. `eagle/simulation_stacked` stores the three orientations (box, edge and
+face) as a single `Images` feature decoded to a (3, 256, 256, 3) tensor, for
+multi-view models.
+
+Preparing a dataset also writes an index of the merger tree links of each
+galaxy, from which `ProgenitorIndex` reads the images of a galaxy across
+snapshots without scanning the dataset.
 """
 
 _CITATION = """
@@ -82,7 +113,205 @@ _CITATION = """
 """
 
 
-class Eagle(tfds.core.GeneratorBasedBuilder):
+_SIMULATIONS = [
+    "RefL0100N1504",
+    "RefL0025N0752",
+    "RefL0025N0376",
+    "RecalL0025N0752",
+]
+
+# image filename prefix of each orientation
+_ORIENTATIONS = {
+    "box": "galrand",
+    "edge": "galedge",
+    "face": "galface",
+}
+
+PROGENITOR_INDEX = "progenitors.parquet"
+
+
+@contextlib.contextmanager
+def image_loader(images_path):
+    """Yield a function mapping image filenames to encodable images.
+
+    Images are read from indexed tar shards when present, otherwise from loose
+    files.
+    """
+    if shards.has_shards(images_path):
+        with shards.ShardReader(images_path) as reader:
+            yield reader.open
+    else:
+        yield lambda filename: images_path / filename
+
+
+def snapshot_fingerprint(snap_path) -> str:
+    """Fingerprint a snapshot directory from the size and mtime of its files."""
+    images_path = snap_path / "images"
+    paths = [snap_path / "data.csv"]
+    if tf.io.gfile.isdir(images_path):
+        paths += [
+            images_path / name for name in sorted(tf.io.gfile.listdir(images_path))
+        ]
+
+    fingerprint = hashlib.sha256()
+    for path in paths:
+        stat = tf.io.gfile.stat(path)
+        fingerprint.update(f"{path.name}:{stat.length}:{stat.mtime_nsec}\n".encode())
+
+    return fingerprint.hexdigest()
+
+
+def snapshot_paths(path):
+    """Snapshot directories of a simulation, skipping files such as checksums."""
+    return [snap_path for snap_path in path.iterdir() if snap_path.is_dir()]
+
+
+def read_snapshot_fingerprints(data_dir) -> dict:
+    """Read the snapshot fingerprints of a prepared dataset."""
+    if data_dir is None:
+        return {}
+    metadata_path = data_dir / "metadata.json"
+    if not tf.io.gfile.exists(metadata_path):
+        return {}
+    with tf.io.gfile.GFile(metadata_path, "r") as f:
+        metadata = json.load(f)
+
+    return metadata.get("snapshot_fingerprints", {})
+
+
+def snapshot_rows(snap_paths):
+    """Yield the GalaxyID, snapshot directory and row of the galaxies with images.
+
+    Rows are yielded one snapshot after the other.
+    """
+    for snap_path in snap_paths:
+        with tf.io.gfile.GFile(snap_path / "data.csv", "r") as f:
+            for row in csv.DictReader(f):
+                if int(row["Image_ID"]) != -1:
+                    yield row["GalaxyID"], snap_path, row
+
+
+def previous_rows(data_dir, snapshots):
+    """Yield the GalaxyID, shard, offset and row of examples of a preparation.
+
+    Only the examples of the given snapshots are read, from the sidecars of
+    every split, with their rows holding the catalogue fields as strings.
+    """
+    if not snapshots:
+        return
+
+    for split in tfds.builder_from_directory(data_dir).info.splits:
+        df = pd.read_parquet(sidecar.get_sidecar_path(data_dir, split))
+        df = df[df["Snapshot"].isin(snapshots)]
+        # numpy columns, so that sizes are formatted as float32 like the records
+        columns = {k: df[k].to_numpy() for k in df.columns}
+        for i, galaxy_id in enumerate(map(str, columns["GalaxyID"])):
+            row = {
+                "GalaxyID": galaxy_id,
+                "SnapNum": str(columns["Snapshot"][i]),
+                **{k: str(columns[f"Sizes/{k}"][i]) for k in eagle_columns.SIZES},
+            }
+            yield (
+                galaxy_id,
+                columns[sidecar.SHARD_COLUMN][i],
+                int(columns[sidecar.OFFSET_COLUMN][i]),
+                row,
+            )
+
+
+def read_tree_links(path) -> pd.DataFrame:
+    """Read the merger tree links of the galaxies of every downloaded snapshot.
+
+    Snapshots downloaded without the links have missing values.
+    """
+    frames = []
+    for snap_path in snapshot_paths(path):
+        with tf.io.gfile.GFile(snap_path / "data.csv", "r") as f:
+            try:
+                frames.append(
+                    pd.read_csv(
+                        f,
+                        usecols=lambda c: c in ["GalaxyID", *eagle_columns.TREE_LINKS],
+                    )
+                )
+            except pd.errors.EmptyDataError:
+                continue
+
+    links = pd.concat(frames) if frames else pd.DataFrame()
+    return links.reindex(columns=["GalaxyID", *eagle_columns.TREE_LINKS])
+
+
+def write_progenitor_index(data_path, info, path) -> None:
+    """Write the progenitor index of a prepared dataset.
+
+    The index has a row per example, sorted by GalaxyID, with its snapshot,
+    merger tree links, split and record location from the sidecars.
+    """
+    locations = [
+        pd.read_parquet(
+            sidecar.get_sidecar_path(data_path, split),
+            columns=[
+                "GalaxyID",
+                "Snapshot",
+                sidecar.SHARD_COLUMN,
+                sidecar.OFFSET_COLUMN,
+            ],
+        ).assign(split=split)
+        for split in info.splits
+    ]
+    links = read_tree_links(path).astype({"GalaxyID": "int64"})
+    index = pd.concat(locations).merge(links, on="GalaxyID", how="left")
+    index = index.drop_duplicates("GalaxyID").sort_values("GalaxyID")
+    index.to_parquet(data_path / PROGENITOR_INDEX, index=False)
+
+
+@dataclasses.dataclass
+class EagleConfig(tfds.core.BuilderConfig):
+    """Config for a single EAGLE simulation."""
+
+    simulation: str = "RefL0100N1504"
+    orientations: Tuple[str, ...] = tuple(_ORIENTATIONS)
+    stacked: bool = False
+    codec: Optional[str] = "png"
+    quality: int = codecs.DEFAULT_QUALITY
+
+
+def builder_configs():
+    """Compose the configs of every simulation."""
+    configs = []
+    for simulation in _SIMULATIONS:
+        configs.append(EagleConfig(name=simulation, simulation=simulation))
+        for orientation in _ORIENTATIONS:
+            configs.append(
+                EagleConfig(
+                    name=f"{simulation}_{orientation}",
+                    simulation=simulation,
+                    orientations=(orientation,),
+                )
+            )
+        configs.append(
+            EagleConfig(
+                name=f"{simulation}_stacked", simulation=simulation, stacked=True
+            )
+        )
+
+    return configs
+
+
+def image_feature(codec="png"):
+    """Feature of a single image."""
+    return codecs.image_feature((256, 256, 3), codec)
+
+
+class Eagle(
+    sidecar.SidecarMixin,
+    splits.HashSplitsMixin,
+    subsets.SubsetMixin,
+    stats.StatisticsMixin,
+    checksums.ChecksumMixin,
+    distributed.ShardLayoutMixin,
+    tfds.core.GeneratorBasedBuilder,
+):
     """DatasetBuilder for eagle dataset."""
 
     VERSION = tfds.core.Version("1.0.0")
@@ -100,15 +329,62 @@ class Eagle(tfds.core.GeneratorBasedBuilder):
     For more information and additional options run:
 
         galaxies_datasets eagle download --help
+
+    Use the `--shards` option to pack images into indexed tar shards instead of
+    one file per image.
     """
 
-    BUILDER_CONFIGS = [
-        # `name` (and optionally `description`) are required for each config
-        tfds.core.BuilderConfig(name="RefL0100N1504"),
-        tfds.core.BuilderConfig(name="RefL0025N0752"),
-        tfds.core.BuilderConfig(name="RefL0025N0376"),
-        tfds.core.BuilderConfig(name="RecalL0025N0752"),
-    ]
+    STATISTICS_QUANTILES = (r"Sizes/.*",)
+
+    BUILDER_CONFIGS = builder_configs()
+
+    def __init__(self, *, previous_data_dir=None, **kwargs):
+        """Builder constructor.
+
+        When preparing the dataset again after downloading new snapshots, the
+        snapshots whose files are unchanged since a previous preparation are
+        copied from its records, keeping images encoded, instead of being read
+        and encoded again from `manual_dir`.
+
+        This is a full copy, not an update in place: every shard of the new
+        preparation is written anew, holding the copied records along with
+        the new ones, and the previous preparation is left as is. Only the
+        reading and encoding of the unchanged images is saved.
+
+        Args:
+            previous_data_dir: directory of a previously prepared dataset of the
+                same config, e.g. `~/tensorflow_datasets/eagle/RefL0100N1504/1.0.0`.
+                It must differ from the one being prepared.
+            **kwargs: arguments forwarded to `tfds.core.GeneratorBasedBuilder`.
+        """
+        super().__init__(**kwargs)
+        self._previous_data_dir = None
+        if previous_data_dir is not None:
+            self._previous_data_dir = tfds.core.Path(previous_data_dir)
+
+    def _download_and_prepare(self, dl_manager, *args, **kwargs):
+        super()._download_and_prepare(dl_manager, *args, **kwargs)
+        write_progenitor_index(
+            self.data_path,
+            self.info,
+            dl_manager.manual_dir / self.builder_config.simulation,
+        )
+
+    @property
+    def image_features(self):
+        """Return the image features dictionary."""
+        orientations = self.builder_config.orientations
+        if self.builder_config.stacked:
+            return {
+                "Images": tfds.features.Sequence(
+                    image_feature(self.builder_config.codec), length=len(orientations)
+                )
+            }
+
+        return {
+            f"Image_{orientation}": image_feature(self.builder_config.codec)
+            for orientation in orientations
+        }
 
     def _info(self) -> tfds.core.DatasetInfo:
         """Returns the dataset metadata."""
@@ -119,22 +395,9 @@ class Eagle(tfds.core.GeneratorBasedBuilder):
                 {
                     # These are the features of your dataset like images, labels ...
                     "GalaxyID": tf.int64,
-                    "Image_box": tfds.features.Image(
-                        shape=(256, 256, 3), encoding_format="png"
-                    ),
-                    "Image_edge": tfds.features.Image(
-                        shape=(256, 256, 3), encoding_format="png"
-                    ),
-                    "Image_face": tfds.features.Image(
-                        shape=(256, 256, 3), encoding_format="png"
-                    ),
+                    **self.image_features,
                     "Snapshot": tfds.features.ClassLabel(num_classes=28),
-                    "Sizes": {
-                        "R_halfmass30": tf.float32,
-                        "R_halfmass100": tf.float32,
-                        "R_halfmass30_projected": tf.float32,
-                        "R_halfmass100_projected": tf.float32,
-                    },
+                    "Sizes": {k: tf.float32 for k in eagle_columns.SIZES},
                 }
             ),
             # If there's a common (input, target) tuple from the
@@ -143,41 +406,142 @@ class Eagle(tfds.core.GeneratorBasedBuilder):
             supervised_keys=None,  # Set to `None` to disable
             homepage="https://icc.dur.ac.uk/Eagle/",
             citation=_CITATION,
+            metadata=tfds.core.MetadataDict(),
         )
 
     def _split_generators(self, dl_manager: tfds.download.DownloadManager):
         """Returns SplitGenerators."""
-        path = dl_manager.manual_dir / self.builder_config.name
+        path = dl_manager.manual_dir / self.builder_config.simulation
+        self._verify_checksums(path)
+
+        previous_fingerprints = read_snapshot_fingerprints(self._previous_data_dir)
+        fingerprints = {}
+        snap_paths = []
+        reused_snapshots = set()
+        for snap_path in snapshot_paths(path):
+            fingerprint = snapshot_fingerprint(snap_path)
+            fingerprints[snap_path.name] = fingerprint
+            if previous_fingerprints.get(snap_path.name) == fingerprint:
+                reused_snapshots.add(int(snap_path.name))
+            else:
+                snap_paths.append(snap_path)
+        self.info.metadata["snapshot_fingerprints"] = fingerprints
 
+        rows = self._split_items(snapshot_rows(snap_paths))
+        reused = self._split_items(
+            previous_rows(self._previous_data_dir, reused_snapshots)
+        )
         return {
-            "train": self._generate_examples(path),
+            split: self._with_statistics(
+                split, self._generate_examples(rows[split], reused[split], split)
+            )
+            for split in self.split_names
         }
 
-    def _generate_examples(self, path):
-        """Yields examples."""
-        for snap_path in path.iterdir():
-            csv_path = snap_path / "data.csv"
-            images_path = snap_path / "images"
-            with tf.io.gfile.GFile(csv_path, "r") as f:
-                for row in csv.DictReader(f):
-                    if int(row["Image_ID"]) != -1:
-                        galaxy_id = row["GalaxyID"]
-                        image_box_path = images_path / f"galrand_{galaxy_id}.png"
-                        image_edge_path = images_path / f"galedge_{galaxy_id}.png"
-                        image_face_path = images_path / f"galface_{galaxy_id}.png"
-                        example = {
-                            "GalaxyID": galaxy_id,
-                            "Image_box": image_box_path,
-                            "Image_edge": image_edge_path,
-                            "Image_face": image_face_path,
-                            "Snapshot": row["SnapNum"],
-                            "Sizes": {
-                                "R_halfmass30": row["R_halfmass30"],
-                                "R_halfmass100": row["R_halfmass100"],
-                                "R_halfmass30_projected": row["R_halfmass30_projected"],
-                                "R_halfmass100_projected": row[
-                                    "R_halfmass100_projected"
-                                ],
-                            },
-                        }
-                        yield galaxy_id, example
+    def _generate_examples(self, rows, reused, split="train"):
+        """Yields examples, given the new and reused rows of the split."""
+        for snap_path, snap_rows in itertools.groupby(rows, key=lambda x: x[1]):
+            yield from self._generate_snapshot_examples(snap_path, snap_rows, split)
+
+        yield from self._reuse_snapshot_examples(reused, split)
+
+    def _generate_snapshot_examples(self, snap_path, rows, split="train"):
+        """Yields the examples of some rows of a single snapshot directory."""
+        images_path = snap_path / "images"
+        with image_loader(images_path) as load_image:
+            for galaxy_id, _, row in rows:
+                if not self._in_subset(galaxy_id, row, split):
+                    continue
+                images = {
+                    f"Image_{orientation}": codecs.encode_image(
+                        load_image(f"{_ORIENTATIONS[orientation]}_{galaxy_id}.png"),
+                        self.builder_config.codec,
+                        "png",
+                        self.builder_config.quality,
+                    )
+                    for orientation in self.builder_config.orientations
+                }
+                if self.builder_config.stacked:
+                    images = {"Images": list(images.values())}
+                example = {
+                    "GalaxyID": galaxy_id,
+                    **images,
+                    "Snapshot": row["SnapNum"],
+                    "Sizes": {k: row[k] for k in eagle_columns.SIZES},
+                }
+                yield galaxy_id, example
+
+    def _reuse_snapshot_examples(self, rows, split="train"):
+        """Yields the examples of some rows from the previous preparation.
+
+        Only the records of the rows are read, at their offsets, keeping their
+        images encoded.
+        """
+        rows = [item for item in rows if self._in_subset(item[0], item[3], split)]
+        if not rows:
+            return
+
+        images = [k for k, f in self.image_features.items() if codecs.is_encoded(f)]
+        ds = sidecar.load_records(
+            self._previous_data_dir,
+            self.info.features,
+            [(shard, offset) for _, shard, offset, _ in rows],
+            decoders={k: tfds.decode.SkipDecoding() for k in images},
+        )
+        for (galaxy_id, _, _, _), example in zip(rows, tfds.as_numpy(ds)):
+            for k in images:
+                if self.builder_config.stacked:
+                    example[k] = [io.BytesIO(image) for image in example[k]]
+                else:
+                    example[k] = io.BytesIO(example[k])
+            yield galaxy_id, example
+
+
+class ProgenitorIndex:
+    """Records of each galaxy of a prepared eagle dataset across snapshots.
+
+    In the EAGLE merger trees, the main progenitor branch of a galaxy is made
+    of the galaxies from its GalaxyID to its TopLeafID, one per snapshot. The
+    history of a galaxy is its main progenitor branch followed by the
+    descendants whose main branch it is on.
+
+    Example:
+        index = eagle.ProgenitorIndex("eagle/RefL0100N1504_face")
+        ds = index.load(galaxy_id)  # one example per snapshot, oldest first
+    """
+
+    def __init__(self, name: str = "eagle", data_dir: Optional[str] = None):
+        """Read the index of a prepared dataset."""
+        builder = tfds.builder(name, data_dir=data_dir)
+        self.data_path = builder.data_path
+        self.features = builder.info.features
+        self.index = pd.read_parquet(self.data_path / PROGENITOR_INDEX)
+        self._galaxy_ids = self.index["GalaxyID"].to_numpy()
+        self._top_leaf_ids = (
+            self.index["TopLeafID"].fillna(self.index["GalaxyID"]).to_numpy()
+        )
+
+    def history(self, galaxy_id: int) -> pd.DataFrame:
+        """Index rows of the history of a galaxy, oldest snapshot first."""
+        position = np.searchsorted(self._galaxy_ids, galaxy_id)
+        if position == len(self._galaxy_ids) or self._galaxy_ids[position] != galaxy_id:
+            raise KeyError(f"GalaxyID {galaxy_id} is not in the dataset")
+
+        end = np.searchsorted(
+            self._galaxy_ids, self._top_leaf_ids[position], side="right"
+        )
+        progenitors = np.zeros(len(self._galaxy_ids), dtype=bool)
+        progenitors[position:end] = True
+        descendants = (self._galaxy_ids < galaxy_id) & (self._top_leaf_ids >= galaxy_id)
+
+        return self.index[progenitors | descendants].sort_values("Snapshot")
+
+    def load(self, galaxy_id: int, decoders=None) -> tf.data.Dataset:
+        """Load the examples of the history of a galaxy, oldest snapshot first.
+
+        Only the records of the galaxy are read, at their offsets.
+        """
+        rows = self.history(galaxy_id)
+        locations = list(zip(rows[sidecar.SHARD_COLUMN], rows[sidecar.OFFSET_COLUMN]))
+
+        return sidecar.load_records(self.data_path, self.features, locations, decoders)
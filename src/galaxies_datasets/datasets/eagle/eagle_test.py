@@ -1,7 +1,14 @@
 """eagle dataset."""
+import csv
+import shutil
+from unittest import mock
+
+import numpy as np
 import tensorflow_datasets as tfds
 
 from . import eagle
+from galaxies_datasets import codecs
+from galaxies_datasets import sidecar
 
 
 class EagleTest(tfds.testing.DatasetBuilderTestCase):
@@ -13,5 +20,195 @@ class EagleTest(tfds.testing.DatasetBuilderTestCase):
     }
 
 
+class EagleStackedTest(tfds.testing.TestCase):
+    """Tests for the stacked orientations configs."""
+
+    def test_stacked_images(self):
+        """The three orientations are decoded as a single tensor."""
+        with tfds.testing.tmp_dir() as data_dir:
+            builder = eagle.Eagle(config="RefL0025N0376_stacked", data_dir=data_dir)
+            builder.download_and_prepare(
+                download_config=tfds.download.DownloadConfig(
+                    manual_dir=tfds.core.Path(eagle.__file__).parent / "dummy_data"
+                )
+            )
+            single = eagle.Eagle(config="RefL0025N0376_face", data_dir=data_dir)
+            single.download_and_prepare(
+                download_config=tfds.download.DownloadConfig(
+                    manual_dir=tfds.core.Path(eagle.__file__).parent / "dummy_data"
+                )
+            )
+            stacked = {
+                int(example["GalaxyID"]): example["Images"]
+                for example in tfds.as_numpy(builder.as_dataset(split="train"))
+            }
+            for example in tfds.as_numpy(single.as_dataset(split="train")):
+                images = stacked[int(example["GalaxyID"])]
+                self.assertEqual(images.shape, (3, 256, 256, 3))
+                self.assertAllEqual(images[2], example["Image_face"])
+                self.assertNotIn("Image_box", example)
+
+
+class EagleCodecTest(tfds.testing.TestCase):
+    """Tests for storing images with other codecs."""
+
+    def test_lossless_codecs(self):
+        """Lossless codecs store the same pixels as png."""
+        manual_dir = tfds.core.Path(eagle.__file__).parent / "dummy_data"
+        download_config = tfds.download.DownloadConfig(manual_dir=manual_dir)
+        with tfds.testing.tmp_dir() as data_dir:
+            images = {}
+            for codec in ["png", "webp", "raw"]:
+                config = codecs.with_codec(
+                    eagle.Eagle.builder_configs["RefL0025N0376_stacked"], codec
+                )
+                builder = eagle.Eagle(config=config, data_dir=data_dir)
+                builder.download_and_prepare(download_config=download_config)
+                images[codec] = {
+                    int(example["GalaxyID"]): example["Images"]
+                    for example in tfds.as_numpy(builder.as_dataset(split="train"))
+                }
+
+            for codec in ["webp", "raw"]:
+                self.assertEqual(set(images[codec]), set(images["png"]))
+                for galaxy_id, image in images[codec].items():
+                    self.assertAllEqual(image, images["png"][galaxy_id])
+
+
+def copy_snapshot(snap_path, snap_number):
+    """Copy a snapshot directory as a new snapshot of the main progenitors."""
+    new_path = snap_path.parent / str(snap_number)
+    (new_path / "images").mkdir(parents=True)
+    with open(snap_path / "data.csv") as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        galaxy_id = row["GalaxyID"]
+        row["GalaxyID"] = str(int(galaxy_id) + 1)
+        row["DescendantID"] = galaxy_id
+        row["SnapNum"] = str(snap_number)
+        for prefix in ["galrand", "galedge", "galface"]:
+            shutil.copy(
+                snap_path / "images" / f"{prefix}_{galaxy_id}.png",
+                new_path / "images" / f"{prefix}_{row['GalaxyID']}.png",
+            )
+    with open(new_path / "data.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+class EagleIncrementalTest(tfds.testing.TestCase):
+    """Tests for incremental preparation of the eagle dataset."""
+
+    def test_unchanged_snapshots_are_reused(self):
+        """Only new snapshots are read from manual_dir when preparing again."""
+        for config in ["RefL0025N0752", "RefL0025N0752_stacked"]:
+            with self.subTest(config=config):
+                self._test_unchanged_snapshots_are_reused(config)
+
+    def _test_unchanged_snapshots_are_reused(self, config):
+        tmp_path = tfds.core.Path(self.tmp_dir) / config
+        manual_dir = tmp_path / "manual"
+        shutil.copytree(
+            tfds.core.Path(eagle.__file__).parent / "dummy_data" / "RefL0025N0752",
+            manual_dir / "RefL0025N0752",
+        )
+        download_config = tfds.download.DownloadConfig(manual_dir=manual_dir)
+
+        builder = eagle.Eagle(config=config, data_dir=tmp_path / "previous")
+        builder.download_and_prepare(download_config=download_config)
+        self.assertEqual(builder.info.splits["train"].num_examples, 3)
+        previous_data_dir = builder.data_dir
+
+        copy_snapshot(manual_dir / "RefL0025N0752" / "27", 26)
+
+        data_dir = tmp_path / "data"
+        builder = eagle.Eagle(
+            config=config,
+            data_dir=data_dir,
+            previous_data_dir=previous_data_dir,
+        )
+        with mock.patch.object(
+            eagle.Eagle,
+            "_generate_snapshot_examples",
+            autospec=True,
+            side_effect=eagle.Eagle._generate_snapshot_examples,
+        ) as generate:
+            builder.download_and_prepare(download_config=download_config)
+        generated = [call.args[1].name for call in generate.call_args_list]
+        self.assertEqual(generated, ["26"])
+
+        builder = eagle.Eagle(config=config, data_dir=data_dir)
+        self.assertEqual(builder.info.splits["train"].num_examples, 6)
+        examples = list(tfds.as_numpy(builder.as_dataset(split="train")))
+        snapshots = {int(example["Snapshot"]) for example in examples}
+        self.assertEqual(snapshots, {26, 27})
+        fingerprints = builder.info.metadata["snapshot_fingerprints"]
+        self.assertEqual(set(fingerprints), {"26", "27"})
+
+        # the copied snapshot keeps its keys, records and encoded images
+        name = f"eagle/{config}"
+        previous = sidecar.read_sidecar(name, data_dir=tmp_path / "previous")
+        copied = sidecar.read_sidecar(name, filter="Snapshot == 27", data_dir=data_dir)
+        self.assertCountEqual(copied[sidecar.KEY_COLUMN], previous[sidecar.KEY_COLUMN])
+        galaxy_ids = set(previous["GalaxyID"])
+        self.assertEqual(
+            encoded_images(tmp_path / "previous", config),
+            {
+                galaxy_id: images
+                for galaxy_id, images in encoded_images(data_dir, config).items()
+                if galaxy_id in galaxy_ids
+            },
+        )
+
+
+def encoded_images(data_dir, config):
+    """Encoded images of every example of a prepared config, by GalaxyID."""
+    builder = eagle.Eagle(config=config, data_dir=data_dir)
+    decoders = {
+        key: tfds.decode.SkipDecoding()
+        for key in builder.image_features
+        if codecs.is_encoded(builder.info.features[key])
+    }
+    ds = builder.as_dataset(split="train", decoders=decoders)
+    return {
+        int(example["GalaxyID"]): [
+            np.asarray(example[key]).tolist() for key in sorted(decoders)
+        ]
+        for example in tfds.as_numpy(ds)
+    }
+
+
+class EagleProgenitorIndexTest(tfds.testing.TestCase):
+    """Tests for the progenitor index of the eagle dataset."""
+
+    def test_history(self):
+        """The images of a galaxy are loaded across snapshots, oldest first."""
+        tmp_path = tfds.core.Path(self.tmp_dir)
+        manual_dir = tmp_path / "manual"
+        shutil.copytree(
+            tfds.core.Path(eagle.__file__).parent / "dummy_data" / "RefL0025N0752",
+            manual_dir / "RefL0025N0752",
+        )
+        copy_snapshot(manual_dir / "RefL0025N0752" / "27", 26)
+        builder = eagle.Eagle(config="RefL0025N0752_face", data_dir=tmp_path / "data")
+        builder.download_and_prepare(
+            download_config=tfds.download.DownloadConfig(manual_dir=manual_dir)
+        )
+
+        index = eagle.ProgenitorIndex("eagle/RefL0025N0752_face", tmp_path / "data")
+        self.assertLen(index.index, 6)
+        for galaxy_id in [618992, 618993]:
+            history = index.history(galaxy_id)
+            self.assertEqual(list(history["GalaxyID"]), [618993, 618992])
+            self.assertEqual(list(history["Snapshot"]), [26, 27])
+
+        examples = list(tfds.as_numpy(index.load(618992)))
+        self.assertEqual([int(e["GalaxyID"]) for e in examples], [618993, 618992])
+        self.assertAllEqual(examples[0]["Image_face"], examples[1]["Image_face"])
+        with self.assertRaises(KeyError):
+            index.history(1)
+
+
 if __name__ == "__main__":
     tfds.testing.test_main()
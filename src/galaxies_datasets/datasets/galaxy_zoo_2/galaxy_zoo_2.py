@@ -1,8 +1,21 @@
 """galaxy_zoo_2 dataset."""
+import dataclasses
+from typing import Optional
+
 import pandas as pd
 import tensorflow as tf
 import tensorflow_datasets as tfds
 
+from galaxies_datasets import checksums
+from galaxies_datasets import codecs
+from galaxies_datasets import distributed
+from galaxies_datasets import duplicates
+from galaxies_datasets import sidecar
+from galaxies_datasets import sky
+from galaxies_datasets import splits
+from galaxies_datasets import stats
+from galaxies_datasets import subsets
+
 _URL = "https://zenodo.org/record/3565489#.YSOxXffQ9hF"
 _URL_GZ = "https://data.galaxyzoo.org/"
 
@@ -213,7 +226,31 @@ def merge_cvs(table1_csv, mapping_csv):
     return df
 
 
-class GalaxyZoo2(tfds.core.GeneratorBasedBuilder):
+def find_images(images_path):
+    """Yield the asset_id and path of every image."""
+    for image_path in images_path.glob("*.jpg"):
+        yield int(image_path.name.split(".")[0]), image_path
+
+
+@dataclasses.dataclass
+class GalaxyZoo2Config(tfds.core.BuilderConfig):
+    """Config storing the images with a codec, by default the source jpegs."""
+
+    codec: Optional[str] = None
+    quality: int = codecs.DEFAULT_QUALITY
+
+
+class GalaxyZoo2(
+    sky.SkyIndexMixin,
+    duplicates.ImageHashMixin,
+    sidecar.SidecarMixin,
+    splits.HashSplitsMixin,
+    subsets.SubsetMixin,
+    stats.StatisticsMixin,
+    checksums.ChecksumMixin,
+    distributed.ShardLayoutMixin,
+    tfds.core.GeneratorBasedBuilder,
+):
     """DatasetBuilder for galaxy_zoo_2 dataset."""
 
     VERSION = tfds.core.Version("1.0.0")
@@ -221,6 +258,8 @@ class GalaxyZoo2(tfds.core.GeneratorBasedBuilder):
         "1.0.0": "Initial release.",
     }
 
+    STATISTICS_LABELS = (r"table1/.*_(fraction|debiased)",)
+
     MANUAL_DOWNLOAD_INSTRUCTIONS = f"""
     Download from [this Zenodo repository]({_URL}) files:
 
@@ -234,6 +273,13 @@ class GalaxyZoo2(tfds.core.GeneratorBasedBuilder):
     Extract them in `manual_dir/galaxy_zoo_2`.
     """
 
+    BUILDER_CONFIGS = [
+        GalaxyZoo2Config(name="jpeg", description="Source jpeg images."),
+        GalaxyZoo2Config(
+            name="webp", description="Lossless WebP images.", codec="webp"
+        ),
+    ]
+
     def _info(self) -> tfds.core.DatasetInfo:
         """Returns the dataset metadata."""
         return tfds.core.DatasetInfo(
@@ -242,7 +288,9 @@ class GalaxyZoo2(tfds.core.GeneratorBasedBuilder):
             features=tfds.features.FeaturesDict(
                 {
                     # These are the features of your dataset like images, labels ...
-                    "image": tfds.features.Image(shape=(424, 424, 3)),
+                    "image": codecs.image_feature(
+                        (424, 424, 3), self.builder_config.codec
+                    ),
                     "table1": morphology_features(_QUESTIONS),
                     "metadata": _METADATA,
                 }
@@ -253,6 +301,7 @@ class GalaxyZoo2(tfds.core.GeneratorBasedBuilder):
             supervised_keys=None,  # Set to `None` to disable
             homepage=_URL,
             citation=_CITATION,
+            metadata=tfds.core.MetadataDict(),
         )
 
     def _split_generators(self, dl_manager: tfds.download.DownloadManager):
@@ -263,22 +312,35 @@ class GalaxyZoo2(tfds.core.GeneratorBasedBuilder):
             "mapping_csv": data_path / "gz2_filename_mapping.csv",
             "table1_csv": data_path / "gz2_hart16.csv",
         }
+        self._verify_checksums(data_path, paths.values())
+        df = merge_cvs(paths["table1_csv"], paths["mapping_csv"])
+        df = df.set_index("asset_id")
+        images = self._split_items(
+            (asset_id, image_path)
+            for asset_id, image_path in find_images(paths["images_path"])
+            if asset_id in df.index
+        )
 
         return {
-            "train": self._generate_examples(paths),
+            split: self._with_statistics(
+                split, self._generate_examples(df, images[split], split)
+            )
+            for split in self.split_names
         }
 
-    def _generate_examples(self, path):
-        """Yields examples."""
-        df = merge_cvs(path["table1_csv"], path["mapping_csv"])
-        df = df.set_index("asset_id")
-
-        for image_path in path["images_path"].glob("*.jpg"):
-            asset_id = int(image_path.name.split(".")[0])
-            if asset_id in df.index:
-                row = df.loc[asset_id]
-                yield asset_id, {
-                    "image": image_path,
-                    "table1": {k: row[k] for k in morphology_features(_QUESTIONS)},
-                    "metadata": {k: row[k] for k in _METADATA},
-                }
+    def _generate_examples(self, df, images, split="train"):
+        """Yields examples, given the catalogue and the images of the split."""
+        for asset_id, image_path in images:
+            row = df.loc[asset_id]
+            if not self._in_subset(asset_id, row, split):
+                continue
+            yield asset_id, {
+                "image": codecs.encode_image(
+                    image_path,
+                    self.builder_config.codec,
+                    "jpeg",
+                    self.builder_config.quality,
+                ),
+                "table1": {k: row[k] for k in morphology_features(_QUESTIONS)},
+                "metadata": {k: row[k] for k in _METADATA},
+            }
@@ -1,7 +1,9 @@
 """galaxy_zoo_2 dataset."""
+import numpy as np
 import tensorflow_datasets as tfds
 
 from . import galaxy_zoo_2
+from galaxies_datasets import codecs
 
 
 class GalaxyZoo2Test(tfds.testing.DatasetBuilderTestCase):
@@ -13,5 +15,32 @@ class GalaxyZoo2Test(tfds.testing.DatasetBuilderTestCase):
     }
 
 
+class GalaxyZoo2CodecTest(tfds.testing.TestCase):
+    """Tests for storing images with other codecs."""
+
+    def test_codec(self):
+        """Each codec has its own config, sharing a data_dir."""
+        manual_dir = tfds.core.Path(galaxy_zoo_2.__file__).parent / "dummy_data"
+        download_config = tfds.download.DownloadConfig(manual_dir=manual_dir)
+        with tfds.testing.tmp_dir() as data_dir:
+            images = {}
+            for config in ["jpeg", "webp"]:
+                builder = galaxy_zoo_2.GalaxyZoo2(config=config, data_dir=data_dir)
+                builder.download_and_prepare(download_config=download_config)
+                images[config] = {
+                    int(example["metadata"]["dr7objid"]): example["image"]
+                    for example in tfds.as_numpy(builder.as_dataset(split="train"))
+                }
+
+            builder = tfds.builder("galaxy_zoo2/webp", data_dir=data_dir)
+            self.assertIsInstance(builder.info.features["image"], codecs.WebPImage)
+            self.assertEqual(set(images["webp"]), set(images["jpeg"]))
+            for key, image in images["webp"].items():
+                self.assertEqual(image.shape, (424, 424, 3))
+                # the jpegs are decoded by Pillow for webp, by TensorFlow here
+                difference = image.astype(int) - images["jpeg"][key]
+                self.assertLess(np.abs(difference).mean(), 1)
+
+
 if __name__ == "__main__":
     tfds.testing.test_main()
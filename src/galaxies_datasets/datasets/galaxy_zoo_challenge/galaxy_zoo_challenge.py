@@ -1,10 +1,20 @@
 """galaxy_zoo_challenge dataset."""
 import csv
 import dataclasses
+from typing import Optional
 
 import tensorflow as tf
 import tensorflow_datasets as tfds
 
+from galaxies_datasets import checksums
+from galaxies_datasets import codecs
+from galaxies_datasets import distributed
+from galaxies_datasets import duplicates
+from galaxies_datasets import sidecar
+from galaxies_datasets import splits
+from galaxies_datasets import stats
+from galaxies_datasets import subsets
+
 _URL = "https://www.kaggle.com/c/galaxy-zoo-the-galaxy-challenge"
 
 _DESCRIPTION_TRAINING = f"""
@@ -85,14 +95,32 @@ _CLASSES = [
 ]
 
 
+def read_solutions(csv_path):
+    """Yield the GalaxyID and row of every training solution."""
+    with csv_path.open() as f:
+        for row in csv.DictReader(f):
+            yield row["GalaxyID"], row
+
+
 @dataclasses.dataclass
 class GalaxyZooChallengeConfig(tfds.core.BuilderConfig):
     """Training dataset config."""
 
     train: bool = True
-
-
-class GalaxyZooChallenge(tfds.core.GeneratorBasedBuilder):
+    codec: Optional[str] = None
+    quality: int = codecs.DEFAULT_QUALITY
+
+
+class GalaxyZooChallenge(
+    duplicates.ImageHashMixin,
+    sidecar.SidecarMixin,
+    splits.HashSplitsMixin,
+    subsets.SubsetMixin,
+    stats.StatisticsMixin,
+    checksums.ChecksumMixin,
+    distributed.ShardLayoutMixin,
+    tfds.core.GeneratorBasedBuilder,
+):
     """DatasetBuilder for galaxy_zoo_challenge dataset."""
 
     VERSION = tfds.core.Version("1.0.0")
@@ -110,6 +138,8 @@ class GalaxyZooChallenge(tfds.core.GeneratorBasedBuilder):
     Extract them in `manual_dir/galaxy_zoo_challenge`
     """
 
+    STATISTICS_LABELS = (r"label/.*",)
+
     BUILDER_CONFIGS = [
         # `name` (and optionally `description`) are required for each config
         GalaxyZooChallengeConfig(name="train"),
@@ -119,7 +149,7 @@ class GalaxyZooChallenge(tfds.core.GeneratorBasedBuilder):
     def _info(self) -> tfds.core.DatasetInfo:
         """Returns the dataset metadata."""
         features = {
-            "image": tfds.features.Image(shape=(424, 424, 3)),
+            "image": codecs.image_feature((424, 424, 3), self.builder_config.codec),
             "GalaxyID": tf.int64,
         }
         supervised_keys = None
@@ -134,6 +164,13 @@ class GalaxyZooChallenge(tfds.core.GeneratorBasedBuilder):
             supervised_keys=supervised_keys,  # Set to `None` to disable
             homepage=_URL,
             citation=_CITATION,
+            metadata=tfds.core.MetadataDict(),
+        )
+
+    def _encode_image(self, image):
+        """Encode an image with the codec of the config."""
+        return codecs.encode_image(
+            image, self.builder_config.codec, "jpeg", self.builder_config.quality
         )
 
     def _split_generators(self, dl_manager: tfds.download.DownloadManager):
@@ -142,34 +179,44 @@ class GalaxyZooChallenge(tfds.core.GeneratorBasedBuilder):
         if self.builder_config.train:
             img_path = data_path / "images_training_rev1"
             csv_path = data_path / "training_solutions_rev1.csv"
+            self._verify_checksums(data_path, [img_path, csv_path])
+            rows = self._split_items(read_solutions(csv_path))
             return {
-                "train": self._generate_examples(img_path, csv_path),
+                split: self._with_statistics(
+                    split, self._generate_examples(img_path, rows[split], split)
+                )
+                for split in self.split_names
             }
         else:
             img_path = data_path / "images_test_rev1"
+            self._verify_checksums(data_path, [img_path])
+            images = self._split_items(
+                (path.name.split(".")[0], path) for path in img_path.glob("*.jpg")
+            )
             return {
-                "train": self._generate_examples_test(img_path),
+                split: self._with_statistics(
+                    split, self._generate_examples_test(images[split], split)
+                )
+                for split in self.split_names
             }
 
-    def _generate_examples(self, img_path, csv_path):
-        """Yields examples."""
-        if self.builder_config.train:
-            with csv_path.open() as f:
-                for row in csv.DictReader(f):
-                    galaxy_id = row["GalaxyID"]
-                    yield galaxy_id, {
-                        "GalaxyID": galaxy_id,
-                        "image": img_path / f"{galaxy_id}.jpg",
-                        "label": {
-                            class_name: row[class_name] for class_name in _CLASSES
-                        },
-                    }
-
-    def _generate_examples_test(self, img_path):
-        """Yields examples."""
-        for path in img_path.glob("*.jpg"):
-            galaxy_id = path.name.split(".")[0]
+    def _generate_examples(self, img_path, rows, split="train"):
+        """Yields examples, given the solutions of the split."""
+        for galaxy_id, row in rows:
+            if not self._in_subset(galaxy_id, row, split):
+                continue
+            yield galaxy_id, {
+                "GalaxyID": galaxy_id,
+                "image": self._encode_image(img_path / f"{galaxy_id}.jpg"),
+                "label": {class_name: row[class_name] for class_name in _CLASSES},
+            }
+
+    def _generate_examples_test(self, images, split="train"):
+        """Yields examples, given the images of the split."""
+        for galaxy_id, path in images:
+            if not self._in_subset(galaxy_id, {"GalaxyID": galaxy_id}, split):
+                continue
             yield galaxy_id, {
-                "image": path,
+                "image": self._encode_image(path),
                 "GalaxyID": galaxy_id,
             }
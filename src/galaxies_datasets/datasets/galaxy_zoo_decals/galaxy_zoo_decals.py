@@ -2,14 +2,34 @@
 import ast
 import csv
 import dataclasses
+import itertools
+import random
+from typing import Dict
+from typing import Optional
 
+import pandas as pd
 import tensorflow as tf
 import tensorflow_datasets as tfds
 
+from galaxies_datasets import checksums
+from galaxies_datasets import codecs
+from galaxies_datasets import distributed
+from galaxies_datasets import duplicates
+from galaxies_datasets import sidecar
+from galaxies_datasets import sky
+from galaxies_datasets import splits
+from galaxies_datasets import stats
+from galaxies_datasets import subsets
+
 _DESCRIPTION = """
 This repository contains the data released in the paper "Galaxy Zoo DECaLS:
 Detailed Visual Morphology Measurements from Volunteers and Deep Learning
 for 314000 Galaxies"
+
+To keep a single copy of the images when using several configs, prepare the
+`images` config, which stores every image once by iauname, and the
+`*_labels` configs (e.g. `volunteers_5_labels`), which hold only the labels.
+`galaxy_zoo_decals.load_with_images` joins them at read time.
 """
 
 _HOMEPAGE_URL = "https://doi.org/10.5281/zenodo.4196266"
@@ -61,6 +81,8 @@ _CITATION = """
 }
 """
 
+IMAGE_STORE = "images"
+
 _METADATA = {
     "iauname": tf.string,
     "ra": tf.float64,
@@ -198,16 +220,92 @@ def find_image_path(iauname, image_paths):
     return None
 
 
+def find_images(image_paths):
+    """Find every image of the png parts, sorted by iauname."""
+    paths = []
+    for image_path in image_paths:
+        paths += tf.io.gfile.glob(str(image_path / "*" / "*.png"))
+
+    return sorted((tfds.core.Path(path) for path in paths), key=lambda path: path.name)
+
+
+def read_csv(csv_path, offsets=None):
+    """Yield the byte offset and row of the lines of a csv, after its header.
+
+    With ``offsets``, only the lines starting at them are read, in that order,
+    so that rows are looked up again without keeping them in memory.
+    """
+    with csv_path.open("rb") as f:
+        header = next(csv.reader([f.readline().decode()]))
+        if offsets is None:
+            offsets = iter(f.tell, None)
+
+        for offset in offsets:
+            f.seek(offset)
+            line = f.readline()
+            if not line:
+                return
+            if line.strip():
+                yield offset, dict(zip(header, next(csv.reader([line.decode()]))))
+
+
+def find_rows(csv_path, image_paths):
+    """Yield the iauname, offset and image path of the rows with an image."""
+    for offset, row in read_csv(csv_path):
+        image_path = find_image_path(row["iauname"], image_paths)
+        if image_path:
+            yield row["iauname"], offset, image_path
+
+
 @dataclasses.dataclass
 class GalaxyZooDecalsConfig(tfds.core.BuilderConfig):
-    """Config for decals DR 1 and 2."""
+    """Config for decals DR 1 and 2.
+
+    Configs without `images` hold only the labels, images being joined at read
+    time from the `images` config, which stores every image once by iauname.
+    See `load_with_images`.
+    """
 
     data: str = "1_and_2"
     csv_name: str = "gz_decals_volunteers_1_and_2.csv"
     auto: bool = False
-
-
-class GalaxyZooDecals(tfds.core.GeneratorBasedBuilder):
+    codec: Optional[str] = None
+    quality: int = codecs.DEFAULT_QUALITY
+    images: bool = True
+    image_store: bool = False
+
+
+def labels_only(config: GalaxyZooDecalsConfig) -> GalaxyZooDecalsConfig:
+    """Derive the config holding only the labels of another config."""
+    return dataclasses.replace(config, name=f"{config.name}_labels", images=False)
+
+
+_LABEL_CONFIGS = [
+    # `name` (and optionally `description`) are required for each config
+    GalaxyZooDecalsConfig(name="volunteers_1_and_2"),
+    GalaxyZooDecalsConfig(
+        name="volunteers_5", data="5", csv_name="gz_decals_volunteers_5.csv"
+    ),
+    GalaxyZooDecalsConfig(
+        name="auto",
+        data="5",
+        csv_name="gz_decals_auto_posteriors.csv",
+        auto=True,
+    ),
+]
+
+
+class GalaxyZooDecals(
+    sky.SkyIndexMixin,
+    duplicates.ImageHashMixin,
+    sidecar.SidecarMixin,
+    splits.HashSplitsMixin,
+    subsets.SubsetMixin,
+    stats.StatisticsMixin,
+    checksums.ChecksumMixin,
+    distributed.ShardLayoutMixin,
+    tfds.core.GeneratorBasedBuilder,
+):
     """DatasetBuilder for galaxy_zoo_decals dataset."""
 
     VERSION = tfds.core.Version("1.0.0")
@@ -231,18 +329,18 @@ class GalaxyZooDecals(tfds.core.GeneratorBasedBuilder):
         gz_decals_dr5_png_part*.zip/J*/J*.png
     """
 
+    STATISTICS_LABELS = (r"morphology/.*_fraction",)
+    STATISTICS_QUANTILES = (
+        r"metadata/redshift",
+        r"metadata/elpetro_absmag_r",
+        r"metadata/sersic_nmgy_r",
+        r"metadata/petro_.*",
+    )
+
     BUILDER_CONFIGS = [
-        # `name` (and optionally `description`) are required for each config
-        GalaxyZooDecalsConfig(name="volunteers_1_and_2"),
-        GalaxyZooDecalsConfig(
-            name="volunteers_5", data="5", csv_name="gz_decals_volunteers_5.csv"
-        ),
-        GalaxyZooDecalsConfig(
-            name="auto",
-            data="5",
-            csv_name="gz_decals_auto_posteriors.csv",
-            auto=True,
-        ),
+        *_LABEL_CONFIGS,
+        GalaxyZooDecalsConfig(name=IMAGE_STORE, image_store=True),
+        *[labels_only(config) for config in _LABEL_CONFIGS],
     ]
 
     @property
@@ -257,22 +355,25 @@ class GalaxyZooDecals(tfds.core.GeneratorBasedBuilder):
 
     def _info(self) -> tfds.core.DatasetInfo:
         """Returns the dataset metadata."""
+        image = codecs.image_feature((424, 424, 3), self.builder_config.codec)
+        if self.builder_config.image_store:
+            features = {"iauname": tf.string, "image": image}
+        else:
+            features = {"morphology": self.morphology_features, "metadata": _METADATA}
+            if self.builder_config.images:
+                features = {"image": image, **features}
+
         return tfds.core.DatasetInfo(
             builder=self,
             description=_DESCRIPTION,
-            features=tfds.features.FeaturesDict(
-                {
-                    "image": tfds.features.Image(shape=(424, 424, 3)),
-                    "morphology": self.morphology_features,
-                    "metadata": _METADATA,
-                }
-            ),
+            features=tfds.features.FeaturesDict(features),
             # If there's a common (input, target) tuple from the
             # features, specify them here. They'll be used if
             # `as_supervised=True` in `builder.as_dataset`.
             supervised_keys=None,  # Set to `None` to disable
             homepage=_HOMEPAGE_URL,
             citation=_CITATION,
+            metadata=tfds.core.MetadataDict(),
         )
 
     def _split_generators(self, dl_manager: tfds.download.DownloadManager):
@@ -280,31 +381,142 @@ class GalaxyZooDecals(tfds.core.GeneratorBasedBuilder):
         data_path = dl_manager.manual_dir / "galaxy_zoo_decals"
         csv_path = data_path / self.builder_config.csv_name
         image_paths = [data_path / f"gz_decals_dr5_png_part{i}" for i in range(1, 5)]
+        if self.builder_config.image_store:
+            self._verify_checksums(data_path, image_paths)
+            return {
+                "train": self._with_statistics(
+                    "train", self._generate_images(image_paths)
+                ),
+            }
+
+        read_paths = [csv_path]
+        if self.builder_config.images:
+            read_paths += image_paths
+        self._verify_checksums(data_path, read_paths)
+        rows = self._split_items(find_rows(csv_path, image_paths))
+        return {
+            split: self._with_statistics(
+                split, self._generate_examples(csv_path, rows[split], split)
+            )
+            for split in self.split_names
+        }
+
+    def _generate_images(self, image_paths):
+        """Yields the images of the image store."""
+        for image_path in find_images(image_paths):
+            iauname = image_path.name[: -len(".png")]
+            if not self._in_subset(iauname, {"iauname": iauname}, "train"):
+                continue
+            yield iauname, {
+                "iauname": iauname,
+                "image": self._encode_image(image_path),
+            }
+
+    def _encode_image(self, image_path):
+        """Encode an image with the codec of the config."""
+        return codecs.encode_image(
+            image_path, self.builder_config.codec, "png", self.builder_config.quality
+        )
+
+    def _generate_examples(self, csv_path, rows, split="train"):
+        """Yields examples, given the iauname, offset and image of their rows."""
+        rows, offsets = itertools.tee(rows)
+        lines = read_csv(csv_path, (offset for _, offset, _ in offsets))
+        for (iauname, _, image_path), (_, row) in zip(rows, lines):
+            if self.builder_config.auto:
+                for field in row:
+                    if "_concentration" in field:
+                        row[field] = ast.literal_eval(row[field])
+
+            if not self._in_subset(iauname, row, split):
+                continue
+            example = {
+                "morphology": {
+                    k: "nan" if row[k] == "" else row[k]
+                    for k in self.morphology_features
+                },
+                "metadata": {k: "nan" if row[k] == "" else row[k] for k in _METADATA},
+            }
+            if self.builder_config.images:
+                example["image"] = self._encode_image(image_path)
+            yield iauname, example
+
+
+def load_with_images(
+    config: str = "volunteers_1_and_2_labels",
+    split: str = "train",
+    data_dir: Optional[str] = None,
+    decoders: Optional[Dict] = None,
+    shuffle_files: bool = False,
+    read_config: Optional[tfds.ReadConfig] = None,
+) -> tf.data.Dataset:
+    """Join a labels only config with the shared image store, at read time.
+
+    The sidecars of both configs are joined by iauname, so that only the
+    records of the examples of the split are read, at their offsets, in the
+    order of the image store. `shuffle_files` shuffles the order of its shards,
+    with the `shuffle_seed` of `read_config`. `decoders` apply to the image
+    store, e.g. `decoders={"image": SkipDecoding()}`.
+    """
+    labels_builder = tfds.builder(f"galaxy_zoo_decals/{config}", data_dir=data_dir)
+    images_builder = tfds.builder(f"galaxy_zoo_decals/{IMAGE_STORE}", data_dir=data_dir)
+    columns = ["iauname", sidecar.SHARD_COLUMN, sidecar.OFFSET_COLUMN]
+    labels = pd.read_parquet(
+        sidecar.get_sidecar_path(labels_builder.data_path, split),
+        columns=["metadata/iauname", sidecar.SHARD_COLUMN, sidecar.OFFSET_COLUMN],
+    )
+    labels.columns = columns
+    images = pd.read_parquet(
+        sidecar.get_sidecar_path(images_builder.data_path, "train"), columns=columns
+    )
+    rows = pd.merge(labels, images, on="iauname", suffixes=("_labels", "_image"))
+    shards = [
+        group.sort_values(f"{sidecar.OFFSET_COLUMN}_image")
+        for _, group in rows.groupby(f"{sidecar.SHARD_COLUMN}_image", sort=True)
+    ]
+    if shuffle_files:
+        seed = read_config.shuffle_seed if read_config is not None else None
+        random.Random(seed).shuffle(shards)
+
+    def read_labels(group):
+        records = {}
+        for shard, offsets in group.groupby(f"{sidecar.SHARD_COLUMN}_labels"):
+            offsets = sorted(offsets[f"{sidecar.OFFSET_COLUMN}_labels"])
+            path = labels_builder.data_path / shard
+            records[shard] = dict(zip(offsets, sidecar.read_records(path, offsets)))
+
+        return records
+
+    def generator():
+        for group in shards:
+            labels_records = read_labels(group)
+            image_records = sidecar.read_records(
+                images_builder.data_path
+                / group[f"{sidecar.SHARD_COLUMN}_image"].iloc[0],
+                list(group[f"{sidecar.OFFSET_COLUMN}_image"]),
+            )
+            locations = zip(
+                group[f"{sidecar.SHARD_COLUMN}_labels"],
+                group[f"{sidecar.OFFSET_COLUMN}_labels"],
+            )
+            for (shard, offset), image in zip(locations, image_records):
+                yield labels_records[shard][offset], image
+
+    ds = tf.data.Dataset.from_generator(
+        generator,
+        output_signature=(
+            tf.TensorSpec(shape=(), dtype=tf.string),
+            tf.TensorSpec(shape=(), dtype=tf.string),
+        ),
+    )
+    labels_features = labels_builder.info.features
+    images_features = images_builder.info.features
+
+    def join(labels, image):
+        image = images_features.deserialize_example(image, decoders=decoders)
         return {
-            "train": self._generate_examples(image_paths, csv_path),
+            "image": image["image"],
+            **labels_features.deserialize_example(labels),
         }
 
-    def _generate_examples(self, image_paths, csv_path):
-        """Yields examples."""
-        with csv_path.open() as f:
-            for row in csv.DictReader(f):
-                iauname = row["iauname"]
-
-                if self.builder_config.auto:
-                    for field in row:
-                        if "_concentration" in field:
-                            row[field] = ast.literal_eval(row[field])
-
-                image_path = find_image_path(iauname, image_paths)
-
-                if image_path:
-                    yield iauname, {
-                        "image": image_path,
-                        "morphology": {
-                            k: "nan" if row[k] == "" else row[k]
-                            for k in self.morphology_features
-                        },
-                        "metadata": {
-                            k: "nan" if row[k] == "" else row[k] for k in _METADATA
-                        },
-                    }
+    return ds.map(join, num_parallel_calls=tf.data.AUTOTUNE)
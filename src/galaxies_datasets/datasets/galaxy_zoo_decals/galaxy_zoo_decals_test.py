@@ -1,4 +1,5 @@
 """galaxy_zoo_decals dataset."""
+import numpy as np
 import tensorflow_datasets as tfds
 
 from . import galaxy_zoo_decals
@@ -8,10 +9,69 @@ class GalaxyZooDecalsTest(tfds.testing.DatasetBuilderTestCase):
     """Tests for galaxy_zoo_decals dataset."""
 
     DATASET_CLASS = galaxy_zoo_decals.GalaxyZooDecals
+    BUILDER_CONFIG_NAMES_TO_TEST = [
+        config.name
+        for config in galaxy_zoo_decals.GalaxyZooDecals.BUILDER_CONFIGS
+        if not config.image_store
+    ]
     SPLITS = {
         "train": 6,  # Number of fake train example
     }
 
 
+class GalaxyZooDecalsImagesTest(tfds.testing.DatasetBuilderTestCase):
+    """Tests for the image store of the galaxy_zoo_decals dataset."""
+
+    DATASET_CLASS = galaxy_zoo_decals.GalaxyZooDecals
+    BUILDER_CONFIG_NAMES_TO_TEST = [galaxy_zoo_decals.IMAGE_STORE]
+    SPLITS = {
+        "train": 18,  # Every fake image
+    }
+
+
+class LoadWithImagesTest(tfds.testing.TestCase):
+    """Tests for joining labels only configs with the image store."""
+
+    def test_matches_full_config(self):
+        """Joined examples are those of the config storing images."""
+        manual_dir = tfds.core.Path(galaxy_zoo_decals.__file__).parent / "dummy_data"
+        download_config = tfds.download.DownloadConfig(manual_dir=manual_dir)
+        with tfds.testing.tmp_dir() as data_dir:
+            builders = {
+                config: galaxy_zoo_decals.GalaxyZooDecals(
+                    config=config, data_dir=data_dir
+                )
+                for config in ["volunteers_5", "volunteers_5_labels", "images"]
+            }
+            for builder in builders.values():
+                builder.download_and_prepare(download_config=download_config)
+            full = builders["volunteers_5"].as_dataset(split="train")
+            full = {
+                example["metadata"]["iauname"]: example
+                for example in tfds.as_numpy(full)
+            }
+            joined = galaxy_zoo_decals.load_with_images(
+                "volunteers_5_labels", data_dir=data_dir
+            )
+            joined = list(tfds.as_numpy(joined))
+            shuffled = galaxy_zoo_decals.load_with_images(
+                "volunteers_5_labels",
+                data_dir=data_dir,
+                shuffle_files=True,
+                read_config=tfds.ReadConfig(shuffle_seed=0),
+            )
+            shuffled = [
+                example["metadata"]["iauname"] for example in tfds.as_numpy(shuffled)
+            ]
+
+        self.assertLen(joined, 6)
+        self.assertCountEqual(shuffled, [e["metadata"]["iauname"] for e in joined])
+        for example in joined:
+            expected = full[example["metadata"]["iauname"]]
+            self.assertAllEqual(example["image"], expected["image"])
+            np.testing.assert_equal(example["morphology"], expected["morphology"])
+            np.testing.assert_equal(example["metadata"], expected["metadata"])
+
+
 if __name__ == "__main__":
     tfds.testing.test_main()
@@ -0,0 +1,154 @@
+"""Shard layouts and read plans for data-parallel training."""
+import dataclasses
+import heapq
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+import numpy as np
+import tensorflow_datasets as tfds
+
+
+class ShardLayoutMixin:
+    """Builder options for the number and size of the prepared shards.
+
+    ``num_shards`` fixes the number of shards of every split, each with the
+    same number of examples give or take one; pick a multiple of the number of
+    workers. ``max_shard_size``, in bytes, bounds the shard size instead.
+    Both need tensorflow_datasets 4.8.0 or later.
+    """
+
+    def __init__(
+        self,
+        *,
+        num_shards: Optional[int] = None,
+        max_shard_size: Optional[int] = None,
+        **kwargs,
+    ):
+        """Set the shard layout."""
+        super().__init__(**kwargs)  # type: ignore
+        self._num_shards = num_shards
+        self._max_shard_size = max_shard_size
+
+    def download_and_prepare(self, *, download_config=None, **kwargs):
+        """Prepare the dataset with the requested shard layout."""
+        download_config = download_config or tfds.download.DownloadConfig()
+        if self._num_shards is not None:
+            _check_download_config(download_config, "num_shards")
+            download_config = dataclasses.replace(
+                download_config, num_shards=self._num_shards
+            )
+        if self._max_shard_size is not None:
+            _check_download_config(download_config, "max_shard_size", "min_shard_size")
+            download_config = dataclasses.replace(
+                download_config,
+                max_shard_size=self._max_shard_size,
+                min_shard_size=min(
+                    download_config.min_shard_size, self._max_shard_size
+                ),
+            )
+
+        super().download_and_prepare(  # type: ignore
+            download_config=download_config, **kwargs
+        )
+
+
+def _check_download_config(download_config, *names: str) -> None:
+    """Fail clearly if tensorflow_datasets lacks shard layout options."""
+    fields = {field.name for field in dataclasses.fields(download_config)}
+    missing = [name for name in names if name not in fields]
+    if missing:
+        raise ValueError(
+            f"tensorflow_datasets {tfds.__version__} does not support "
+            f"{', '.join(missing)}, upgrade it to 4.8.0 or later"
+        )
+
+
+class WorkerPlan(NamedTuple):
+    """Whole shards read by a single worker."""
+
+    worker: int
+    shards: List[int]
+    num_examples: int
+
+
+class ReadPlan(NamedTuple):
+    """Assignment of the shards of a split to every worker."""
+
+    split: str
+    shard_lengths: List[int]
+    workers: List[WorkerPlan]
+
+    @property
+    def imbalance(self) -> float:
+        """Largest over mean number of examples per worker."""
+        counts = [worker.num_examples for worker in self.workers]
+        return max(counts) / np.mean(counts)
+
+    def read_instruction(self, worker: int) -> tfds.core.ReadInstruction:
+        """Read instruction selecting exactly the shards of a worker.
+
+        Absolute ranges aligned on shard boundaries make tensorflow_datasets
+        read whole files, without skipping records.
+        """
+        boundaries = np.cumsum([0] + self.shard_lengths)
+        instructions = [
+            tfds.core.ReadInstruction(
+                self.split,
+                from_=int(boundaries[shard]),
+                to=int(boundaries[shard + 1]),
+                unit="abs",
+            )
+            for shard in self.workers[worker].shards
+        ]
+        instruction = instructions[0]
+        for other in instructions[1:]:
+            instruction = instruction + other
+
+        return instruction
+
+
+def assign_shards(shard_lengths: List[int], num_workers: int) -> List[WorkerPlan]:
+    """Balance whole shards across workers by their number of examples.
+
+    Shards are assigned largest first to the least loaded worker.
+    """
+    if len(shard_lengths) < num_workers:
+        raise ValueError(
+            f"Cannot assign {len(shard_lengths)} shards to {num_workers} workers, "
+            "prepare the dataset again with more shards (num_shards)"
+        )
+
+    heap = [(0, worker) for worker in range(num_workers)]
+    shards: List[List[int]] = [[] for _ in range(num_workers)]
+    order = sorted(range(len(shard_lengths)), key=lambda i: -shard_lengths[i])
+    for shard in order:
+        count, worker = heapq.heappop(heap)
+        shards[worker].append(shard)
+        heapq.heappush(heap, (count + shard_lengths[shard], worker))
+
+    return [
+        WorkerPlan(
+            worker,
+            sorted(shards[worker]),
+            sum(shard_lengths[i] for i in shards[worker]),
+        )
+        for worker in range(num_workers)
+    ]
+
+
+def read_plan(
+    name: str,
+    num_workers: int,
+    split: str = "train",
+    data_dir: Optional[str] = None,
+) -> ReadPlan:
+    """Plan which shards of a prepared dataset each worker reads.
+
+    Pass ``plan.read_instruction(worker)`` as the split of ``tfds.load`` or
+    of the loaders in :mod:`galaxies_datasets.pipelines`.
+    """
+    builder = tfds.builder(name, data_dir=data_dir)
+    shard_lengths = list(builder.info.splits[split].shard_lengths)
+
+    return ReadPlan(split, shard_lengths, assign_shards(shard_lengths, num_workers))
@@ -0,0 +1,306 @@
+"""Perceptual hashes of the images and near-duplicate search across datasets.
+
+Preparing a Galaxy Zoo dataset also adds a ``_image_hash`` column to its
+sidecars, with a 64 bit DCT perceptual hash of the image of each example.
+Images are hashed as the examples are generated, from the images decoded for
+the statistics. Hashes of images that differ only by compression, small shifts or brightness are a few bits apart, so
+near-duplicate cutouts, e.g. of a galaxy in both Galaxy Zoo 2 and the Kaggle
+challenge, are found by Hamming distance::
+
+    report = duplicates.duplicate_report(["galaxy_zoo2", "galaxy_zoo_challenge/train"])
+
+:class:`HashIndex` implements multi-index hashing: the hashes are split in
+``chunks`` substrings, each sorted separately. Two hashes within ``radius``
+bits share at least one substring within ``radius // chunks`` bits, so a
+query only probes those neighbours of its substrings with binary searches,
+instead of comparing every pair.
+"""
+import itertools
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import sidecar
+
+HASH_COLUMN = "_image_hash"
+HASH_SIZE = 8
+THUMBNAIL_SIZE = 4 * HASH_SIZE
+DEFAULT_RADIUS = 6
+DEFAULT_CHUNKS = 4
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II matrix."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(THUMBNAIL_SIZE)[:HASH_SIZE]
+
+
+def thumbnails(images: tf.Tensor) -> tf.Tensor:
+    """Grayscale thumbnails hashed by :func:`dct_hash`, of one or more images."""
+    images = tf.convert_to_tensor(images)
+    if images.shape[-1] == 3:
+        images = tf.image.rgb_to_grayscale(images)
+    thumbnail = tf.image.resize(
+        tf.cast(images, tf.float32), (THUMBNAIL_SIZE, THUMBNAIL_SIZE), method="area"
+    )
+    return thumbnail[..., 0]
+
+
+def dct_hash(thumbnails: np.ndarray) -> np.ndarray:
+    """64 bit perceptual hashes of a batch of thumbnails.
+
+    Each bit tells whether one of the 8 x 8 lowest frequency DCT coefficients
+    is above their median, leaving out the mean brightness.
+    """
+    coefficients = np.einsum("ij,njk,lk->nil", _DCT, thumbnails, _DCT)
+    coefficients = coefficients.reshape(len(thumbnails), HASH_SIZE**2)
+    median = np.median(coefficients[:, 1:], axis=1, keepdims=True)
+    bits = np.packbits(coefficients > median, axis=1)
+    return bits.view(">u8")[:, 0].astype(np.uint64)
+
+
+def perceptual_hash(images) -> np.ndarray:
+    """Perceptual hashes of a batch of images, e.g. of an external catalogue."""
+    return dct_hash(thumbnails(images).numpy())
+
+
+def hamming(hashes_a: np.ndarray, hashes_b: np.ndarray) -> np.ndarray:
+    """Number of differing bits between pairs of hashes."""
+    xor = np.ascontiguousarray(np.bitwise_xor(hashes_a, hashes_b), np.uint64)
+    return _POPCOUNT[xor.view(np.uint8)].reshape(*xor.shape, 8).sum(axis=-1)
+
+
+class HashMatches(NamedTuple):
+    """Pairs of hashes within the search radius."""
+
+    query: np.ndarray
+    index: np.ndarray
+    distance: np.ndarray
+
+
+class HashIndex:
+    """Multi-index of 64 bit hashes."""
+
+    def __init__(self, hashes: np.ndarray, chunks: int = DEFAULT_CHUNKS):
+        """Sort the substrings of the hashes."""
+        if 64 % chunks:
+            raise ValueError(f"chunks must divide 64, got {chunks}")
+        self.hashes = np.asarray(hashes, np.uint64)
+        self.chunks = chunks
+        self.width = 64 // chunks
+        self.orders = []
+        self.keys = []
+        for chunk in range(chunks):
+            values = self._substrings(self.hashes, chunk)
+            order = np.argsort(values, kind="stable")
+            self.orders.append(order)
+            self.keys.append(values[order])
+
+    def __len__(self) -> int:
+        """Number of indexed hashes."""
+        return len(self.hashes)
+
+    def _substrings(self, hashes: np.ndarray, chunk: int) -> np.ndarray:
+        mask = np.uint64((1 << self.width) - 1)
+        return (hashes >> np.uint64(chunk * self.width)) & mask
+
+    def _probes(self, radius: int) -> np.ndarray:
+        """Substring masks of at most ``radius // chunks`` bits."""
+        bits = range(self.width)
+        masks = [
+            sum(1 << bit for bit in flipped)
+            for count in range(radius // self.chunks + 1)
+            for flipped in itertools.combinations(bits, count)
+        ]
+        return np.array(masks, np.uint64)
+
+    def _candidates(
+        self, hashes: np.ndarray, probes: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Pairs sharing a substring up to a probe, possibly repeated."""
+        queries = []
+        positions = []
+        for chunk, (order, keys) in enumerate(zip(self.orders, self.keys)):
+            values = (self._substrings(hashes, chunk)[:, None] ^ probes).ravel()
+            low = np.searchsorted(keys, values, side="left")
+            counts = np.searchsorted(keys, values, side="right") - low
+            # expand every range into candidate pairs
+            query = np.repeat(np.arange(len(values)) // len(probes), counts)
+            first = np.repeat(low - (np.cumsum(counts) - counts), counts)
+            queries.append(query)
+            positions.append(order[first + np.arange(counts.sum())])
+
+        return np.concatenate(queries), np.concatenate(positions)
+
+    def query(
+        self, hashes: np.ndarray, radius: int = DEFAULT_RADIUS, block: int = 4096
+    ) -> HashMatches:
+        """Find every indexed hash within ``radius`` bits.
+
+        Queries are processed ``block`` at a time to bound the memory of the
+        candidates. Probes grow combinatorially with ``radius // chunks``.
+        Returned indices refer to the order of the given and of the indexed
+        hashes.
+        """
+        hashes = np.atleast_1d(np.asarray(hashes, np.uint64))
+        if not len(self):
+            hashes = hashes[:0]
+        probes = self._probes(radius)
+        matches = []
+        for start in range(0, len(hashes), block):
+            query, index = self._candidates(hashes[start : start + block], probes)
+            pairs = np.unique(query.astype(np.int64) * len(self) + index)
+            query, index = np.divmod(pairs, len(self))
+            distance = hamming(hashes[start + query], self.hashes[index])
+            close = distance <= radius
+            matches.append((start + query[close], index[close], distance[close]))
+
+        if not matches:
+            empty = np.zeros(0, np.int64)
+            return HashMatches(empty, empty, empty)
+
+        return HashMatches(*(np.concatenate(column) for column in zip(*matches)))
+
+
+class ImageHashMixin:
+    """Hash the `HASH_IMAGE` feature as a builder generates the examples.
+
+    Hashes are stored in the sidecar rows, keyed by example key. Configs
+    without the image are not hashed. Requires
+    :class:`~galaxies_datasets.sidecar.SidecarMixin`, after this one, and
+    :class:`~galaxies_datasets.stats.StatisticsMixin`, which decodes the
+    images.
+    """
+
+    HASH_IMAGE = "image"
+
+    def _observe_example(self, split, key, example, images):
+        super()._observe_example(split, key, example, images)  # type: ignore
+        if self.HASH_IMAGE in images:
+            thumbnail = thumbnails(images[self.HASH_IMAGE][0])
+            row = self._sidecar_row(split, key)  # type: ignore
+            row[HASH_COLUMN] = dct_hash(thumbnail[None].numpy())[0]
+
+
+def load_image_hashes(
+    name: str, split: str = "train", data_dir: Optional[str] = None
+) -> np.ndarray:
+    """Load the image hashes of a prepared dataset, in the order of its sidecar."""
+    builder = tfds.builder(name, data_dir=data_dir)
+    path = sidecar.get_sidecar_path(builder.data_path, split)
+    return pd.read_parquet(path, columns=[HASH_COLUMN])[HASH_COLUMN].to_numpy(np.uint64)
+
+
+def _search(
+    hashes_a: np.ndarray,
+    index_b: HashIndex,
+    radius: int,
+    same: bool,
+) -> HashMatches:
+    """Match hashes against an index, each pair once if they are the same."""
+    matches = index_b.query(hashes_a, radius)
+    if not same:
+        return matches
+
+    keep = matches.query < matches.index
+    return HashMatches(*(column[keep] for column in matches))
+
+
+def find_duplicates(
+    name_a: str,
+    name_b: Optional[str] = None,
+    radius: int = DEFAULT_RADIUS,
+    split_a: str = "train",
+    split_b: Optional[str] = None,
+    data_dir: Optional[str] = None,
+) -> pd.DataFrame:
+    """Pairs of near-duplicate images of one or two prepared datasets.
+
+    Without ``name_b`` and ``split_b``, pairs are searched within a split,
+    each pair once. Returns the sidecar columns of both examples, prefixed
+    with ``a/`` and ``b/``, and the Hamming ``distance``.
+    """
+    name_b = name_a if name_b is None else name_b
+    split_b = split_a if split_b is None else split_b
+    same = (name_a, split_a) == (name_b, split_b)
+
+    index_b = HashIndex(load_image_hashes(name_b, split_b, data_dir))
+    matches = _search(
+        load_image_hashes(name_a, split_a, data_dir), index_b, radius, same
+    )
+
+    rows_a = sidecar.read_sidecar(name_a, split_a, data_dir=data_dir)
+    rows_b = sidecar.read_sidecar(name_b, split_b, data_dir=data_dir)
+    rows_a = rows_a.iloc[matches.query].add_prefix("a/")
+    rows_b = rows_b.iloc[matches.index].add_prefix("b/")
+    pairs = pd.concat(
+        [
+            rows_a.reset_index(drop=True),
+            rows_b.reset_index(drop=True),
+            pd.Series(matches.distance, name="distance"),
+        ],
+        axis=1,
+    )
+
+    return pairs
+
+
+def duplicate_report(
+    names: Sequence[str],
+    radius: int = DEFAULT_RADIUS,
+    data_dir: Optional[str] = None,
+) -> pd.DataFrame:
+    """Near-duplicates within and between every split of prepared datasets.
+
+    Returns one row per pair of splits, including a split with itself, with
+    the number of near-duplicate ``pairs`` and the number and fraction of the
+    examples of each split involved. Pairs between a training and a test
+    split leak between them.
+    """
+    splits: List[Tuple[str, str]] = [
+        (name, split)
+        for name in names
+        for split in tfds.builder(name, data_dir=data_dir).info.splits
+    ]
+    hashes = {key: load_image_hashes(*key, data_dir=data_dir) for key in splits}
+
+    rows = []
+    for j, key_b in enumerate(splits):
+        index_b = HashIndex(hashes[key_b])
+        for key_a in splits[: j + 1]:
+            matches = _search(hashes[key_a], index_b, radius, key_a == key_b)
+            if key_a == key_b:
+                examples_a = examples_b = len(np.unique(np.concatenate(matches[:2])))
+            else:
+                examples_a = len(np.unique(matches.query))
+                examples_b = len(np.unique(matches.index))
+            rows.append(
+                {
+                    "dataset_a": key_a[0],
+                    "split_a": key_a[1],
+                    "dataset_b": key_b[0],
+                    "split_b": key_b[1],
+                    "pairs": len(matches.query),
+                    "examples_a": examples_a,
+                    "examples_b": examples_b,
+                    "fraction_a": examples_a / max(len(hashes[key_a]), 1),
+                    "fraction_b": examples_b / max(len(hashes[key_b]), 1),
+                }
+            )
+
+    return pd.DataFrame(rows)
@@ -0,0 +1,29 @@
+"""Columns of the EAGLE database tables used by the eagle dataset.
+
+Shared by the eagle builder and the download script, without importing
+TensorFlow.
+"""
+
+SIZES = [
+    "R_halfmass30",
+    "R_halfmass100",
+    "R_halfmass30_projected",
+    "R_halfmass100_projected",
+]
+
+# merger tree links between the galaxies of different snapshots
+TREE_LINKS = ["DescendantID", "LastProgID", "TopLeafID"]
+
+# columns of the EAGLE database tables needed to build the dataset
+TABLE_COLUMNS = {
+    "SubHalo": [
+        "GalaxyID",
+        *TREE_LINKS,
+        "SnapNum",
+        "Image_ID",
+        "Image_face",
+        "Image_edge",
+        "Image_box",
+    ],
+    "Sizes": ["GalaxyID", *SIZES],
+}
@@ -0,0 +1,322 @@
+"""Ready-made tf.data input pipelines for the galaxies datasets."""
+import os
+import time
+from typing import Callable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import caching
+from galaxies_datasets import codecs
+from galaxies_datasets import datasets  # noqa: F401
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+CACHE_ENCODED = "encoded"
+CACHE_DECODED = "decoded"
+
+
+def label_keys(
+    features: tfds.features.FeaturesDict, suffix: Optional[str] = None
+) -> List[str]:
+    """Scalar float features, optionally only those ending with a suffix."""
+    return [
+        key
+        for key, feature in features.items()
+        if isinstance(feature, tfds.features.Tensor)
+        and feature.shape == ()
+        and codecs.feature_dtype(feature).is_floating
+        and (suffix is None or key.endswith(f"_{suffix}"))
+    ]
+
+
+def pack_labels(labels, keys: List[str]) -> tf.Tensor:
+    """Stack a dictionary of scalar labels into a float32 vector."""
+    return tf.stack([tf.cast(labels[key], tf.float32) for key in keys], axis=-1)
+
+
+def check_cache(cache: Optional[str], image_cache=None) -> None:
+    """Check the cache options of :func:`load`."""
+    if cache not in (None, CACHE_ENCODED, CACHE_DECODED):
+        raise ValueError(
+            f"cache must be None, {CACHE_ENCODED!r} or {CACHE_DECODED!r}, "
+            f"got {cache!r}"
+        )
+    if image_cache is not None and cache == CACHE_DECODED:
+        raise ValueError(f"image_cache replaces the {CACHE_DECODED!r} cache")
+
+
+def image_decoder(
+    image_feature: tfds.features.FeatureConnector,
+    image_cache: Optional[caching.ImageCache] = None,
+) -> Callable:
+    """Function decoding the images of a feature, as read with SkipDecoding.
+
+    With an image cache, it decodes ``(key, image)`` pairs, looking the images
+    up in the cache and storing those it decodes.
+    """
+    if not codecs.is_encoded(image_feature):
+        if image_cache is not None:
+            raise ValueError("image_cache needs an encoded image feature")
+        return lambda image: image
+    if image_cache is None:
+        return image_feature.decode_example
+
+    dtype = codecs.feature_dtype(image_feature)
+    missing = np.zeros((0,), dtype.as_numpy_dtype)
+
+    def lookup(key):
+        image = image_cache.get(key)
+        return (missing, False) if image is None else (image, True)
+
+    def store(key, image):
+        image_cache.put(key, image)
+        return image
+
+    def decode(key_image):
+        key, image = key_image
+        cached, found = tf.numpy_function(
+            lookup, [key], [dtype, tf.bool], stateful=True
+        )
+        image = tf.cond(
+            found,
+            lambda: cached,
+            lambda: tf.numpy_function(
+                store, [key, image_feature.decode_example(image)], dtype
+            ),
+        )
+        image.set_shape(image_feature.shape)
+        return image
+
+    return decode
+
+
+def load(
+    name: str,
+    image_key: str,
+    keys: List[str],
+    label_feature: Optional[str] = None,
+    split: str = "train",
+    batch_size: int = 32,
+    shuffle_buffer: Optional[int] = 1000,
+    cache: Optional[str] = None,
+    cache_filename: str = "",
+    data_dir: Optional[str] = None,
+    drop_remainder: bool = False,
+    seed: Optional[int] = None,
+    augment: Optional[Callable[[tf.Tensor], tf.Tensor]] = None,
+    image_cache: Optional[caching.ImageCache] = None,
+) -> tf.data.Dataset:
+    """Load a prepared dataset as batches of ``(image, label_vector)``.
+
+    Shards are interleaved and images decoded in parallel with autotuned
+    parallelism. Images are scaled to ``[0, 1]`` float32 and the labels in
+    ``keys``, read from ``label_feature`` or from the top level features, are
+    packed into a float32 vector in that order.
+
+    ``cache`` places ``tf.data.Dataset.cache`` before decoding (``"encoded"``),
+    which keeps the compact png bytes, or after it (``"decoded"``), which skips
+    decoding after the first epoch at the cost of memory. ``cache_filename``
+    caches to disk instead of memory.
+
+    ``image_cache`` keeps the decoded images that fit its budget across
+    epochs, keyed by example, see :mod:`galaxies_datasets.caching`.
+
+    ``augment`` is applied to whole batches of images, see
+    :mod:`galaxies_datasets.augmentation`.
+    """
+    check_cache(cache, image_cache)
+    builder = tfds.builder(name, data_dir=data_dir)
+    image_feature = builder.info.features[image_key]
+    encoded = codecs.is_encoded(image_feature)
+
+    read_config = tfds.ReadConfig(
+        shuffle_seed=seed,
+        interleave_cycle_length=AUTOTUNE,
+        num_parallel_calls_for_interleave_files=AUTOTUNE,
+        add_tfds_id=image_cache is not None,
+    )
+    ds = builder.as_dataset(
+        split=split,
+        shuffle_files=shuffle_buffer is not None,
+        read_config=read_config,
+        decoders={image_key: tfds.decode.SkipDecoding()} if encoded else None,
+    )
+
+    def select(example):
+        labels = example if label_feature is None else example[label_feature]
+        image = example[image_key]
+        if image_cache is not None:
+            image = (example["tfds_id"], image)
+        return image, pack_labels(labels, keys)
+
+    decode_image = image_decoder(image_feature, image_cache)
+
+    def decode(image, label):
+        image = decode_image(image)
+        return tf.cast(image, tf.float32) / 255.0, label
+
+    ds = ds.map(select, num_parallel_calls=AUTOTUNE)
+    if cache == CACHE_ENCODED:
+        ds = ds.cache(cache_filename)
+    # shuffle the small encoded images, unless a cache would freeze the order
+    if shuffle_buffer is not None and cache != CACHE_DECODED:
+        ds = ds.shuffle(shuffle_buffer, seed=seed)
+    ds = ds.map(decode, num_parallel_calls=AUTOTUNE)
+    if cache == CACHE_DECODED:
+        ds = ds.cache(cache_filename)
+        if shuffle_buffer is not None:
+            ds = ds.shuffle(shuffle_buffer, seed=seed)
+
+    ds = ds.batch(batch_size, drop_remainder=drop_remainder)
+    if augment is not None:
+        ds = ds.map(
+            lambda image, label: (augment(image), label), num_parallel_calls=AUTOTUNE
+        )
+    ds = ds.prefetch(AUTOTUNE)
+
+    options = tf.data.Options()
+    options.experimental_deterministic = seed is not None
+    return ds.with_options(options)
+
+
+def galaxy_zoo_challenge(split: str = "train", **kwargs) -> tf.data.Dataset:
+    """Galaxy Zoo challenge images with the 37 vote fractions."""
+    builder = tfds.builder("galaxy_zoo_challenge/train")
+    keys = label_keys(builder.info.features["label"])
+
+    return load(
+        "galaxy_zoo_challenge/train",
+        "image",
+        keys,
+        label_feature="label",
+        split=split,
+        **kwargs,
+    )
+
+
+def galaxy_zoo2(
+    config: str = "jpeg", split: str = "train", label: str = "debiased", **kwargs
+) -> tf.data.Dataset:
+    """Galaxy Zoo 2 images with one vote fraction per answer.
+
+    ``config`` selects the image codec, e.g. "webp". ``label`` selects the
+    table 1 fraction: "fraction", "weighted_fraction" or "debiased".
+    """
+    name = f"galaxy_zoo2/{config}"
+    builder = tfds.builder(name)
+    keys = [
+        key
+        for key in label_keys(builder.info.features["table1"], label)
+        if label != "fraction" or not key.endswith("_weighted_fraction")
+    ]
+
+    return load(name, "image", keys, label_feature="table1", split=split, **kwargs)
+
+
+def galaxy_zoo_decals(
+    config: str = "volunteers_1_and_2",
+    split: str = "train",
+    label: str = "fraction",
+    **kwargs,
+) -> tf.data.Dataset:
+    """Galaxy Zoo DECaLS images with one vote fraction per answer.
+
+    ``label`` is "fraction" or, except for the auto config, "debiased".
+    """
+    name = f"galaxy_zoo_decals/{config}"
+    builder = tfds.builder(name)
+    keys = label_keys(builder.info.features["morphology"], label)
+
+    return load(name, "image", keys, label_feature="morphology", split=split, **kwargs)
+
+
+def eagle(
+    config: str = "RefL0025N0376",
+    split: str = "train",
+    orientation: str = "face",
+    **kwargs,
+) -> tf.data.Dataset:
+    """EAGLE mock images with the galaxy sizes.
+
+    ``orientation`` is ignored for the stacked configs, which yield the three
+    orientations together.
+    """
+    name = f"eagle/{config}"
+    builder = tfds.builder(name)
+    features = builder.info.features
+    image_key = "Images" if "Images" in features else f"Image_{orientation}"
+    keys = label_keys(features["Sizes"])
+
+    return load(name, image_key, keys, label_feature="Sizes", split=split, **kwargs)
+
+
+class ThroughputReport(NamedTuple):
+    """Measured throughput of an input pipeline."""
+
+    batches: int
+    examples: int
+    seconds: float
+    cpu_seconds: float
+    cpu_count: int
+
+    @property
+    def examples_per_second(self) -> float:
+        """Examples produced per second."""
+        return self.examples / self.seconds
+
+    @property
+    def cpu_utilization(self) -> float:
+        """Fraction of the available cores kept busy, between 0 and 1."""
+        return self.cpu_seconds / (self.seconds * self.cpu_count)
+
+    def __str__(self) -> str:
+        """Human readable summary."""
+        return (
+            f"{self.batches} batches, {self.examples} examples in "
+            f"{self.seconds:.2f} s: {self.examples_per_second:.1f} examples/s, "
+            f"{self.cpu_utilization:.0%} of {self.cpu_count} cores"
+        )
+
+
+def available_cpu_count() -> int:
+    """Number of cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+def throughput_report(
+    ds: tf.data.Dataset, num_batches: int = 100, warmup_batches: int = 5
+) -> ThroughputReport:
+    """Iterate over a pipeline and measure its throughput and CPU usage.
+
+    The first ``warmup_batches`` are excluded, giving the autotuner and
+    prefetch buffers time to fill. CPU time is that of the whole process, so
+    it includes every tf.data worker thread.
+    """
+    iterator = iter(ds)
+    for _ in range(warmup_batches):
+        if next(iterator, None) is None:
+            break
+
+    batches = 0
+    examples = 0
+    start_cpu = sum(os.times()[:2])
+    start = time.perf_counter()
+    for batch in iterator:
+        examples += int(tf.shape(tf.nest.flatten(batch)[0])[0])
+        batches += 1
+        if batches == num_batches:
+            break
+    seconds = time.perf_counter() - start
+    cpu_seconds = sum(os.times()[:2]) - start_cpu
+
+    return ThroughputReport(
+        batches, examples, seconds, cpu_seconds, available_cpu_count()
+    )
@@ -3,7 +3,15 @@ import typer
 
 from galaxies_datasets.scripts import documentation
 from galaxies_datasets.scripts import eagle
+from galaxies_datasets.scripts.duplicates import duplicates
+from galaxies_datasets.scripts.prepare import prepare
+from galaxies_datasets.scripts.profile import profile_read
+from galaxies_datasets.scripts.serve import serve
 
 app = typer.Typer()
 app.add_typer(eagle.app, name="eagle")
 app.add_typer(documentation.app, name="documentation")
+app.command(name="duplicates")(duplicates.duplicates)
+app.command(name="prepare")(prepare.prepare)
+app.command(name="profile-read")(profile_read.profile_read)
+app.command(name="serve")(serve.serve)
@@ -0,0 +1 @@
+"""Deduplication scripts."""
@@ -0,0 +1,35 @@
+"""Report near-duplicate images within and between prepared datasets."""
+import os
+import pathlib
+from typing import List
+from typing import Optional
+
+import typer
+
+from galaxies_datasets import datasets  # noqa: F401
+from galaxies_datasets import duplicates as dedup
+
+
+names_arg = typer.Argument(
+    ..., help="Prepared datasets, e.g. galaxy_zoo2 galaxy_zoo_challenge/train"
+)
+radius_arg = typer.Option(
+    dedup.DEFAULT_RADIUS, help="Maximum differing bits of near-duplicate hashes"
+)
+data_dir_arg = typer.Option(None, help="tensorflow_datasets data directory")
+output_arg = typer.Option(None, help="Also write the report to this csv file")
+
+
+def duplicates(
+    names: List[str] = names_arg,
+    radius: int = radius_arg,
+    data_dir: Optional[pathlib.Path] = data_dir_arg,
+    output: Optional[pathlib.Path] = output_arg,
+) -> None:
+    """Count near-duplicate images between every pair of splits."""
+    report = dedup.duplicate_report(
+        names, radius, None if data_dir is None else os.fspath(data_dir)
+    )
+    typer.echo(report.to_string(index=False))
+    if output is not None:
+        report.to_csv(output, index=False)
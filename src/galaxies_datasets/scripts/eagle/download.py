@@ -1,9 +1,15 @@
 """Download images and data from the EAGLE simulation public database."""
 import pathlib
 import re
+import time
 from enum import Enum
 from importlib import resources
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
 from typing import Optional
+from typing import Tuple
 
 import pandas as pd
 import requests
@@ -13,6 +19,13 @@ from eagleSqlTools._eagleSqlTools import _WebDBConnection
 from requests.adapters import HTTPAdapter
 from tqdm.auto import tqdm
 
+from galaxies_datasets import shards
+from galaxies_datasets.eagle_columns import TABLE_COLUMNS
+from galaxies_datasets.scripts.eagle.query_cache import MASS_COLUMN
+from galaxies_datasets.scripts.eagle.query_cache import QueryCache
+from galaxies_datasets.scripts.eagle.telemetry import retry_statuses
+from galaxies_datasets.scripts.eagle.telemetry import Telemetry
+
 app = typer.Typer()
 
 home_path = pathlib.Path.home()
@@ -27,16 +40,67 @@ class EagleOrientation(Enum):
     box = "box"
 
 
+def mass_condition(min_mass_star: float, max_mass_star: Optional[float] = None) -> str:
+    """Compose the sql condition on the 30 kpc aperture stellar mass."""
+    condition = f"ape.Mass_Star > {min_mass_star:.2e}"
+    if max_mass_star is not None:
+        condition += f" and ape.Mass_Star <= {max_mass_star:.2e}"
+
+    return condition
+
+
+def select_columns(columns: Optional[List[str]] = None) -> str:
+    """Compose the sql projection on the table columns, all of them if None."""
+    if columns is None:
+        return "tab.*"
+    if "GalaxyID" not in columns:
+        columns = ["GalaxyID", *columns]
+
+    return ",\n    ".join(f"tab.{column}" for column in columns)
+
+
 def table_query(
-    simulation: str, snap_number: int, min_mass_star: float, table: str
+    simulation: str,
+    snap_number: int,
+    min_mass_star: float,
+    table: str,
+    max_mass_star: Optional[float] = None,
+    columns: Optional[List[str]] = None,
+    galaxy_ids: Optional[Tuple[int, int]] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None,
 ) -> str:
-    """Composes the sql query from a template."""
+    """Composes the sql query from a template.
+
+    The 30 kpc aperture stellar mass is selected along with the table columns,
+    as the `MASS_COLUMN`.
+
+    `galaxy_ids` optionally restricts the query to an inclusive GalaxyID range.
+    `after` and `limit` select the first `limit` galaxies, by GalaxyID, with a
+    GalaxyID larger than `after`, to page through a table by key.
+    """
+    condition = mass_condition(min_mass_star, max_mass_star)
+    if galaxy_ids is not None:
+        condition += (
+            f" and gal.GalaxyID between {galaxy_ids[0]:d} and {galaxy_ids[1]:d}"
+        )
+    if after is not None:
+        condition += f" and gal.GalaxyID > {after:d}"
+
+    top = order = ""
+    if limit is not None:
+        top = f" TOP {limit:d}"
+        order = "\nORDER BY\n    gal.GalaxyID"
+
     template = resources.read_text("galaxies_datasets.scripts.eagle", "table_query.sql")
     query = template.format(
+        top=top,
+        columns=f"{select_columns(columns)},\n    ape.Mass_Star as {MASS_COLUMN}",
         simulation=simulation,
         snap_number=snap_number,
-        min_mass_star=min_mass_star,
+        condition=condition,
         table=table,
+        order=order,
     )
 
     return query
@@ -48,33 +112,92 @@ def download_table(
     snap_number: int,
     min_mass_star: float,
     table: str,
+    max_mass_star: Optional[float] = None,
+    columns: Optional[List[str]] = None,
+    galaxy_ids: Optional[Tuple[int, int]] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None,
 ) -> pd.DataFrame:
     """Download a single table from the database."""
-    query = table_query(simulation, snap_number, min_mass_star, table)
+    query = table_query(
+        simulation,
+        snap_number,
+        min_mass_star,
+        table,
+        max_mass_star,
+        columns,
+        galaxy_ids,
+        after,
+        limit,
+    )
     result = connection._execute_query(query)
     df = pd.DataFrame(result)
 
     return df
 
 
+def fetch_table(
+    connection: _WebDBConnection,
+    simulation: str,
+    snap_number: int,
+    min_mass_star: float,
+    table: str,
+    cache: Optional[QueryCache] = None,
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """Download a single table, going through the cache when given."""
+
+    def fetch(low: float, high: Optional[float]) -> pd.DataFrame:
+        return download_table(
+            connection, simulation, snap_number, low, table, high, columns
+        )
+
+    if cache is None:
+        df = fetch(min_mass_star, None)
+    else:
+        df = cache.fetch(fetch, simulation, table, snap_number, min_mass_star, columns)
+
+    return df.drop(columns=MASS_COLUMN)
+
+
 def download_tables(
     connection: _WebDBConnection,
     simulation: str,
     snap_number: int,
     min_mass_star: float,
+    cache: Optional[QueryCache] = None,
+    columns: Optional[Dict[str, Optional[List[str]]]] = None,
 ) -> pd.DataFrame:
-    """Download tables and merge them."""
+    """Download tables and merge them.
+
+    Only the `columns` of each table are downloaded, by default the ones needed to
+    build the Eagle dataset. A table mapped to None is downloaded in full.
+
+    When a cache is given, tables are only downloaded for galaxies missing from it
+    and cached results fetched at a lower mass threshold are filtered locally by
+    their stellar mass.
+    """
     tables = [
         "SubHalo",
         "Sizes",
     ]
+    if columns is None:
+        columns = TABLE_COLUMNS
 
     first = True
     df_tot = None
     pbar = tqdm(tables, leave=False)
     for table in pbar:
         pbar.set_description(f"Table {table}")
-        df = download_table(connection, simulation, snap_number, min_mass_star, table)
+        df = fetch_table(
+            connection,
+            simulation,
+            snap_number,
+            min_mass_star,
+            table,
+            cache,
+            columns.get(table),
+        )
         if first:
             df_tot = df
             first = False
@@ -84,6 +207,138 @@ def download_tables(
     return df_tot
 
 
+def select_page(
+    df: pd.DataFrame,
+    galaxy_ids: Optional[Tuple[int, int]] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> pd.DataFrame:
+    """Select a page of galaxies locally, as `table_query` does in the database."""
+    if galaxy_ids is not None:
+        df = df[df["GalaxyID"].between(*galaxy_ids)]
+    if after is not None:
+        df = df[df["GalaxyID"] > after]
+    if limit is not None:
+        df = df.sort_values("GalaxyID").head(limit)
+
+    return df.reset_index(drop=True)
+
+
+def page_table(
+    connection: _WebDBConnection,
+    simulation: str,
+    snap_number: int,
+    min_mass_star: float,
+    table: str,
+    cache: Optional[QueryCache] = None,
+    columns: Optional[List[str]] = None,
+) -> Callable[..., pd.DataFrame]:
+    """Get a function selecting pages of a single table.
+
+    Pages are read from the cache when it holds the whole table, and downloaded
+    from the database otherwise.
+    """
+    cached = None
+    if cache is not None:
+        cached = cache.lookup(simulation, table, snap_number, min_mass_star, columns)
+
+    def download(**page) -> pd.DataFrame:
+        if cached is not None:
+            df = select_page(cached, **page)
+        else:
+            df = download_table(
+                connection,
+                simulation,
+                snap_number,
+                min_mass_star,
+                table,
+                columns=columns,
+                **page,
+            )
+        return df.drop(columns=MASS_COLUMN)
+
+    return download
+
+
+def download_pages(
+    connection: _WebDBConnection,
+    simulation: str,
+    snap_number: int,
+    min_mass_star: float,
+    page_size: int,
+    columns: Optional[Dict[str, Optional[List[str]]]] = None,
+    cache: Optional[QueryCache] = None,
+) -> Iterator[pd.DataFrame]:
+    """Download tables and merge them, one page of galaxies at a time.
+
+    Pages are selected by key: the first table is queried for the first
+    `page_size` galaxies after the last GalaxyID of the previous page, and the
+    other tables for the GalaxyID range of the page, so that every query and
+    merged page stays bounded in size. An empty selection yields a single
+    empty page, which still holds the columns.
+
+    When a cache is given, tables it holds in full for the mass threshold and
+    columns are paged through locally. Other tables are queried page by page and
+    not added to the cache, which would hold the whole table in memory.
+    """
+    tables = [
+        "SubHalo",
+        "Sizes",
+    ]
+    if columns is None:
+        columns = TABLE_COLUMNS
+
+    download = {
+        table: page_table(
+            connection,
+            simulation,
+            snap_number,
+            min_mass_star,
+            table,
+            cache,
+            columns.get(table),
+        )
+        for table in tables
+    }
+    first, *others = tables
+    after = None
+    with tqdm(leave=False) as pbar:
+        while True:
+            df_tot = download[first](after=after, limit=page_size)
+            n_galaxies = len(df_tot)
+            if n_galaxies > 0:
+                galaxy_ids = df_tot["GalaxyID"]
+                page = {"galaxy_ids": (int(galaxy_ids.min()), int(galaxy_ids.max()))}
+            else:
+                page = {"after": after, "limit": 0}
+            for table in others:
+                df = download[table](**page)
+                df_tot = pd.merge(df_tot, df, on="GalaxyID", how="outer")
+
+            if n_galaxies > 0 or after is None:
+                yield df_tot
+            pbar.update(n_galaxies)
+            if n_galaxies < page_size:
+                break
+            after = page["galaxy_ids"][1]
+
+
+def parse_columns(values: List[str]) -> Dict[str, Optional[List[str]]]:
+    """Parse `TABLE=COLUMN,COLUMN` column selections over the Eagle defaults.
+
+    `TABLE=*` selects all the columns of a table.
+    """
+    columns: Dict[str, Optional[List[str]]] = dict(TABLE_COLUMNS)
+    for value in values:
+        table, _, selection = value.partition("=")
+        if selection.strip() == "*":
+            columns[table] = None
+        else:
+            columns[table] = [c.strip() for c in selection.split(",") if c.strip()]
+
+    return columns
+
+
 def strip_url(url: Optional[str]) -> Optional[str]:
     """Extract the image url from the image fields in the database."""
     if url:
@@ -96,10 +351,18 @@ def clean_urls(df: pd.DataFrame) -> None:
     """Clean the image urls in the dataframe."""
     for orientation in EagleOrientation:
         column = f"Image_{orientation.value}"
-        data = df[column].str.decode("utf8").apply(strip_url)
+        # empty pages have no values to infer a string column from
+        data = df[column].astype(object).str.decode("utf8").apply(strip_url)
         df[column] = data
 
 
+def clean_urls_page(df: pd.DataFrame) -> pd.DataFrame:
+    """Clean the image urls of a page of data."""
+    clean_urls(df)
+
+    return df
+
+
 def determine_manual_dir(manual_dir: Optional[pathlib.Path] = None):
     """Determine the manual_dir."""
     if manual_dir is None:
@@ -108,6 +371,13 @@ def determine_manual_dir(manual_dir: Optional[pathlib.Path] = None):
     return manual_dir
 
 
+def get_cache_path(manual_dir: Optional[pathlib.Path] = None) -> pathlib.Path:
+    """Get the location of the query results cache."""
+    manual_dir = determine_manual_dir(manual_dir)
+
+    return manual_dir / "eagle_query_cache"
+
+
 def get_download_path(
     simulation: str,
     snap_number: int,
@@ -140,18 +410,58 @@ def save_dataframe(df: pd.DataFrame, path: pathlib.Path) -> None:
     df.to_csv(filepath, index=False)
 
 
+def save_dataframe_pages(pages: Iterator[pd.DataFrame], path: pathlib.Path) -> None:
+    """Save the data to a csv file, appending one page at a time.
+
+    The header is written with the first page, which may be empty.
+    """
+    filepath = get_data_filepath(path)
+    header = None
+    for df in pages:
+        if header is None:
+            header = list(df.columns)
+            df.to_csv(filepath, index=False)
+        else:
+            df.reindex(columns=header).to_csv(
+                filepath, mode="a", header=False, index=False
+            )
+
+
 def download_and_save_data(
     connection: _WebDBConnection,
     simulation: str,
     snap_number: int,
     min_mass_star: float,
     manual_dir: Optional[pathlib.Path] = None,
+    cache: Optional[QueryCache] = None,
+    columns: Optional[Dict[str, Optional[List[str]]]] = None,
+    page_size: Optional[int] = None,
 ) -> None:
-    """Download the data for a single snapshot."""
-    df = download_tables(connection, simulation, snap_number, min_mass_star)
-    clean_urls(df)
+    """Download the data for a single snapshot.
+
+    When a `page_size` is given the data is downloaded and written to disk one
+    page of galaxies at a time, only reading tables from the cache.
+    """
     path = get_download_path(simulation, snap_number, manual_dir)
     path.mkdir(parents=True, exist_ok=True)
+
+    if page_size is not None:
+        pages = download_pages(
+            connection,
+            simulation,
+            snap_number,
+            min_mass_star,
+            page_size,
+            columns,
+            cache,
+        )
+        save_dataframe_pages(map(clean_urls_page, pages), path)
+        return
+
+    df = download_tables(
+        connection, simulation, snap_number, min_mass_star, cache, columns
+    )
+    clean_urls(df)
     save_dataframe(df, path)
 
 
@@ -177,13 +487,55 @@ def get_filename_from_url(url: str) -> str:
     return url.split("/")[-1]
 
 
+def request_image(
+    session: requests.Session, url: str, telemetry: Optional[Telemetry] = None
+) -> requests.Response:
+    """Request an image, recording failed connections in the telemetry."""
+    start = time.perf_counter()
+    try:
+        return session.get(url, timeout=10, stream=True)
+    except requests.RequestException:
+        if telemetry is not None:
+            telemetry.record(0, time.perf_counter() - start, None)
+        raise
+
+
+def save_image(
+    response: requests.Response,
+    filename: str,
+    images_path: pathlib.Path,
+    writer: Optional[shards.ShardWriter] = None,
+) -> int:
+    """Save a downloaded image to a file or a shard, returning its size."""
+    if writer is not None:
+        content = response.content
+        writer.write(filename, content)
+        return len(content)
+
+    nbytes = 0
+    with open(images_path / filename, "wb") as f:
+        for chunk in response:
+            nbytes += len(chunk)
+            f.write(chunk)
+
+    return nbytes
+
+
 def download_images(
     simulation: str,
     snap_number: int,
     orientation: EagleOrientation,
     manual_dir: Optional[pathlib.Path] = None,
+    shard_size: Optional[int] = None,
+    telemetry: Optional[Telemetry] = None,
 ):
-    """Download the images for a specific snapshot."""
+    """Download the images for a specific snapshot.
+
+    Images are saved as loose files unless a `shard_size` (in bytes) is given, in
+    which case they are packed into indexed tar shards of at most that size.
+    Every request is recorded in the `telemetry`, when given, with the latency
+    until its response headers.
+    """
     session = requests.Session()
     session.mount("http://", HTTPAdapter(max_retries=5))
 
@@ -192,16 +544,29 @@ def download_images(
     images_path = get_images_path(simulation, snap_number, manual_dir)
     images_path.mkdir(parents=True, exist_ok=True)
 
+    writer = None
+    if shard_size is not None:
+        writer = shards.ShardWriter(images_path, orientation.value, shard_size)
+
+    if telemetry is not None:
+        telemetry.set_pending(len(urls))
+
     pbar = tqdm(urls, leave=False)
     for url in pbar:
         filename = get_filename_from_url(url)
         pbar.set_description(filename)
-        path = images_path / filename
 
-        response = session.get(url, timeout=10, stream=True)
-        with open(path, "wb") as f:
-            for chunk in response:
-                f.write(chunk)
+        start = time.perf_counter()
+        response = request_image(session, url, telemetry)
+        latency = time.perf_counter() - start
+        nbytes = save_image(response, filename, images_path, writer)
+        if telemetry is not None:
+            telemetry.record(
+                nbytes, latency, response.status_code, retry_statuses(response)
+            )
+
+    if writer is not None:
+        writer.close()
 
 
 def print_info_message(
@@ -241,6 +606,41 @@ min_mass_star_arg = typer.Option(
     1e8, help="Minimum stellar mass of galaxies to download"
 )
 manual_dir_arg = typer.Option(None, "--manual_dir", help="Where to download data.")
+columns_arg = typer.Option(
+    [],
+    "--columns",
+    help="Columns to download from a table as TABLE=COLUMN,COLUMN (TABLE=* for all)."
+    " Defaults to the columns used by the eagle dataset.",
+)
+cache_arg = typer.Option(
+    True,
+    "--cache/--no-cache",
+    help="Reuse locally cached query results, only querying missing galaxies.",
+)
+page_size_arg = typer.Option(
+    None,
+    "--page_size",
+    help="Download and save data in pages of at most this many galaxies, "
+    "bounding memory usage. Cached query results are reused, but new ones are "
+    "not cached in this mode.",
+)
+shards_arg = typer.Option(
+    False, "--shards", help="Pack images into indexed tar shards instead of files."
+)
+shard_size_arg = typer.Option(
+    1.0, "--shard_size", help="Maximum size of each image shard in GB."
+)
+metrics_file_arg = typer.Option(
+    None,
+    "--metrics_file",
+    help="Append download throughput metrics to this JSON-lines file.",
+)
+metrics_interval_arg = typer.Option(
+    10.0, "--metrics_interval", help="Seconds between metrics reports."
+)
+metrics_port_arg = typer.Option(
+    None, "--metrics_port", help="Serve the latest metrics on this local HTTP port."
+)
 
 
 @app.command()
@@ -251,6 +651,14 @@ def download(
     stop_snap_number: int = stop_snap_number_arg,
     min_mass_star: float = min_mass_star_arg,
     manual_dir: pathlib.Path = manual_dir_arg,
+    columns: List[str] = columns_arg,
+    use_cache: bool = cache_arg,
+    page_size: Optional[int] = page_size_arg,
+    use_shards: bool = shards_arg,
+    shard_size: float = shard_size_arg,
+    metrics_file: Optional[pathlib.Path] = metrics_file_arg,
+    metrics_interval: float = metrics_interval_arg,
+    metrics_port: Optional[int] = metrics_port_arg,
 ) -> None:
     """Download images and data from the EAGLE simulation public database."""
     print_info_message(
@@ -258,16 +666,47 @@ def download(
     )
     connection = connect(user)
 
-    pbar = tqdm(range(start_snap_number, stop_snap_number))
-    for snap_number in pbar:
-        pbar.set_description(f"Snapshot #{snap_number}")
-        download_and_save_data(
-            connection, simulation, snap_number, min_mass_star, manual_dir
-        )
-        orientation_pbar = tqdm(EagleOrientation)
-        for orientation in orientation_pbar:
-            orientation_pbar.set_description(f"Orientation {orientation.value}")
-            download_images(simulation, snap_number, orientation, manual_dir)
+    table_columns = parse_columns(columns)
+    cache = QueryCache(get_cache_path(manual_dir)) if use_cache else None
+    shard_bytes = int(shard_size * 1024**3) if use_shards else None
+    telemetry = None
+    if metrics_file is not None or metrics_port is not None:
+        telemetry = Telemetry(metrics_file, metrics_interval, metrics_port).start()
+
+    try:
+        pbar = tqdm(range(start_snap_number, stop_snap_number))
+        for snap_number in pbar:
+            pbar.set_description(f"Snapshot #{snap_number}")
+            download_and_save_data(
+                connection,
+                simulation,
+                snap_number,
+                min_mass_star,
+                manual_dir,
+                cache,
+                table_columns,
+                page_size,
+            )
+            if telemetry is not None:
+                num_images = sum(
+                    len(get_urls(simulation, snap_number, orientation, manual_dir))
+                    for orientation in EagleOrientation
+                )
+                telemetry.start_snapshot(snap_number, num_images)
+            orientation_pbar = tqdm(EagleOrientation)
+            for orientation in orientation_pbar:
+                orientation_pbar.set_description(f"Orientation {orientation.value}")
+                download_images(
+                    simulation,
+                    snap_number,
+                    orientation,
+                    manual_dir,
+                    shard_bytes,
+                    telemetry,
+                )
+    finally:
+        if telemetry is not None:
+            telemetry.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,157 @@
+"""Local cache of EAGLE database query results."""
+import pathlib
+from typing import Callable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+import pandas as pd
+
+Fetch = Callable[[float, Optional[float]], pd.DataFrame]
+
+# the table queries also select the 30 kpc aperture stellar mass under this name,
+# so that cached rows can be filtered by mass locally
+MASS_COLUMN = "ApertureMass_Star"
+
+
+class CacheEntry(NamedTuple):
+    """Cached rows of all galaxies above a stellar mass threshold.
+
+    `columns` lists the columns that were downloaded, None meaning all of them.
+    """
+
+    data: pd.DataFrame
+    min_mass_star: float
+    columns: Optional[List[str]] = None
+
+    def covers(self, columns: Optional[List[str]]) -> bool:
+        """Whether the entry holds all the requested columns."""
+        if self.columns is None:
+            return True
+        if columns is None:
+            return False
+
+        return set(columns) <= set(self.columns)
+
+    def select(
+        self, min_mass_star: float, columns: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        """Select the rows above a stellar mass threshold and the given columns."""
+        data = self.data[self.data[MASS_COLUMN] > min_mass_star]
+        if columns is not None and self.columns != columns:
+            keep = {"GalaxyID", MASS_COLUMN, *columns}
+            data = data[[c for c in data if c in keep]]
+
+        return data.reset_index(drop=True)
+
+
+def queried_mass(mass_star: float) -> float:
+    """Stellar mass threshold as it is written in the sql queries."""
+    return float(f"{mass_star:.2e}")
+
+
+class QueryCache:
+    """On-disk cache of query results keyed by simulation, table and snapshot.
+
+    An entry fetched at a given stellar mass threshold holds a superset of the
+    rows for any higher threshold, so it can be reused by filtering locally on
+    its `MASS_COLUMN`.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        """Set the cache location."""
+        self.path = path
+
+    def get_entry_path(
+        self, simulation: str, table: str, snap_number: int
+    ) -> pathlib.Path:
+        """Get the path of a single cache entry."""
+        return self.path / simulation / table / f"{snap_number}.pkl"
+
+    def load(
+        self, simulation: str, table: str, snap_number: int
+    ) -> Optional[CacheEntry]:
+        """Load an entry, if present.
+
+        Entries cached without the `MASS_COLUMN` cannot be filtered and are
+        ignored, to be fetched again.
+        """
+        path = self.get_entry_path(simulation, table, snap_number)
+        if not path.exists():
+            return None
+
+        entry = CacheEntry(**pd.read_pickle(path))
+        if MASS_COLUMN not in entry.data:
+            return None
+
+        return entry
+
+    def save(
+        self,
+        simulation: str,
+        table: str,
+        snap_number: int,
+        entry: CacheEntry,
+    ) -> None:
+        """Save an entry, replacing any previous one."""
+        path = self.get_entry_path(simulation, table, snap_number)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        pd.to_pickle(entry._asdict(), path)
+
+    def fetch(
+        self,
+        fetch: Fetch,
+        simulation: str,
+        table: str,
+        snap_number: int,
+        min_mass_star: float,
+        columns: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """Fetch rows above a stellar mass threshold through the cache.
+
+        `fetch(min_mass_star, max_mass_star)` downloads the requested `columns`,
+        along with the `MASS_COLUMN`, and is only called for rows missing from the
+        cache: the galaxies between the requested and the cached thresholds, or
+        everything when there is no entry with matching columns.
+        """
+        min_mass_star = queried_mass(min_mass_star)
+        entry = self.load(simulation, table, snap_number)
+
+        lower = entry is not None and min_mass_star < entry.min_mass_star
+        if (
+            entry is None
+            or not entry.covers(columns)
+            or (lower and entry.columns != columns)
+        ):
+            entry = CacheEntry(fetch(min_mass_star, None), min_mass_star, columns)
+            self.save(simulation, table, snap_number, entry)
+        elif lower:
+            delta = fetch(min_mass_star, entry.min_mass_star)
+            data = pd.concat([entry.data, delta], ignore_index=True)
+            entry = CacheEntry(data, min_mass_star, entry.columns)
+            self.save(simulation, table, snap_number, entry)
+
+        return entry.select(min_mass_star, columns)
+
+    def lookup(
+        self,
+        simulation: str,
+        table: str,
+        snap_number: int,
+        min_mass_star: float,
+        columns: Optional[List[str]] = None,
+    ) -> Optional[pd.DataFrame]:
+        """Rows above a stellar mass threshold, if the cache holds all of them.
+
+        Unlike `fetch`, nothing is downloaded or saved.
+        """
+        min_mass_star = queried_mass(min_mass_star)
+        entry = self.load(simulation, table, snap_number)
+        if (
+            entry is None
+            or min_mass_star < entry.min_mass_star
+            or not entry.covers(columns)
+        ):
+            return None
+
+        return entry.select(min_mass_star, columns)
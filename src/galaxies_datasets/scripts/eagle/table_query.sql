@@ -1,12 +1,12 @@
-SELECT
-    tab.*
+SELECT{top:s}
+    {columns:s}
 FROM
     {simulation:s}_SubHalo as gal,
     {simulation:s}_Aperture as ape,
     {simulation:s}_{table:s} as tab
 WHERE
     gal.SnapNum = {snap_number:d} and
-    ape.Mass_Star > {min_mass_star:.2e} and
+    {condition:s} and
     ape.ApertureSize = 30 and
     gal.GalaxyID = ape.GalaxyID and
-    gal.GalaxyID = tab.GalaxyID
+    gal.GalaxyID = tab.GalaxyID{order:s}
@@ -0,0 +1,204 @@
+"""Throughput metrics of EAGLE image downloads.
+
+Metrics are appended as one JSON object per line to a file every
+``interval`` seconds, and optionally served as JSON on a local HTTP port,
+e.g. ``curl localhost:8000``. Rates and latency percentiles cover the last
+interval and the last requests, so stalls show up as they happen.
+"""
+import collections
+import http.server
+import json
+import pathlib
+import threading
+import time
+from typing import Counter
+from typing import Deque
+from typing import Dict
+from typing import Optional
+
+import numpy as np
+import requests
+
+LATENCY_WINDOW = 1024
+PERCENTILES = (50, 90, 99)
+
+
+def retry_statuses(response: requests.Response) -> Counter:
+    """Count the retries of a request by status code, or error name."""
+    retries = getattr(response.raw, "retries", None)
+    history = getattr(retries, "history", None) or ()
+    return collections.Counter(
+        str(attempt.status) if attempt.status else type(attempt.error).__name__
+        for attempt in history
+    )
+
+
+class Telemetry:
+    """Running download metrics, written periodically and served over HTTP.
+
+    Use as a context manager, or call :meth:`start` and :meth:`close`.
+    """
+
+    def __init__(
+        self,
+        path: Optional[pathlib.Path] = None,
+        interval: float = 10.0,
+        port: Optional[int] = None,
+    ):
+        """Set where and how often metrics are reported.
+
+        Args:
+            path: JSON-lines file metrics are appended to.
+            interval: seconds between reports.
+            port: local HTTP port serving the latest metrics, 0 for any free
+                port.
+        """
+        self.path = path
+        self.interval = interval
+        self.port = port
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        self._server: Optional[http.server.ThreadingHTTPServer] = None
+
+        self._start = time.monotonic()
+        self._images = 0
+        self._bytes = 0
+        self._latencies: Deque[float] = collections.deque(maxlen=LATENCY_WINDOW)
+        self._retries: Counter = collections.Counter()
+        self._errors: Counter = collections.Counter()
+        self._snapshot: Optional[int] = None
+        self._snapshot_total = 0
+        self._snapshot_done = 0
+        self._pending = 0
+        self._last = (self._start, 0, 0)
+        self._latest: Dict = {}
+
+    def start_snapshot(self, snap_number: int, num_images: int) -> None:
+        """Start counting the images of a snapshot."""
+        with self._lock:
+            self._snapshot = snap_number
+            self._snapshot_total = num_images
+            self._snapshot_done = 0
+
+    def set_pending(self, pending: int) -> None:
+        """Set the number of images queued for download."""
+        with self._lock:
+            self._pending = pending
+
+    def record(
+        self,
+        nbytes: int,
+        latency: float,
+        status: Optional[int],
+        retries: Optional[Counter] = None,
+    ) -> None:
+        """Record a finished request, with its status code if it got one."""
+        with self._lock:
+            self._latencies.append(latency)
+            self._retries.update(retries or {})
+            if status is None or status >= 400:
+                self._errors[str(status or "connection")] += 1
+                return
+            self._images += 1
+            self._bytes += nbytes
+            self._snapshot_done += 1
+            self._pending = max(self._pending - 1, 0)
+
+    def metrics(self) -> Dict:
+        """Current metrics, rates being since the previous call."""
+        with self._lock:
+            now = time.monotonic()
+            last_time, last_images, last_bytes = self._last
+            elapsed = max(now - last_time, 1e-9)
+            images_per_second = (self._images - last_images) / elapsed
+            self._last = (now, self._images, self._bytes)
+            remaining = self._snapshot_total - self._snapshot_done
+            latencies = np.asarray(self._latencies)
+            metrics = {
+                "time": time.time(),
+                "elapsed_seconds": now - self._start,
+                "images": self._images,
+                "bytes": self._bytes,
+                "images_per_second": images_per_second,
+                "bytes_per_second": (self._bytes - last_bytes) / elapsed,
+                "latency_ms": {
+                    f"p{p}": float(np.percentile(latencies, p) * 1000)
+                    if len(latencies)
+                    else None
+                    for p in PERCENTILES
+                },
+                "retries": dict(self._retries),
+                "errors": dict(self._errors),
+                "pending": self._pending,
+                "snapshot": self._snapshot,
+                "snapshot_images": self._snapshot_done,
+                "snapshot_total": self._snapshot_total,
+                "snapshot_eta_seconds": remaining / images_per_second
+                if images_per_second > 0
+                else None,
+            }
+            self._latest = metrics
+            return metrics
+
+    def write(self) -> None:
+        """Append the current metrics to the file."""
+        metrics = self.metrics()
+        if self.path is not None:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(metrics) + "\n")
+
+    def _report(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self) -> "Telemetry":
+        """Start reporting in the background."""
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.port is not None:
+            self._server = http.server.ThreadingHTTPServer(
+                ("localhost", self.port), _handler(self)
+            )
+            self.port = self._server.server_address[1]
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self._writer = threading.Thread(target=self._report, daemon=True)
+        self._writer.start()
+        return self
+
+    def close(self) -> None:
+        """Write the final metrics and stop reporting."""
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.join()
+        self.write()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self) -> "Telemetry":
+        """Start reporting."""
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        """Stop reporting."""
+        self.close()
+
+
+def _handler(telemetry: Telemetry):
+    """Request handler serving the latest metrics."""
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802
+            with telemetry._lock:
+                body = json.dumps(telemetry._latest or {}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
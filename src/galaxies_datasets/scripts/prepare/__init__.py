@@ -0,0 +1 @@
+"""Preparation scripts."""
@@ -0,0 +1,270 @@
+"""Prepare several datasets and configs in parallel."""
+import concurrent.futures
+import multiprocessing
+import os
+import pathlib
+import time
+import traceback
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_datasets as tfds
+import typer
+
+from galaxies_datasets import pipelines
+from galaxies_datasets.scripts.documentation.build_catalog import list_datasets
+
+# tensorflow runtime of a job
+BASE_MEMORY_GB = 1.0
+# the tensorflow_datasets shuffler keeps up to 1 GB of examples in memory
+SHUFFLE_BUFFER_GB = 1.0
+# upper bound, for configs of unknown size
+MEMORY_PER_JOB_GB = BASE_MEMORY_GB + SHUFFLE_BUFFER_GB
+# assumed available memory, where it cannot be read
+DEFAULT_MEMORY_GB = 2 * MEMORY_PER_JOB_GB
+# assumed size of a string feature
+STRING_BYTES = 64
+# approximate number of examples of the datasets, by dataset or config name
+NUM_EXAMPLES = {
+    "galaxy_zoo2": 243_500,
+    "galaxy_zoo_challenge/train": 61_578,
+    "galaxy_zoo_challenge/test": 79_975,
+    "galaxy_zoo_decals": 314_000,
+}
+
+
+class JobResult(NamedTuple):
+    """Outcome of preparing a single config."""
+
+    name: str
+    seconds: float
+    num_examples: int
+    error: Optional[str] = None
+
+
+def all_configs() -> List[str]:
+    """Names of every config of every dataset."""
+    return [name for _, value in list_datasets() for name in expand_name(value.name)]
+
+
+def expand_name(name: str) -> List[str]:
+    """Expand a dataset name without config to all of its configs."""
+    if "/" in name:
+        return [name]
+
+    builder_class = tfds.builder_cls(name)
+    if not builder_class.BUILDER_CONFIGS:
+        return [name]
+
+    return [f"{name}/{config.name}" for config in builder_class.BUILDER_CONFIGS]
+
+
+def available_memory_gb() -> Optional[float]:
+    """Memory available to new processes, in GB, or None if unknown.
+
+    Read from /proc/meminfo on Linux, else the physical memory from sysconf,
+    which Windows does not have.
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024**2
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024**3
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def example_bytes(features: tfds.features.FeatureConnector) -> int:
+    """Upper bound of the size of an example, with its images decoded."""
+    total = 0
+    for tensor_info in tf.nest.flatten(features.get_tensor_info()):
+        size = int(np.prod([dim or 1 for dim in tensor_info.shape]))
+        dtype = tf.as_dtype(tensor_info.dtype)
+        total += size * (STRING_BYTES if dtype == tf.string else dtype.size)
+
+    return total
+
+
+def estimate_memory_gb(name: str, data_dir: Optional[str] = None) -> float:
+    """Estimated memory of preparing a config, in GB.
+
+    The shuffler holds the examples in memory up to its buffer size, so the
+    estimate is the size of the examples, from the features of the config and
+    its number of examples, capped by the buffer. Configs of unknown size get
+    the upper bound.
+    """
+    builder = tfds.builder(name, data_dir=data_dir)
+    num_examples = sum(split.num_examples for split in builder.info.splits.values())
+    if not num_examples:
+        num_examples = NUM_EXAMPLES.get(name, NUM_EXAMPLES.get(name.split("/")[0]))
+    if not num_examples:
+        return MEMORY_PER_JOB_GB
+
+    buffered_gb = example_bytes(builder.info.features) * num_examples / 1024**3
+    return BASE_MEMORY_GB + min(SHUFFLE_BUFFER_GB, buffered_gb)
+
+
+def plan_jobs(
+    num_configs: int,
+    jobs: Optional[int] = None,
+    memory_gb: Optional[float] = None,
+    memory_per_job_gb: float = MEMORY_PER_JOB_GB,
+) -> int:
+    """Number of parallel jobs fitting in the cores and the memory.
+
+    ``memory_gb`` defaults to the available memory, or `DEFAULT_MEMORY_GB`
+    if unknown.
+    """
+    if jobs is None:
+        jobs = pipelines.available_cpu_count()
+    if memory_gb is None:
+        memory_gb = available_memory_gb()
+    if memory_gb is None:
+        memory_gb = DEFAULT_MEMORY_GB
+    by_memory = max(1, int(memory_gb // memory_per_job_gb))
+
+    return max(1, min(jobs, by_memory, num_configs))
+
+
+def prepare_config(
+    name: str,
+    data_dir: Optional[str] = None,
+    manual_dir: Optional[str] = None,
+) -> JobResult:
+    """Prepare a single config, reporting errors instead of raising them."""
+    tfds.disable_progress_bar()
+    start = time.perf_counter()
+    try:
+        builder = tfds.builder(name, data_dir=data_dir)
+        builder.download_and_prepare(
+            download_config=tfds.download.DownloadConfig(manual_dir=manual_dir)
+        )
+        num_examples = sum(split.num_examples for split in builder.info.splits.values())
+    except Exception:
+        return JobResult(name, time.perf_counter() - start, 0, traceback.format_exc())
+
+    return JobResult(name, time.perf_counter() - start, num_examples)
+
+
+def format_summary(results: List[JobResult], seconds: float) -> str:
+    """Table of the per config timings."""
+    width = max(len(result.name) for result in results)
+    lines = [f"{'config':<{width}}  {'status':<6}  {'examples':>9}  {'seconds':>9}"]
+    for result in results:
+        status = "failed" if result.error else "ok"
+        lines.append(
+            f"{result.name:<{width}}  {status:<6}  "
+            f"{result.num_examples:>9}  {result.seconds:>9.1f}"
+        )
+    total = sum(result.seconds for result in results)
+    lines.append(f"{len(results)} configs in {seconds:.1f} s ({total:.1f} s of jobs)")
+
+    return "\n".join(lines)
+
+
+def run(
+    names: List[str],
+    jobs: int = 1,
+    data_dir: Optional[str] = None,
+    manual_dir: Optional[str] = None,
+) -> List[JobResult]:
+    """Prepare configs across a pool of processes, echoing their progress.
+
+    A single job prepares them in this process. Otherwise each config is
+    prepared in a fresh process, as TensorFlow does not survive forking.
+    """
+    results = []
+
+    def report(result):
+        results.append(result)
+        status = "failed" if result.error else f"done in {result.seconds:.1f} s"
+        typer.echo(f"[{len(results)}/{len(names)}] {result.name} {status}")
+
+    if jobs == 1:
+        for name in names:
+            report(prepare_config(name, data_dir, manual_dir))
+        return results
+
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(jobs, mp_context=context) as pool:
+        futures = [
+            pool.submit(prepare_config, name, data_dir, manual_dir) for name in names
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            report(future.result())
+
+    order = {name: i for i, name in enumerate(names)}
+    return sorted(results, key=lambda result: order[result.name])
+
+
+names_arg = typer.Argument(
+    None, help="Datasets or configs, e.g. eagle/RefL0025N0376 or galaxy_zoo_decals"
+)
+all_arg = typer.Option(False, "--all", help="Prepare every config of every dataset.")
+jobs_arg = typer.Option(
+    None, "--jobs", "-j", help="Maximum parallel jobs. Defaults to the cores."
+)
+memory_per_job_arg = typer.Option(
+    None,
+    "--memory_per_job",
+    help="Memory of a job in GB, limiting the jobs to the free memory. "
+    "Defaults to the largest estimate of the configs.",
+)
+memory_arg = typer.Option(
+    None,
+    "--memory_gb",
+    help="Memory in GB the jobs may use. Defaults to the available memory.",
+)
+data_dir_arg = typer.Option(None, "--data_dir", help="Where to prepare datasets.")
+manual_dir_arg = typer.Option(
+    None, "--manual_dir", help="Where manually downloaded data is."
+)
+
+
+def prepare(
+    names: Optional[List[str]] = names_arg,
+    all_datasets: bool = all_arg,
+    jobs: Optional[int] = jobs_arg,
+    memory_per_job: Optional[float] = memory_per_job_arg,
+    memory_gb: Optional[float] = memory_arg,
+    data_dir: Optional[pathlib.Path] = data_dir_arg,
+    manual_dir: Optional[pathlib.Path] = manual_dir_arg,
+) -> None:
+    """Prepare datasets, scheduling their configs across processes."""
+    if all_datasets:
+        configs = all_configs()
+    else:
+        configs = [config for name in names or [] for config in expand_name(name)]
+    if not configs:
+        raise typer.BadParameter("Give datasets to prepare, or --all")
+
+    data_dir_str = None if data_dir is None else os.fspath(data_dir)
+    if memory_per_job is None:
+        memory_per_job = max(
+            estimate_memory_gb(config, data_dir_str) for config in configs
+        )
+    num_jobs = plan_jobs(len(configs), jobs, memory_gb, memory_per_job)
+    typer.echo(f"Preparing {len(configs)} configs with {num_jobs} jobs")
+
+    start = time.perf_counter()
+    results = run(
+        configs,
+        num_jobs,
+        data_dir_str,
+        None if manual_dir is None else os.fspath(manual_dir),
+    )
+    typer.echo(format_summary(results, time.perf_counter() - start))
+
+    failed = [result for result in results if result.error]
+    for result in failed:
+        typer.secho(f"{result.name} failed:\n{result.error}", fg=typer.colors.RED)
+    if failed:
+        raise typer.Exit(code=1)
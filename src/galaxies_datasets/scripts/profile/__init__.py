@@ -0,0 +1 @@
+"""Profiling scripts."""
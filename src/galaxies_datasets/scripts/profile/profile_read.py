@@ -0,0 +1,257 @@
+"""Profile the read path of a prepared dataset."""
+import json
+import os
+import pathlib
+import platform
+import time
+from typing import Dict
+from typing import Iterable
+from typing import NamedTuple
+from typing import Optional
+
+import tensorflow as tf
+import tensorflow_datasets as tfds
+import typer
+
+from galaxies_datasets import codecs
+from galaxies_datasets import datasets  # noqa: F401
+from galaxies_datasets import pipelines
+
+# each stage adds one step to the previous one
+STAGES = {
+    "read": "read the serialized records",
+    "parse": "parse every feature, keeping images encoded",
+    "decode": "decode the images",
+    "unpack": "convert the nested dictionaries to numpy",
+}
+
+
+class StageReport(NamedTuple):
+    """Measured cost of a read stage."""
+
+    examples: int
+    bytes: int
+    seconds: float
+    cpu_seconds: float
+
+    def to_dict(self, previous: Optional["StageReport"] = None) -> Dict:
+        """Summary that can be stored as JSON."""
+        latency = self.seconds / self.examples
+        summary = {
+            "examples": self.examples,
+            "seconds": self.seconds,
+            "examples_per_second": self.examples / self.seconds,
+            "mb_per_second": self.bytes / self.seconds / 1e6,
+            "latency_ms": latency * 1e3,
+            "cpu_utilization": self.cpu_seconds
+            / (self.seconds * pipelines.available_cpu_count()),
+        }
+        if previous is not None:
+            summary["added_latency_ms"] = (
+                latency - previous.seconds / previous.examples
+            ) * 1e3
+
+        return summary
+
+
+def flat_serialized_info(serialized_info, prefix: str = "") -> Dict:
+    """Serialized tensors of the features, named as their tf.train.Example keys."""
+    flat = {}
+    for key, value in serialized_info.items():
+        if isinstance(value, dict):
+            flat.update(flat_serialized_info(value, f"{prefix}{key}/"))
+        else:
+            flat[f"{prefix}{key}"] = value
+
+    return flat
+
+
+def example_feature(tensor_info) -> tf.io.VarLenFeature:
+    """Parsing spec reading a serialized tensor as stored."""
+    dtype = tf.as_dtype(getattr(tensor_info, "tf_dtype", None) or tensor_info.dtype)
+    if dtype == tf.string:
+        return tf.io.VarLenFeature(tf.string)
+    if dtype.is_floating:
+        return tf.io.VarLenFeature(tf.float32)
+
+    return tf.io.VarLenFeature(tf.int64)
+
+
+def measure(batches: Iterable) -> StageReport:
+    """Iterate over batches of examples, measuring time and CPU usage.
+
+    Batches hold ``(record_bytes, example)`` pairs.
+    """
+    examples = 0
+    total_bytes = 0
+    start_cpu = sum(os.times()[:2])
+    start = time.perf_counter()
+    for sizes, _ in batches:
+        examples += len(sizes)
+        total_bytes += int(sum(sizes))
+    seconds = time.perf_counter() - start
+    cpu_seconds = sum(os.times()[:2]) - start_cpu
+
+    return StageReport(examples, total_bytes, seconds, cpu_seconds)
+
+
+def stage_dataset(
+    builder: tfds.core.DatasetBuilder,
+    stage: str,
+    split: str = "train",
+    num_examples: Optional[int] = None,
+    batch_size: int = 32,
+    parallel_reads: int = 4,
+) -> tf.data.Dataset:
+    """Read pipeline up to a stage, yielding ``(record_bytes, example)`` batches."""
+    features = builder.info.features
+    encoded = {
+        key: tfds.decode.SkipDecoding()
+        for key, feature in features.items()
+        if codecs.is_encoded(feature)
+    }
+    files = [
+        os.fspath(builder.data_path / filename)
+        for filename in builder.info.splits[split].filenames
+    ]
+
+    ds = tf.data.Dataset.from_tensor_slices(files).interleave(
+        tf.data.TFRecordDataset,
+        cycle_length=parallel_reads,
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=True,
+    )
+    if num_examples is not None:
+        ds = ds.take(num_examples)
+
+    def parse(record):
+        decoders = encoded if stage == "parse" else None
+        return features.deserialize_example(record, decoders=decoders)
+
+    if stage == "read":
+        ds = ds.map(lambda record: (tf.strings.length(record), record))
+    else:
+        ds = ds.map(
+            lambda record: (tf.strings.length(record), parse(record)),
+            num_parallel_calls=tf.data.AUTOTUNE,
+        )
+
+    return ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def feature_costs(
+    builder: tfds.core.DatasetBuilder,
+    split: str = "train",
+    num_examples: int = 256,
+    repeats: int = 10,
+) -> Dict[str, float]:
+    """Parsing cost of every serialized feature, in microseconds per example.
+
+    Features are parsed one at a time from records held in memory, so that
+    file reads do not blur the comparison. Sorted from the most expensive.
+    """
+    files = [
+        os.fspath(builder.data_path / filename)
+        for filename in builder.info.splits[split].filenames
+    ]
+    records = tf.stack(list(tf.data.TFRecordDataset(files).take(num_examples)))
+    serialized_info = flat_serialized_info(builder.info.features.get_serialized_info())
+
+    costs = {}
+    for key, tensor_info in serialized_info.items():
+        spec = {key: example_feature(tensor_info)}
+        parse = tf.function(lambda records: tf.io.parse_example(records, spec))
+        parse(records)  # trace
+        start = time.perf_counter()
+        for _ in range(repeats):
+            parse(records)
+        seconds = time.perf_counter() - start
+        costs[key] = seconds / (repeats * len(records)) * 1e6
+
+    return dict(sorted(costs.items(), key=lambda item: -item[1]))
+
+
+def profile(
+    name: str,
+    split: str = "train",
+    data_dir: Optional[str] = None,
+    num_examples: Optional[int] = None,
+    batch_size: int = 32,
+    parallel_reads: int = 4,
+    per_feature: bool = True,
+) -> Dict:
+    """Profile every read stage of a prepared dataset."""
+    builder = tfds.builder(name, data_dir=data_dir)
+
+    stages = {}
+    previous = None
+    for stage in STAGES:
+        ds = stage_dataset(
+            builder, stage, split, num_examples, batch_size, parallel_reads
+        )
+        batches = tfds.as_numpy(ds) if stage == "unpack" else ds
+        report = measure(batches)
+        stages[stage] = {"description": STAGES[stage], **report.to_dict(previous)}
+        previous = report
+
+    result = {
+        "dataset": name,
+        "split": split,
+        "options": {
+            "num_examples": num_examples,
+            "batch_size": batch_size,
+            "parallel_reads": parallel_reads,
+        },
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": pipelines.available_cpu_count(),
+            "tensorflow": tf.__version__,
+        },
+        "stages": stages,
+    }
+    if per_feature:
+        result["feature_parse_us"] = feature_costs(builder, split)
+
+    return result
+
+
+dataset_arg = typer.Argument(
+    ..., help="Prepared dataset, e.g. galaxy_zoo_decals/volunteers_5"
+)
+split_arg = typer.Option("train", help="Split to read")
+data_dir_arg = typer.Option(None, help="tensorflow_datasets data directory")
+num_examples_arg = typer.Option(None, help="Read at most this many examples")
+batch_size_arg = typer.Option(32, help="Examples per batch")
+parallel_reads_arg = typer.Option(4, help="Number of files read in parallel")
+per_feature_arg = typer.Option(True, help="Measure the parsing cost of every feature")
+output_arg = typer.Option(
+    None, help="Write the JSON report to this file instead of stdout"
+)
+
+
+def profile_read(
+    dataset: str = dataset_arg,
+    split: str = split_arg,
+    data_dir: Optional[pathlib.Path] = data_dir_arg,
+    num_examples: Optional[int] = num_examples_arg,
+    batch_size: int = batch_size_arg,
+    parallel_reads: int = parallel_reads_arg,
+    per_feature: bool = per_feature_arg,
+    output: Optional[pathlib.Path] = output_arg,
+) -> None:
+    """Profile the read path of a prepared dataset, reporting JSON."""
+    result = profile(
+        dataset,
+        split,
+        None if data_dir is None else os.fspath(data_dir),
+        num_examples,
+        batch_size,
+        parallel_reads,
+        per_feature,
+    )
+    report = json.dumps(result, indent=2)
+    if output is None:
+        typer.echo(report)
+    else:
+        output.write_text(report + "\n")
@@ -0,0 +1 @@
+"""Data serving scripts."""
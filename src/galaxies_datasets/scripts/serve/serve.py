@@ -0,0 +1,58 @@
+"""Serve a prepared dataset to local trainer processes."""
+import os
+import pathlib
+from typing import Optional
+
+import typer
+
+
+dataset_arg = typer.Argument(
+    ..., help="Prepared dataset, e.g. galaxy_zoo_decals/volunteers_5"
+)
+name_arg = typer.Option(..., help="Name the clients connect to, unique on the machine")
+consumers_arg = typer.Option(1, help="Number of clients")
+split_arg = typer.Option("train", help="Split to serve")
+batch_size_arg = typer.Option(32, help="Examples per batch")
+epochs_arg = typer.Option(1, help="Epochs to serve, forever if 0")
+window_arg = typer.Option(
+    4096, help="Decoded examples shuffled together for each client"
+)
+num_slots_arg = typer.Option(
+    8, help="Batches buffered in shared memory for each client"
+)
+max_lag_arg = typer.Option(2, help="Windows a client may fall behind the fastest one")
+seed_arg = typer.Option(0, help="Shuffle seed of the first client")
+data_dir_arg = typer.Option(None, help="tensorflow_datasets data directory")
+
+
+def serve(
+    dataset: str = dataset_arg,
+    name: str = name_arg,
+    consumers: int = consumers_arg,
+    split: str = split_arg,
+    batch_size: int = batch_size_arg,
+    epochs: Optional[int] = epochs_arg,
+    window: int = window_arg,
+    num_slots: int = num_slots_arg,
+    max_lag: int = max_lag_arg,
+    seed: int = seed_arg,
+    data_dir: Optional[pathlib.Path] = data_dir_arg,
+) -> None:
+    """Read and decode a dataset once, serving batches to local clients."""
+    # shared memory needs Python 3.8, which the other commands do not
+    from galaxies_datasets import serving
+
+    typer.echo(f"Serving {dataset} to {consumers} clients as {name!r}")
+    serving.serve(
+        name,
+        dataset,
+        split,
+        num_consumers=consumers,
+        batch_size=batch_size,
+        epochs=epochs or None,
+        window=window,
+        num_slots=num_slots,
+        max_lag=max_lag,
+        seed=seed,
+        data_dir=None if data_dir is None else os.fspath(data_dir),
+    )
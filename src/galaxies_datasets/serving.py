@@ -0,0 +1,650 @@
+"""Serve decoded batches of a prepared dataset to several local processes.
+
+A single server process reads and decodes a dataset once and publishes
+batches to every consumer through its own shared-memory ring buffer, so that
+trainers running side by side on one machine, e.g. in a hyperparameter
+sweep, do not each read and decode the same shards::
+
+    $ galaxies_datasets serve galaxy_zoo_decals/volunteers_5 --name gzd --consumers 8
+
+and in trainer ``i``::
+
+    for batch in serving.Client("gzd", consumer=i):
+        ...
+
+Each consumer sees every example once per epoch, in its own order: decoded
+examples are held in windows of ``window`` examples, shared by the consumers,
+which each shuffle their order. A consumer may fall ``max_lag`` windows
+behind the fastest one before holding it back, and consumers that close
+their client or die, as told by a heartbeat in their ring, are dropped. Only
+features with a fixed shape and a numeric dtype are served, flattened with
+``/`` separators. Serving requires Python 3.8 or later, for
+:mod:`multiprocessing.shared_memory`.
+"""
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import datasets  # noqa: F401
+from galaxies_datasets import sidecar
+
+# ring header: written and read batch counts, closed flag, heartbeats of the
+# producer and the consumer, detached flag, then slot sizes
+_WRITTEN = 0
+_READ = 1
+_CLOSED = 2
+_PRODUCER_BEAT = 3
+_CONSUMER_BEAT = 4
+_DETACHED = 5
+_HEADER_FIELDS = 6
+_ALIGNMENT = 64
+_END_OF_EPOCH = "end of epoch"
+_POLL_INTERVAL = 0.0005
+_MAX_POLL_INTERVAL = 0.05
+_HEARTBEAT_INTERVAL = 0.5
+HEARTBEAT_TIMEOUT = 30.0
+
+
+def spec_name(name: str) -> str:
+    """Name of the shared memory block holding the spec of a server."""
+    return f"{name}_spec"
+
+
+def ring_name(name: str, consumer: int) -> str:
+    """Name of the shared memory block holding the ring of a consumer."""
+    return f"{name}_{consumer}"
+
+
+def attach(name: str) -> shared_memory.SharedMemory:
+    """Attach to an existing shared memory block without owning it."""
+    shm = shared_memory.SharedMemory(name=name)
+    if os.name == "posix":
+        # Attaching registers the block with the resource tracker, which
+        # would unlink it when this process exits
+        # (https://bugs.python.org/issue39959). There is no tracker elsewhere.
+        resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore
+    return shm
+
+
+def _aligned(size: int) -> int:
+    return -(-size // _ALIGNMENT) * _ALIGNMENT
+
+
+def batch_spec(example: Dict, batch_size: int) -> Dict[str, Dict]:
+    """Dtype, shape and slot offset of every servable feature of an example."""
+    spec = {}
+    offset = 0
+    for key, value in sidecar.flatten(example).items():
+        value = np.asarray(value)
+        if value.dtype.kind not in "biuf":
+            continue
+        spec[key] = {
+            "dtype": value.dtype.str,
+            "shape": list(value.shape),
+            "offset": offset,
+        }
+        offset += _aligned(batch_size * value.nbytes)
+
+    return spec
+
+
+def slot_size(spec: Dict[str, Dict], batch_size: int) -> int:
+    """Bytes of a ring slot holding a batch."""
+    return max(
+        (
+            feature["offset"]
+            + _aligned(
+                batch_size
+                * np.dtype(feature["dtype"]).itemsize
+                * int(np.prod(feature["shape"]))
+            )
+            for feature in spec.values()
+        ),
+        default=0,
+    )
+
+
+class _Pulse:
+    """Tell whether a heartbeat stopped, by when it last changed locally.
+
+    Heartbeats are counters, so the processes need not share a clock. A
+    heartbeat which has not started yet never stops.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._beat = 0
+        self._changed = time.monotonic()
+
+    def stopped(self, beat: int) -> bool:
+        now = time.monotonic()
+        if beat != self._beat:
+            self._beat = beat
+            self._changed = now
+            return False
+        return beat != 0 and now - self._changed > self.timeout
+
+
+class Ring:
+    """Single producer, single consumer ring of fixed size batch slots.
+
+    The producer only writes the written count, closed flag and its
+    heartbeat, and the consumer only the read count, its heartbeat and
+    detached flag, so they need no lock. Either side is considered gone once
+    its heartbeat did not change for ``timeout`` seconds.
+    """
+
+    def __init__(
+        self,
+        shm: shared_memory.SharedMemory,
+        spec: Dict[str, Dict],
+        batch_size: int,
+        num_slots: int,
+        timeout: float = HEARTBEAT_TIMEOUT,
+    ):
+        """Map a ring onto a shared memory block."""
+        self.shm = shm
+        self.spec = spec
+        self.batch_size = batch_size
+        self.num_slots = num_slots
+        self.slot_size = slot_size(spec, batch_size)
+        self._data_offset = _aligned((_HEADER_FIELDS + num_slots) * 8)
+        self._pulses = {
+            _PRODUCER_BEAT: _Pulse(timeout),
+            _CONSUMER_BEAT: _Pulse(timeout),
+        }
+
+    @staticmethod
+    def nbytes(spec: Dict[str, Dict], batch_size: int, num_slots: int) -> int:
+        """Size of the shared memory block of a ring."""
+        header = _aligned((_HEADER_FIELDS + num_slots) * 8)
+        return header + num_slots * max(slot_size(spec, batch_size), 1)
+
+    def _header(self) -> np.ndarray:
+        # views are not kept, so that the shared memory can be closed
+        return np.ndarray(
+            (_HEADER_FIELDS + self.num_slots,), dtype=np.int64, buffer=self.shm.buf
+        )
+
+    def _arrays(self, slot: int) -> Dict[str, np.ndarray]:
+        start = self._data_offset + slot * self.slot_size
+        return {
+            key: np.ndarray(
+                (self.batch_size, *feature["shape"]),
+                dtype=feature["dtype"],
+                buffer=self.shm.buf,
+                offset=start + feature["offset"],
+            )
+            for key, feature in self.spec.items()
+        }
+
+    @property
+    def written(self) -> int:
+        """Number of batches written."""
+        return int(self._header()[_WRITTEN])
+
+    @property
+    def read(self) -> int:
+        """Number of batches read."""
+        return int(self._header()[_READ])
+
+    @property
+    def closed(self) -> bool:
+        """Whether the producer is done writing."""
+        return bool(self._header()[_CLOSED])
+
+    def close(self) -> None:
+        """Mark the ring as done writing."""
+        self._header()[_CLOSED] = 1
+
+    def beat(self, field: int) -> None:
+        """Advance the heartbeat of the producer or the consumer."""
+        header = self._header()
+        header[field] = header[field] + 1
+
+    def _stopped(self, field: int) -> bool:
+        return self._pulses[field].stopped(int(self._header()[field]))
+
+    def detach_consumer(self) -> None:
+        """Mark the consumer as done reading."""
+        self._header()[_DETACHED] = 1
+
+    @property
+    def dropped(self) -> bool:
+        """Whether the consumer detached or died, so nobody reads the ring."""
+        return bool(self._header()[_DETACHED]) or self._stopped(_CONSUMER_BEAT)
+
+    @property
+    def producer_stopped(self) -> bool:
+        """Whether the producer died without closing the ring."""
+        return self._stopped(_PRODUCER_BEAT)
+
+    def put(self, batch: Dict[str, np.ndarray], stop: threading.Event) -> bool:
+        """Write a batch once a slot is free, unless stopped or dropped first."""
+        written = self.written
+        wait = _POLL_INTERVAL
+        while written - self.read >= self.num_slots:
+            if stop.is_set() or self.dropped:
+                return False
+            time.sleep(wait)
+            wait = min(2 * wait, _MAX_POLL_INTERVAL)
+
+        slot = written % self.num_slots
+        size = 0
+        for key, array in self._arrays(slot).items():
+            size = len(batch[key])
+            array[:size] = batch[key]
+        header = self._header()
+        header[_HEADER_FIELDS + slot] = size
+        header[_WRITTEN] = written + 1
+        return True
+
+    def get(self) -> Optional[Dict[str, np.ndarray]]:
+        """Copy out the next batch, or None if there is none yet."""
+        read = self.read
+        if read >= self.written:
+            return None
+
+        slot = read % self.num_slots
+        header = self._header()
+        size = int(header[_HEADER_FIELDS + slot])
+        batch = {key: array[:size].copy() for key, array in self._arrays(slot).items()}
+        header[_READ] = read + 1
+        return batch
+
+
+class Heartbeat:
+    """Beat a heartbeat of rings from a daemon thread, while the process runs.
+
+    The thread dies with the process, however it ends, so the other side of
+    the rings sees the heartbeat stop.
+    """
+
+    def __init__(self, rings: List[Ring], field: int):
+        """Beat once, and start beating every ``_HEARTBEAT_INTERVAL``."""
+        self._rings = rings
+        self._field = field
+        self._stop = threading.Event()
+        self._beat()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _beat(self) -> None:
+        for ring in self._rings:
+            ring.beat(self._field)
+
+    def _run(self) -> None:
+        while not self._stop.wait(_HEARTBEAT_INTERVAL):
+            self._beat()
+
+    def stop(self) -> None:
+        """Stop beating, before the shared memory is closed."""
+        self._stop.set()
+        self._thread.join()
+
+
+def write_spec(name: str, spec: Dict) -> shared_memory.SharedMemory:
+    """Publish the spec of a server as json in a shared memory block."""
+    data = json.dumps(spec).encode()
+    shm = shared_memory.SharedMemory(
+        name=spec_name(name), create=True, size=8 + len(data)
+    )
+    shm.buf[8 : 8 + len(data)] = data
+    # the length is written last, once the spec is complete
+    np.ndarray((1,), dtype=np.int64, buffer=shm.buf)[0] = len(data)
+    return shm
+
+
+def read_spec(name: str, timeout: float = 60.0) -> Dict:
+    """Read the spec of a server, waiting for it to start."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            shm = attach(spec_name(name))
+        except FileNotFoundError:
+            shm = None
+        if shm is not None:
+            length = int(np.ndarray((1,), dtype=np.int64, buffer=shm.buf)[0])
+            if length:
+                spec = json.loads(bytes(shm.buf[8 : 8 + length]))
+                shm.close()
+                return spec
+            shm.close()
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"No data server named {name!r} started")
+        time.sleep(_MAX_POLL_INTERVAL)
+
+
+def windows(examples: Iterator[Dict], spec: Dict[str, Dict], window: int):
+    """Stack consecutive examples into windows of at most ``window``."""
+    buffers = {
+        key: np.empty((window, *feature["shape"]), dtype=feature["dtype"])
+        for key, feature in spec.items()
+    }
+    size = 0
+    for example in examples:
+        example = sidecar.flatten(example)
+        for key, buffer in buffers.items():
+            buffer[size] = example[key]
+        size += 1
+        if size == window:
+            yield {key: buffer.copy() for key, buffer in buffers.items()}
+            size = 0
+    if size:
+        yield {key: buffer[:size].copy() for key, buffer in buffers.items()}
+
+
+def _examples(builder: tfds.core.DatasetBuilder, split: str) -> Iterator[Dict]:
+    """Decoded numpy examples of a split, decoded in parallel."""
+    read_config = tfds.ReadConfig(num_parallel_calls_for_decode=tf.data.AUTOTUNE)
+    ds = builder.as_dataset(split=split, read_config=read_config)
+    return iter(tfds.as_numpy(ds.prefetch(tf.data.AUTOTUNE)))
+
+
+def _epoch_windows(
+    builder: tfds.core.DatasetBuilder,
+    split: str,
+    examples: Iterator[Dict],
+    features: Dict[str, Dict],
+    window: int,
+    epochs: Optional[int],
+):
+    """Windows of every epoch, each epoch followed by an end marker."""
+    epoch = 0
+    while epochs is None or epoch < epochs:
+        if epoch > 0:
+            examples = _examples(builder, split)
+        yield from windows(examples, features, window)
+        yield _END_OF_EPOCH
+        epoch += 1
+    yield None
+
+
+def _gather(
+    window: Dict[str, np.ndarray],
+    indices: np.ndarray,
+    pending: Optional[Dict[str, np.ndarray]] = None,
+) -> Dict[str, np.ndarray]:
+    """Gather examples of a window, after the examples left over before them."""
+    if pending is None:
+        return {key: array[indices] for key, array in window.items()}
+
+    return {
+        key: np.concatenate([pending[key], array[indices]])
+        for key, array in window.items()
+    }
+
+
+def _publish_window(
+    ring: Ring,
+    window: Dict[str, np.ndarray],
+    pending: Optional[Dict[str, np.ndarray]],
+    rng: np.random.Generator,
+    stop: threading.Event,
+) -> Tuple[bool, Optional[Dict[str, np.ndarray]]]:
+    """Publish the batches of a window, in a shuffled order.
+
+    The window is shared by every consumer, so only a permutation of its
+    indices is shuffled and each batch gathered from it. The first batch
+    completes the examples left over from the previous window.
+
+    Returns:
+        Whether every full batch was published, and the examples left over.
+    """
+    order = rng.permutation(len(next(iter(window.values()))))
+    start = 0
+    if pending is not None:
+        start = min(ring.batch_size - len(next(iter(pending.values()))), len(order))
+        pending = _gather(window, order[:start], pending)
+        if len(next(iter(pending.values()))) < ring.batch_size:
+            return True, pending
+        if not ring.put(pending, stop):
+            return False, None
+
+    while start + ring.batch_size <= len(order):
+        batch = _gather(window, order[start : start + ring.batch_size])
+        if not ring.put(batch, stop):
+            return False, None
+        start += ring.batch_size
+
+    return True, _gather(window, order[start:]) if start < len(order) else None
+
+
+def _publish(
+    ring: Ring,
+    windows_queue: queue.Queue,
+    seed: int,
+    drop_remainder: bool,
+    stop: threading.Event,
+) -> None:
+    """Shuffle the windows of a consumer into batches and publish them.
+
+    Returns once the last window is published, or the ring is dropped.
+    """
+    rng = np.random.default_rng(seed)
+    pending: Optional[Dict[str, np.ndarray]] = None
+    while not stop.is_set():
+        try:
+            window = windows_queue.get(timeout=_MAX_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+        if window is None or window is _END_OF_EPOCH:
+            if pending is not None and not drop_remainder:
+                if not ring.put(pending, stop):
+                    return
+            pending = None
+            if window is None:
+                return
+            continue
+
+        published, pending = _publish_window(ring, window, pending, rng, stop)
+        if not published:
+            return
+
+
+def _broadcast(
+    item,
+    queues: List[queue.Queue],
+    publishers: List[threading.Thread],
+    stop: threading.Event,
+) -> None:
+    """Hand a window to every publisher still running, waiting for room."""
+    for windows_queue, publisher in zip(queues, publishers):
+        while publisher.is_alive() and not stop.is_set():
+            try:
+                windows_queue.put(item, timeout=_MAX_POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+
+
+def _drain(
+    rings: List[Ring], publishers: List[threading.Thread], stop: threading.Event
+) -> None:
+    """Wait until the consumers have read every published batch."""
+    for publisher in publishers:
+        while publisher.is_alive() and not stop.is_set():
+            publisher.join(_MAX_POLL_INTERVAL)
+    for ring in rings:
+        ring.close()
+    while not stop.is_set() and any(
+        ring.read < ring.written and not ring.dropped for ring in rings
+    ):
+        time.sleep(_MAX_POLL_INTERVAL)
+
+
+def serve(
+    name: str,
+    dataset: str,
+    split: str = "train",
+    num_consumers: int = 1,
+    batch_size: int = 32,
+    epochs: Optional[int] = 1,
+    window: int = 4096,
+    num_slots: int = 8,
+    max_lag: int = 2,
+    seed: int = 0,
+    drop_remainder: bool = False,
+    data_dir: Optional[str] = None,
+    stop: Optional[threading.Event] = None,
+) -> None:
+    """Serve a prepared dataset to ``num_consumers`` clients until done.
+
+    The dataset is read and decoded once per epoch, forever if ``epochs`` is
+    None, and consumer ``i`` shuffles with seed ``seed + i``. Windows are
+    read ahead for consumers up to ``max_lag`` windows behind the fastest one.
+    Returns once every consumer still attached has read every batch, or
+    ``stop`` is set, and then removes the shared memory.
+    """
+    stop = stop or threading.Event()
+    builder = tfds.builder(dataset, data_dir=data_dir)
+    examples = _examples(builder, split)
+    first = next(examples)
+    features = batch_spec(first, batch_size)
+
+    size = Ring.nbytes(features, batch_size, num_slots)
+    blocks = [
+        shared_memory.SharedMemory(
+            name=ring_name(name, consumer), create=True, size=size
+        )
+        for consumer in range(num_consumers)
+    ]
+    rings = [Ring(shm, features, batch_size, num_slots) for shm in blocks]
+    heartbeat = Heartbeat(rings, _PRODUCER_BEAT)
+    spec = {
+        "features": features,
+        "batch_size": batch_size,
+        "num_slots": num_slots,
+        "num_consumers": num_consumers,
+    }
+    blocks.append(write_spec(name, spec))
+
+    queues: List[queue.Queue] = [queue.Queue(maxsize=max_lag) for _ in rings]
+    publishers = [
+        threading.Thread(
+            target=_publish,
+            args=(ring, windows_queue, seed + consumer, drop_remainder, stop),
+            daemon=True,
+        )
+        for consumer, (ring, windows_queue) in enumerate(zip(rings, queues))
+    ]
+    for publisher in publishers:
+        publisher.start()
+
+    try:
+        for item in _epoch_windows(
+            builder, split, _chain(first, examples), features, window, epochs
+        ):
+            _broadcast(item, queues, publishers, stop)
+            if stop.is_set():
+                break
+        _drain(rings, publishers, stop)
+    finally:
+        stop.set()
+        for publisher in publishers:
+            publisher.join()
+        heartbeat.stop()
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+def _serve_until_terminated(*args, **kwargs) -> None:
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    serve(*args, **kwargs)
+
+
+def start(name: str, dataset: str, **kwargs) -> multiprocessing.Process:
+    """Start a data server in a new process, see :func:`serve` for the options.
+
+    Terminating the process removes the shared memory.
+    """
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(
+        target=_serve_until_terminated, args=(name, dataset), kwargs=kwargs
+    )
+    process.start()
+    return process
+
+
+class Client:
+    """Iterator over the batches a data server publishes to one consumer.
+
+    Batches are dictionaries of numpy arrays, like those of
+    ``tfds.as_numpy(ds.batch(batch_size))``, copied out of shared memory.
+    Iteration stops when the server is done, and fails if it dies.
+    """
+
+    def __init__(self, name: str, consumer: int = 0, timeout: float = 60.0):
+        """Attach to the ring of a consumer, waiting for the server to start."""
+        spec = read_spec(name, timeout)
+        if not 0 <= consumer < spec["num_consumers"]:
+            raise ValueError(
+                f"consumer must be in [0, {spec['num_consumers']}), got {consumer}"
+            )
+        self.spec = spec
+        self._shm = attach(ring_name(name, consumer))
+        self._ring: Optional[Ring] = Ring(
+            self._shm, spec["features"], spec["batch_size"], spec["num_slots"]
+        )
+        self._heartbeat = Heartbeat([self._ring], _CONSUMER_BEAT)
+
+    def __iter__(self) -> "Client":
+        """Iterate over the batches."""
+        return self
+
+    def __next__(self) -> Dict[str, np.ndarray]:
+        """Wait for the next batch."""
+        if self._ring is None:
+            raise StopIteration
+
+        wait = _POLL_INTERVAL
+        while True:
+            batch = self._ring.get()
+            if batch is not None:
+                return batch
+            if self._ring.closed and self._ring.read >= self._ring.written:
+                self.close()
+                raise StopIteration
+            if wait >= _MAX_POLL_INTERVAL and self._ring.producer_stopped:
+                self.close()
+                raise RuntimeError("The data server stopped")
+            time.sleep(wait)
+            wait = min(2 * wait, _MAX_POLL_INTERVAL)
+
+    def close(self) -> None:
+        """Detach from the shared memory, so that the server stops serving."""
+        if self._ring is not None:
+            self._heartbeat.stop()
+            self._ring.detach_consumer()
+            self._ring = None
+            self._shm.close()
+
+    def __enter__(self) -> "Client":
+        """Use the client as a context manager, closing it on exit."""
+        return self
+
+    def __exit__(self, *exc) -> None:
+        """Close the client."""
+        self.close()
@@ -0,0 +1,167 @@
+"""Tar shards for large collections of small files."""
+import csv
+import io
+import pathlib
+import tarfile
+from typing import BinaryIO
+from typing import Dict
+from typing import NamedTuple
+from typing import Optional
+
+DEFAULT_SHARD_SIZE = 1024**3
+INDEX_SUFFIX = ".index.csv"
+INDEX_FIELDS = ["name", "shard", "offset", "size"]
+
+
+class ShardEntry(NamedTuple):
+    """Location of a single member inside a shard."""
+
+    shard: str
+    offset: int
+    size: int
+
+
+def get_shard_filename(prefix: str, number: int) -> str:
+    """Get the filename of a shard."""
+    return f"{prefix}-{number:05d}.tar"
+
+
+def get_index_filepath(path: pathlib.Path, prefix: str) -> pathlib.Path:
+    """Get the index filepath for the shards sharing a prefix."""
+    return path / f"{prefix}{INDEX_SUFFIX}"
+
+
+def has_shards(path: pathlib.Path) -> bool:
+    """Whether a directory contains indexed shards."""
+    return path.is_dir() and any(path.glob(f"*{INDEX_SUFFIX}"))
+
+
+def read_index(path: pathlib.Path) -> Dict[str, ShardEntry]:
+    """Read and merge every shard index in a directory."""
+    index = {}
+    for index_path in sorted(path.glob(f"*{INDEX_SUFFIX}")):
+        with open(index_path, newline="") as f:
+            for row in csv.DictReader(f):
+                index[row["name"]] = ShardEntry(
+                    row["shard"], int(row["offset"]), int(row["size"])
+                )
+
+    return index
+
+
+class ShardWriter:
+    """Write files into a sequence of size-bounded tar shards.
+
+    Shards are named ``<prefix>-00000.tar``, ``<prefix>-00001.tar``, ... and
+    ``<prefix>.index.csv`` records the shard, byte offset and size of every
+    member, so that it can be read back without scanning the archives.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        prefix: str,
+        max_shard_size: int = DEFAULT_SHARD_SIZE,
+    ):
+        """Open the index, shards are created on demand."""
+        self.path = path
+        self.prefix = prefix
+        self.max_shard_size = max_shard_size
+        self.shard_number = -1
+        self.shard_name: Optional[str] = None
+        self.tar: Optional[tarfile.TarFile] = None
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.index_file = open(get_index_filepath(path, prefix), "w", newline="")
+        self.index_writer = csv.writer(self.index_file)
+        self.index_writer.writerow(INDEX_FIELDS)
+
+    def __enter__(self) -> "ShardWriter":
+        """Enter context."""
+        return self
+
+    def __exit__(self, *args) -> None:
+        """Exit context."""
+        self.close()
+
+    def _next_shard(self) -> None:
+        """Close the current shard and start a new one."""
+        if self.tar is not None:
+            self.tar.close()
+        self.shard_number += 1
+        self.shard_name = get_shard_filename(self.prefix, self.shard_number)
+        self.tar = tarfile.open(
+            self.path / self.shard_name, "w", format=tarfile.USTAR_FORMAT
+        )
+
+    def write(self, name: str, data: bytes) -> None:
+        """Append a member to the current shard, rolling over when full."""
+        if self.tar is None or (
+            self.tar.offset > 0 and self.tar.offset + len(data) > self.max_shard_size
+        ):
+            self._next_shard()
+
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.size = len(data)
+        self.tar.addfile(tarinfo, io.BytesIO(data))
+
+        # data is padded to whole blocks right after the member header
+        blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+        if remainder > 0:
+            blocks += 1
+        offset = self.tar.offset - blocks * tarfile.BLOCKSIZE
+        self.index_writer.writerow([name, self.shard_name, offset, tarinfo.size])
+
+    def close(self) -> None:
+        """Close the current shard and the index."""
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+        self.index_file.close()
+
+
+class ShardReader:
+    """Random access to the members of indexed tar shards."""
+
+    def __init__(self, path: pathlib.Path):
+        """Load every index in the directory."""
+        self.path = path
+        self.index = read_index(path)
+        self.files: Dict[str, BinaryIO] = {}
+
+    def __enter__(self) -> "ShardReader":
+        """Enter context."""
+        return self
+
+    def __exit__(self, *args) -> None:
+        """Exit context."""
+        self.close()
+
+    def __contains__(self, name: str) -> bool:
+        """Whether a member is present in the shards."""
+        return name in self.index
+
+    def __len__(self) -> int:
+        """Number of members in the shards."""
+        return len(self.index)
+
+    def read(self, name: str) -> bytes:
+        """Read the content of a member."""
+        entry = self.index[name]
+        f = self.files.get(entry.shard)
+        if f is None:
+            f = open(self.path / entry.shard, "rb")
+            self.files[entry.shard] = f
+        f.seek(entry.offset)
+
+        return f.read(entry.size)
+
+    def open(self, name: str) -> io.BytesIO:
+        """Get a member as a file-like object."""
+        return io.BytesIO(self.read(name))
+
+    def close(self) -> None:
+        """Close all open shards."""
+        for f in self.files.values():
+            f.close()
+        self.files = {}
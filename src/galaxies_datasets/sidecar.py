@@ -0,0 +1,344 @@
+"""Columnar sidecar of the non-image features, for fast subset reads.
+
+Preparing a dataset also writes ``sidecar/<split>.parquet`` next to its
+shards, with one row per example holding every non-image feature, flattened
+with ``/`` separators (e.g. ``table1/gz2_class``), plus the example key and
+the shard and byte offset of its record. Filters are evaluated on the sidecar
+alone and only the matching records are read and decoded.
+
+Rows are collected, keyed by example key, as the examples are generated.
+Records are then located by reading the shards once more, parsing only the
+columns which tell the examples apart and decoding nothing, at about the cost
+of reading the prepared files.
+"""
+import collections
+import itertools
+import struct
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import codecs
+
+SIDECAR_DIR = "sidecar"
+KEY_COLUMN = "_key"
+SHARD_COLUMN = "_shard"
+OFFSET_COLUMN = "_offset"
+
+Filter = Union[str, Callable[[pd.DataFrame], pd.Series]]
+
+# uint64 record length followed by its masked crc32
+_HEADER = struct.Struct("<QI")
+_FOOTER_SIZE = 4
+_LOCATE_BATCH_SIZE = 1024
+
+
+def image_keys(features: tfds.features.FeaturesDict) -> List[str]:
+    """Top level features holding images."""
+    return [
+        key for key, feature in features.items() if codecs.is_image_feature(feature)
+    ]
+
+
+def flat_keys(features: tfds.features.FeaturesDict, prefix: str = "") -> List[str]:
+    """Names of the nested features, joined with ``/``."""
+    keys = []
+    for key, feature in features.items():
+        if isinstance(feature, tfds.features.FeaturesDict):
+            keys += flat_keys(feature, f"{prefix}{key}/")
+        else:
+            keys.append(f"{prefix}{key}")
+
+    return keys
+
+
+def flatten(example: Dict, prefix: str = "") -> Dict:
+    """Flatten nested features, decoding strings."""
+    row = {}
+    for key, value in example.items():
+        if isinstance(value, dict):
+            row.update(flatten(value, f"{prefix}{key}/"))
+        elif isinstance(value, bytes):
+            row[f"{prefix}{key}"] = value.decode("utf-8")
+        elif isinstance(value, np.ndarray) and value.ndim == 0:
+            row[f"{prefix}{key}"] = value.item()
+        else:
+            row[f"{prefix}{key}"] = value
+
+    return row
+
+
+def record_offsets(path: tfds.core.Path) -> List[int]:
+    """Byte offset of every record in a TFRecord file, reading only headers."""
+    offsets = []
+    with tf.io.gfile.GFile(path, "rb") as f:
+        offset = 0
+        while True:
+            header = f.read(_HEADER.size)
+            if not header:
+                break
+            length, _ = _HEADER.unpack(header)
+            offsets.append(offset)
+            offset += _HEADER.size + length + _FOOTER_SIZE
+            f.seek(offset)
+
+    return offsets
+
+
+def read_records(path: tfds.core.Path, offsets: List[int]) -> Iterator[bytes]:
+    """Read the serialized records at the given offsets."""
+    with tf.io.gfile.GFile(path, "rb") as f:
+        for offset in offsets:
+            f.seek(offset)
+            length, _ = _HEADER.unpack(f.read(_HEADER.size))
+            yield f.read(length)
+
+
+def get_sidecar_path(data_path: tfds.core.Path, split: str) -> tfds.core.Path:
+    """Get the path of the sidecar of a split."""
+    return data_path / SIDECAR_DIR / f"{split}.parquet"
+
+
+def encode_row(features: tfds.features.FeaturesDict, example: Dict) -> Dict:
+    """Sidecar row of a generated example, with its features as in the records."""
+    skipped = image_keys(features)
+    encoded = {
+        key: features[key].encode_example(value)
+        for key, value in example.items()
+        if key not in skipped
+    }
+    # numpy scalars, so that columns keep the dtypes of the features, and
+    # sorted like the decoded examples
+    row = flatten(tf.nest.map_structure(_scalar, encoded))
+    return {key: row[key] for key in sorted(row, key=lambda k: k.split("/"))}
+
+
+def _scalar(value):
+    if isinstance(value, np.ndarray) and value.ndim == 0:
+        return value[()]
+    return value
+
+
+def _comparable(value):
+    """Value of a column, comparable between generated and parsed examples."""
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    if isinstance(value, str):
+        return value
+    value = np.asarray(value)
+    return value.astype(np.float64 if value.dtype.kind == "f" else np.int64).tobytes()
+
+
+def _parse_dtype(value) -> Optional[tf.dtypes.DType]:
+    """Dtype of a scalar column in the records, None for other columns."""
+    if isinstance(value, str):
+        return tf.string
+    if isinstance(value, (int, float, np.generic)):
+        # records hold every integer as int64, and every float as float32
+        return tf.float32 if np.asarray(value).dtype.kind == "f" else tf.int64
+    return None
+
+
+def join_columns(rows: List[Dict]) -> Dict[str, tf.dtypes.DType]:
+    """Scalar columns telling the rows of a split apart, with their dtypes.
+
+    The first integer or text column with unique values, else every scalar
+    column. Examples with the same values in all of them are told apart in
+    generation order.
+    """
+    dtypes = {key: _parse_dtype(value) for key, value in rows[0].items()}
+    scalars = {
+        key: dtype
+        for key, dtype in dtypes.items()
+        if dtype is not None and not key.startswith("_")
+    }
+    for key, dtype in scalars.items():
+        if dtype == tf.float32:
+            continue
+        if len({_comparable(row[key]) for row in rows}) == len(rows):
+            return {key: dtype}
+
+    return scalars
+
+
+def locate_records(
+    data_path: tfds.core.Path,
+    filenames: List[str],
+    columns: Dict[str, tf.dtypes.DType],
+) -> Iterator[Tuple[str, int, Tuple]]:
+    """Yield the shard, offset and values of some columns of every record.
+
+    Only those columns are parsed, and the images are never decoded.
+    """
+    spec = {key: tf.io.FixedLenFeature((), dtype) for key, dtype in columns.items()}
+    for filename in filenames:
+        path = data_path / filename
+        ds = (
+            tf.data.TFRecordDataset(str(path))
+            .batch(_LOCATE_BATCH_SIZE)
+            .map(lambda x: tf.io.parse_example(x, spec))
+        )
+        values = (
+            tuple(_comparable(value) for value in row)
+            for batch in tfds.as_numpy(ds)
+            for row in zip(*(batch[key] for key in columns))
+        )
+        for offset, row in zip(record_offsets(path), values):
+            yield filename, offset, row
+
+
+def write_sidecar(
+    data_path: tfds.core.Path,
+    split_info: tfds.core.SplitInfo,
+    rows: Dict,
+    locate: bool = True,
+) -> None:
+    """Write the sidecar of a split from its rows, keyed by example key.
+
+    With ``locate``, rows are written in record order along with the location
+    of their record, see :func:`locate_records`. Otherwise, in generation
+    order.
+    """
+    ordered = list(rows.values())
+    if locate and rows:
+        columns = join_columns(ordered)
+        keys = collections.defaultdict(collections.deque)
+        for key, row in rows.items():
+            keys[tuple(_comparable(row[column]) for column in columns)].append(key)
+        ordered = [
+            {**rows[keys[values].popleft()], SHARD_COLUMN: shard, OFFSET_COLUMN: offset}
+            for shard, offset, values in locate_records(
+                data_path, split_info.filenames, columns
+            )
+        ]
+
+    sidecar_path = get_sidecar_path(data_path, split_info.name)
+    sidecar_path.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(ordered).to_parquet(sidecar_path, index=False)
+
+
+class SidecarMixin:
+    """Collect the sidecar rows as a builder generates the examples.
+
+    The sidecars are written once the builder is prepared. ``sidecar_locations``
+    can be turned off to skip locating the records, which reads the shards
+    once more; :func:`load` and the loaders reading records at their offsets
+    then do not work. Requires :class:`~galaxies_datasets.stats.StatisticsMixin`,
+    which passes on the generated examples.
+    """
+
+    def __init__(self, *, sidecar_locations: bool = True, **kwargs):
+        """Start with no rows."""
+        super().__init__(**kwargs)  # type: ignore
+        self._sidecar_locations = sidecar_locations
+        self._sidecar_rows: Dict[str, Dict] = collections.defaultdict(dict)
+
+    def _observe_example(self, split, key, example, images):
+        super()._observe_example(split, key, example, images)  # type: ignore
+        row = encode_row(self.info.features, example)  # type: ignore
+        row[KEY_COLUMN] = str(key)
+        self._sidecar_rows[split][key] = row
+
+    def _sidecar_row(self, split: str, key) -> Dict:
+        """Row of a generated example, to which mixins may add columns."""
+        return self._sidecar_rows[split][key]
+
+    def _download_and_prepare(self, *args, **kwargs):
+        self._sidecar_rows.clear()
+        super()._download_and_prepare(*args, **kwargs)  # type: ignore
+        for split, split_info in self.info.splits.items():  # type: ignore
+            write_sidecar(
+                self.data_path,  # type: ignore
+                split_info,
+                self._sidecar_rows[split],
+                self._sidecar_locations,
+            )
+
+
+def select(sidecar: pd.DataFrame, filter: Optional[Filter] = None) -> pd.DataFrame:
+    """Select the sidecar rows matching a filter.
+
+    ``filter`` is either a :meth:`pandas.DataFrame.query` expression, quoting
+    nested feature names with backticks, or a function returning a boolean
+    mask.
+    """
+    if filter is None:
+        return sidecar
+    if isinstance(filter, str):
+        return sidecar.query(filter)
+
+    return sidecar[filter(sidecar)]
+
+
+def read_sidecar(
+    name: str,
+    split: str = "train",
+    filter: Optional[Filter] = None,
+    data_dir: Optional[str] = None,
+) -> pd.DataFrame:
+    """Read the sidecar of a prepared dataset, optionally filtered."""
+    builder = tfds.builder(name, data_dir=data_dir)
+    sidecar = pd.read_parquet(get_sidecar_path(builder.data_path, split))
+
+    return select(sidecar, filter)
+
+
+def load(
+    name: str,
+    split: str = "train",
+    filter: Optional[Filter] = None,
+    data_dir: Optional[str] = None,
+    decoders: Optional[Dict] = None,
+) -> tf.data.Dataset:
+    """Load only the examples of a prepared dataset matching a filter.
+
+    Records are read in shard order directly at their offsets, so shards
+    without matches are never opened and non-matching records never decoded.
+    """
+    builder = tfds.builder(name, data_dir=data_dir)
+    rows = read_sidecar(name, split, filter, data_dir)
+    if SHARD_COLUMN not in rows:
+        raise ValueError(
+            f"{name} was prepared without sidecar_locations, prepare it again "
+            "with them to load subsets"
+        )
+    rows = rows.sort_values([SHARD_COLUMN, OFFSET_COLUMN])
+    locations = list(zip(rows[SHARD_COLUMN], rows[OFFSET_COLUMN]))
+
+    return load_records(builder.data_path, builder.info.features, locations, decoders)
+
+
+def load_records(
+    data_path: tfds.core.Path,
+    features: tfds.features.FeaturesDict,
+    locations: List[Tuple[str, int]],
+    decoders: Optional[Dict] = None,
+) -> tf.data.Dataset:
+    """Load the examples of the records at the given shards and offsets.
+
+    Examples are loaded in the order of ``locations``, opening a shard once
+    for each run of records in it.
+    """
+
+    def generator():
+        for shard, group in itertools.groupby(locations, key=lambda x: x[0]):
+            offsets = [offset for _, offset in group]
+            yield from read_records(data_path / shard, offsets)
+
+    ds = tf.data.Dataset.from_generator(
+        generator, output_signature=tf.TensorSpec(shape=(), dtype=tf.string)
+    )
+    return ds.map(
+        lambda x: features.deserialize_example(x, decoders=decoders),
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=True,
+    )
@@ -0,0 +1,253 @@
+"""Sky coordinate index and cross-matching between catalogues.
+
+Positions are bucketed in declination zones and sorted by right ascension
+inside each zone, so the neighbours of a position are found with binary
+searches over a handful of zones: matching N positions against an index of M
+takes O(N log M) instead of comparing every pair.
+"""
+import io
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import sidecar
+
+SKY_INDEX_DIR = "sky_index"
+DEFAULT_ZONE_HEIGHT = 1 / 60  # degrees
+
+
+def unit_vectors(ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+    """Cartesian unit vectors of positions in degrees."""
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    return np.stack(
+        [np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)], axis=-1
+    )
+
+
+def separation(vectors_a: np.ndarray, vectors_b: np.ndarray) -> np.ndarray:
+    """Angular separation in arcseconds between pairs of unit vectors."""
+    # chord length is accurate at small separations, unlike the dot product
+    chord = np.linalg.norm(vectors_a - vectors_b, axis=-1)
+    return np.degrees(2 * np.arcsin(np.clip(chord / 2, 0, 1))) * 3600
+
+
+class Matches(NamedTuple):
+    """Pairs of positions within the matching radius."""
+
+    query: np.ndarray
+    index: np.ndarray
+    separation: np.ndarray
+
+
+class SkyIndex:
+    """Zone index of sky positions, given in degrees."""
+
+    def __init__(
+        self,
+        ra: np.ndarray,
+        dec: np.ndarray,
+        zone_height: float = DEFAULT_ZONE_HEIGHT,
+    ):
+        """Sort the positions by zone and right ascension."""
+        ra = np.mod(np.asarray(ra, np.float64), 360)
+        dec = np.asarray(dec, np.float64)
+        self.zone_height = zone_height
+
+        keys = self._zones(dec) * 360.0 + ra
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+        self.vectors = unit_vectors(ra, dec)[self.order]
+
+    def __len__(self) -> int:
+        """Number of indexed positions."""
+        return len(self.keys)
+
+    def _zones(self, dec: np.ndarray) -> np.ndarray:
+        """Zone of each declination."""
+        return np.floor((dec + 90) / self.zone_height).astype(np.int64)
+
+    def _ra_ranges(
+        self, ra: np.ndarray, dec: np.ndarray, radius: float
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Half-open right ascension ranges covering a circle around each position.
+
+        Ranges crossing ra = 0 are split in two, so there are up to 3 per
+        position, flagged as used by the returned mask.
+        """
+        radius = np.radians(radius)
+        dec = np.radians(dec)
+        ratio = np.sin(radius) / np.maximum(np.cos(dec), 1e-12)
+        half_width = np.degrees(np.arcsin(np.clip(ratio, 0, 1))) * (1 + 1e-9)
+        full = (np.abs(dec) + radius >= np.pi / 2) | (half_width >= 180)
+
+        low = ra - half_width
+        high = ra + half_width
+        starts = np.stack([np.clip(low, 0, 360), low + 360, np.zeros_like(ra)])
+        ends = np.stack([np.clip(high, 0, 360), np.full_like(ra, 360), high - 360])
+        used = np.stack([np.ones_like(full), ~full & (low < 0), ~full & (high > 360)])
+        starts[0] = np.where(full, 0, starts[0])
+        ends[0] = np.where(full, 360, ends[0])
+
+        return starts, ends, used
+
+    def query(self, ra: np.ndarray, dec: np.ndarray, radius: float) -> Matches:
+        """Find every indexed position within `radius` arcseconds.
+
+        Returned indices refer to the order of the given and of the indexed
+        positions.
+        """
+        ra = np.mod(np.atleast_1d(np.asarray(ra, np.float64)), 360)
+        dec = np.atleast_1d(np.asarray(dec, np.float64))
+        radius_deg = radius / 3600
+
+        starts, ends, used = self._ra_ranges(ra, dec, radius_deg)
+        n_zones = int(np.ceil(radius_deg / self.zone_height))
+        zones = self._zones(dec)
+
+        query_ids = []
+        lows = []
+        counts = []
+        for dz in range(-n_zones, n_zones + 1):
+            offset = (zones + dz) * 360.0
+            for start, end, mask in zip(starts, ends, used):
+                low = np.searchsorted(self.keys, offset + start)
+                high = np.searchsorted(self.keys, offset + end)
+                query_ids.append(np.arange(len(ra)))
+                lows.append(low)
+                counts.append(np.where(mask, np.maximum(high - low, 0), 0))
+        query_ids = np.concatenate(query_ids)
+        lows = np.concatenate(lows)
+        counts = np.concatenate(counts)
+
+        # expand every range into candidate pairs
+        query = np.repeat(query_ids, counts)
+        first = np.repeat(lows - (np.cumsum(counts) - counts), counts)
+        position = first + np.arange(counts.sum())
+
+        vectors = unit_vectors(ra, dec)
+        distance = separation(vectors[query], self.vectors[position])
+        close = distance <= radius
+
+        return Matches(query[close], self.order[position[close]], distance[close])
+
+    def save(self, path: tfds.core.Path) -> None:
+        """Save the sorted index."""
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            order=self.order,
+            keys=self.keys,
+            vectors=self.vectors,
+            zone_height=self.zone_height,
+        )
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(buffer.getvalue())
+
+    @classmethod
+    def load(cls, path: tfds.core.Path) -> "SkyIndex":
+        """Load a saved index without sorting it again."""
+        index = cls.__new__(cls)
+        with np.load(io.BytesIO(path.read_bytes())) as data:
+            index.order = data["order"]
+            index.keys = data["keys"]
+            index.vectors = data["vectors"]
+            index.zone_height = float(data["zone_height"])
+
+        return index
+
+
+def get_sky_index_path(data_path: tfds.core.Path, split: str) -> tfds.core.Path:
+    """Get the path of the sky index of a split."""
+    return data_path / SKY_INDEX_DIR / f"{split}.npz"
+
+
+class SkyIndexMixin:
+    """Index the `SKY_COORDINATES` sidecar columns once a builder is prepared.
+
+    Must come before :class:`galaxies_datasets.sidecar.SidecarMixin`, as the
+    index is built from the sidecars. Indices follow the sidecar rows. Configs
+    without the coordinates are not indexed.
+    """
+
+    SKY_COORDINATES = ("metadata/ra", "metadata/dec")
+
+    def _download_and_prepare(self, *args, **kwargs):
+        super()._download_and_prepare(*args, **kwargs)  # type: ignore
+        ra_column, dec_column = self.SKY_COORDINATES
+        keys = sidecar.flat_keys(self.info.features)  # type: ignore
+        if ra_column not in keys or dec_column not in keys:
+            return
+        for split in self.info.splits:  # type: ignore
+            path = sidecar.get_sidecar_path(self.data_path, split)  # type: ignore
+            df = pd.read_parquet(path, columns=[ra_column, dec_column])
+            index = SkyIndex(df[ra_column], df[dec_column])
+            index.save(get_sky_index_path(self.data_path, split))  # type: ignore
+
+
+def load_sky_index(
+    name: str, split: str = "train", data_dir: Optional[str] = None
+) -> SkyIndex:
+    """Load the sky index of a prepared dataset."""
+    builder = tfds.builder(name, data_dir=data_dir)
+    return SkyIndex.load(get_sky_index_path(builder.data_path, split))
+
+
+def match_catalogue(
+    name: str,
+    ra: np.ndarray,
+    dec: np.ndarray,
+    radius: float,
+    split: str = "train",
+    data_dir: Optional[str] = None,
+) -> pd.DataFrame:
+    """Match external positions against a prepared dataset.
+
+    Returns the sidecar rows of the matched examples, with the position of the
+    external entry in `query` and the `separation` in arcseconds.
+    """
+    matches = load_sky_index(name, split, data_dir).query(ra, dec, radius)
+    rows = sidecar.read_sidecar(name, split, data_dir=data_dir)
+    rows = rows.iloc[matches.index].reset_index(drop=True)
+    rows.insert(0, "query", matches.query)
+    rows.insert(1, "separation", matches.separation)
+
+    return rows
+
+
+def cross_match(
+    name_a: str,
+    name_b: str,
+    radius: float,
+    split_a: str = "train",
+    split_b: str = "train",
+    data_dir: Optional[str] = None,
+    coordinates_a: Tuple[str, str] = SkyIndexMixin.SKY_COORDINATES,
+) -> pd.DataFrame:
+    """Pairs of examples of two prepared datasets within `radius` arcseconds.
+
+    Returns the sidecar columns of both datasets, prefixed with their names.
+    """
+    rows_a = sidecar.read_sidecar(name_a, split_a, data_dir=data_dir)
+    ra_column, dec_column = coordinates_a
+    matches = load_sky_index(name_b, split_b, data_dir).query(
+        rows_a[ra_column], rows_a[dec_column], radius
+    )
+    rows_b = sidecar.read_sidecar(name_b, split_b, data_dir=data_dir)
+
+    rows_a = rows_a.iloc[matches.query].add_prefix(f"{name_a}/")
+    rows_b = rows_b.iloc[matches.index].add_prefix(f"{name_b}/")
+    pairs = pd.concat(
+        [
+            rows_a.reset_index(drop=True),
+            rows_b.reset_index(drop=True),
+            pd.Series(matches.separation, name="separation"),
+        ],
+        axis=1,
+    )
+
+    return pairs
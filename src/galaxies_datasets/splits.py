@@ -0,0 +1,104 @@
+"""Hash based splits assigned while preparing the datasets.
+
+Builders take a ``split_fractions`` option, e.g. :data:`DEFAULT_FRACTIONS`,
+and write one physical split per entry instead of a single ``train`` split::
+
+    builder = tfds.builder("galaxy_zoo2", split_fractions=splits.DEFAULT_FRACTIONS)
+    builder.download_and_prepare()
+    ds = builder.as_dataset(split="validation")
+
+Each example goes to the split given by a hash of its key (``GalaxyID``,
+``asset_id`` or ``iauname``), so the assignment does not depend on the order
+of the source files and reading a split only reads its own shards. Builders
+group the source items by split in a single pass with
+:meth:`HashSplitsMixin._split_items`, shared by the generators of the splits.
+"""
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Mapping
+from typing import Optional
+from typing import Tuple
+
+from galaxies_datasets import subsets
+
+SPLITS_KEY = "splits"
+
+DEFAULT_FRACTIONS = {"train": 0.8, "validation": 0.1, "test": 0.1}
+
+
+def assign_split(key, fractions: Dict[str, float], seed: int = 0) -> str:
+    """Split of an example, drawn from the fractions with a hash of its key.
+
+    The hash is salted, so that splits are independent of the subsets drawn
+    by :mod:`galaxies_datasets.subsets` with the same seed.
+    """
+    value = subsets.hash_fraction(f"split:{key}", seed)
+    total = sum(fractions.values())
+    cumulative = 0.0
+    for split, fraction in fractions.items():
+        cumulative += fraction / total
+        if value < cumulative:
+            return split
+
+    return split
+
+
+class HashSplitsMixin:
+    """Builder option writing the examples to hash assigned splits.
+
+    Without ``split_fractions`` every example goes to ``train``. The fractions
+    and ``split_seed`` are recorded in the ``splits`` metadata.
+    """
+
+    def __init__(
+        self,
+        *,
+        split_fractions: Optional[Dict[str, float]] = None,
+        split_seed: int = 0,
+        **kwargs,
+    ):
+        """Set the split fractions."""
+        if split_fractions is not None and (
+            not split_fractions or min(split_fractions.values()) <= 0
+        ):
+            raise ValueError(
+                f"split_fractions must all be positive, got {split_fractions}"
+            )
+
+        super().__init__(**kwargs)  # type: ignore
+        self._split_fractions = split_fractions
+        self._split_seed = split_seed
+
+    @property
+    def split_names(self) -> List[str]:
+        """Names of the splits to generate."""
+        if self._split_fractions is None:
+            return ["train"]
+
+        return list(self._split_fractions)
+
+    def _download_and_prepare(self, *args, **kwargs):
+        if self._split_fractions is not None:
+            self.info.metadata[SPLITS_KEY] = {  # type: ignore
+                "fractions": self._split_fractions,
+                "seed": self._split_seed,
+            }
+        super()._download_and_prepare(*args, **kwargs)  # type: ignore
+
+    def _split_items(self, items: Iterable[Tuple]) -> Mapping[str, Iterable[Tuple]]:
+        """Group the items of the source by split, in a single pass over it.
+
+        Items are tuples starting with the key of their example. Without
+        ``split_fractions`` they all go to ``train``, and are passed through
+        lazily.
+        """
+        if self._split_fractions is None:
+            return {"train": items}
+
+        groups: Dict[str, List[Tuple]] = {split: [] for split in self.split_names}
+        for item in items:
+            split = assign_split(item[0], self._split_fractions, self._split_seed)
+            groups[split].append(item)
+
+        return groups
@@ -0,0 +1,329 @@
+"""Dataset statistics accumulated while the examples are generated.
+
+Builders pass the examples of each split through
+:meth:`StatisticsMixin._with_statistics`, which stores in the dataset metadata,
+under ``statistics/<split>``:
+
+- ``images``: per channel pixel mean and standard deviation of every image
+  feature, in the 0-255 range of the stored images.
+- ``labels``: mean, standard deviation and a histogram over [0, 1] of the vote
+  fractions matching ``STATISTICS_LABELS``.
+- ``quantiles``: mean, standard deviation, range and percentiles of the
+  features matching ``STATISTICS_QUANTILES``, such as redshifts or sizes.
+
+Features are named with ``/`` separators, as in the sidecars. Missing (NaN)
+values are counted but otherwise ignored.
+"""
+import random
+import re
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import codecs
+from galaxies_datasets import sidecar
+
+STATISTICS_KEY = "statistics"
+HISTOGRAM_BINS = 20
+PERCENTILES = np.linspace(0, 100, 101)
+
+
+class Moments:
+    """Running mean and variance per channel, merging batches with Welford."""
+
+    def __init__(self, channels: int = 1):
+        """Start with no values."""
+        self.count = 0
+        self.mean = np.zeros(channels)
+        self.m2 = np.zeros(channels)
+
+    def update(self, values: np.ndarray) -> None:
+        """Add values of shape ``(..., channels)``."""
+        values = np.asarray(values, dtype=np.float64).reshape(-1, len(self.mean))
+        count = len(values)
+        if count == 0:
+            return
+        mean = values.mean(axis=0)
+        m2 = ((values - mean) ** 2).sum(axis=0)
+
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta**2 * self.count * count / total
+        self.count = total
+
+    @property
+    def variance(self) -> np.ndarray:
+        """Population variance of the values."""
+        if self.count == 0:
+            return np.full_like(self.mean, np.nan)
+        return self.m2 / self.count
+
+    @property
+    def std(self) -> np.ndarray:
+        """Population standard deviation of the values."""
+        return np.sqrt(self.variance)
+
+
+class QuantileSketch:
+    """Approximate quantiles in bounded memory.
+
+    Values are buffered in levels of ``capacity`` items, level ``i`` items
+    standing for ``2**i`` values. A full level is sorted and every other item,
+    starting at random, is promoted to the next level, as in the KLL sketch.
+    """
+
+    def __init__(self, capacity: int = 256, seed: int = 0):
+        """Start with no values."""
+        self.capacity = capacity
+        self.levels: List[List[float]] = [[]]
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._rng = random.Random(seed)
+
+    def update(self, value: float) -> None:
+        """Add a value."""
+        self.levels[0].append(value)
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+        level = 0
+        while len(self.levels[level]) >= self.capacity:
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            items = sorted(self.levels[level])
+            self.levels[level + 1].extend(items[self._rng.randint(0, 1) :: 2])
+            self.levels[level] = []
+            level += 1
+
+    def quantiles(self, q: Sequence[float]) -> np.ndarray:
+        """Approximate quantiles, the extremes being exact."""
+        q = np.asarray(q, dtype=np.float64)
+        if self.count == 0:
+            return np.full(q.shape, np.nan)
+        values = np.concatenate([np.asarray(items, float) for items in self.levels])
+        weights = np.concatenate(
+            [np.full(len(items), 2**level) for level, items in enumerate(self.levels)]
+        )
+        order = np.argsort(values)
+        values = values[order]
+        ranks = np.cumsum(weights[order])
+
+        index = np.searchsorted(ranks, q * ranks[-1], side="left")
+        result = values[np.clip(index, 0, len(values) - 1)]
+        result[q <= 0] = self.min
+        result[q >= 1] = self.max
+
+        return result
+
+
+class FeatureStatistics:
+    """Statistics of a scalar feature."""
+
+    def __init__(self, histogram: bool = False, quantiles: bool = False):
+        """Choose the statistics to accumulate besides the moments."""
+        self.moments = Moments()
+        self.missing = 0
+        self.counts = np.zeros(HISTOGRAM_BINS, dtype=np.int64) if histogram else None
+        self.sketch = QuantileSketch() if quantiles else None
+
+    def update(self, value) -> None:
+        """Add a value, given as anything convertible to a float."""
+        value = float(value)
+        if not np.isfinite(value):
+            self.missing += 1
+            return
+        self.moments.update(np.array([value]))
+        if self.counts is not None:
+            index = int(np.clip(value, 0, 1) * HISTOGRAM_BINS)
+            self.counts[min(index, HISTOGRAM_BINS - 1)] += 1
+        if self.sketch is not None:
+            self.sketch.update(value)
+
+    def to_dict(self) -> Dict:
+        """Summary that can be stored as JSON."""
+        summary = {
+            "mean": float(self.moments.mean[0]),
+            "std": float(self.moments.std[0]),
+            "missing": self.missing,
+        }
+        if self.counts is not None:
+            summary["histogram"] = {
+                "edges": np.linspace(0, 1, HISTOGRAM_BINS + 1).tolist(),
+                "counts": self.counts.tolist(),
+            }
+        if self.sketch is not None:
+            summary["min"] = float(self.sketch.min)
+            summary["max"] = float(self.sketch.max)
+            summary["percentiles"] = self.sketch.quantiles(PERCENTILES / 100).tolist()
+
+        return summary
+
+
+def get_value(example: Dict, key: str):
+    """Get a nested value from its ``/`` joined name."""
+    for part in key.split("/"):
+        example = example[part]
+
+    return example
+
+
+class DatasetStatistics:
+    """Statistics of the images and labels of the examples of a split."""
+
+    def __init__(
+        self,
+        images: Dict[str, int],
+        labels: Iterable[str] = (),
+        quantiles: Iterable[str] = (),
+    ):
+        """Choose the features to describe.
+
+        Args:
+            images: number of channels of each image feature.
+            labels: vote fraction features, described with histograms.
+            quantiles: features described with percentiles.
+        """
+        self.num_examples = 0
+        self.images = {key: Moments(channels) for key, channels in images.items()}
+        self.labels = {key: FeatureStatistics(histogram=True) for key in labels}
+        self.quantiles = {key: FeatureStatistics(quantiles=True) for key in quantiles}
+
+    @classmethod
+    def for_features(
+        cls,
+        features: tfds.features.FeaturesDict,
+        labels: Sequence[str] = (),
+        quantiles: Sequence[str] = (),
+    ) -> "DatasetStatistics":
+        """Describe every image feature, and the features matching the patterns."""
+        images = {}
+        for key, feature in features.items():
+            if codecs.is_image_feature(feature):
+                if isinstance(feature, tfds.features.Sequence):
+                    feature = feature.feature
+                images[key] = feature.shape[-1]
+        keys = sidecar.flat_keys(features)
+
+        def matching(patterns):
+            return [k for k in keys if any(re.fullmatch(p, k) for p in patterns)]
+
+        return cls(images, matching(labels), matching(quantiles))
+
+    def decode_images(self, example: Dict) -> Dict[str, List[np.ndarray]]:
+        """Decode the images of every image feature of a generated example."""
+        decoded = {}
+        for key in self.images:
+            images = example[key]
+            if not isinstance(images, (list, tuple)):
+                images = [images]
+            decoded[key] = [codecs.decode_image(image) for image in images]
+
+        return decoded
+
+    def update(
+        self, example: Dict, images: Optional[Dict[str, List[np.ndarray]]] = None
+    ) -> None:
+        """Add a generated example, before encoding.
+
+        ``images`` are its images as returned by :meth:`decode_images`,
+        decoded here if not given.
+        """
+        self.num_examples += 1
+        if images is None:
+            images = self.decode_images(example)
+        for key, moments in self.images.items():
+            for image in images[key]:
+                moments.update(image)
+        for key, statistics in {**self.labels, **self.quantiles}.items():
+            statistics.update(get_value(example, key))
+
+    def to_dict(self) -> Dict:
+        """Summary that can be stored as JSON."""
+        return {
+            "num_examples": self.num_examples,
+            "images": {
+                key: {"mean": moments.mean.tolist(), "std": moments.std.tolist()}
+                for key, moments in self.images.items()
+            },
+            "labels": {key: s.to_dict() for key, s in self.labels.items()},
+            "quantiles": {key: s.to_dict() for key, s in self.quantiles.items()},
+        }
+
+
+class StatisticsMixin:
+    """Accumulate statistics of the examples as a builder generates them.
+
+    The builder info needs a ``tfds.core.MetadataDict`` to store them.
+    """
+
+    STATISTICS_LABELS: Tuple[str, ...] = ()
+    STATISTICS_QUANTILES: Tuple[str, ...] = ()
+
+    _observing = True
+
+    def split_generators(
+        self, dl_manager: tfds.download.DownloadManager
+    ) -> Dict[str, Iterable[Tuple[str, Dict]]]:
+        """Generators of the ``(key, example)`` pairs of every split, as is.
+
+        Examples are neither described nor observed, so their images are not
+        decoded, e.g. to stream them without preparing the dataset.
+        """
+        self._observing = False
+        try:
+            return self._split_generators(dl_manager)  # type: ignore
+        finally:
+            self._observing = True
+
+    def _with_statistics(
+        self, split: str, examples: Iterable[Tuple[str, Dict]]
+    ) -> Iterable[Tuple[str, Dict]]:
+        """Pass on the examples of a split, storing their statistics at the end."""
+        if not self._observing:
+            return examples
+
+        return self._observed(split, examples)
+
+    def _observed(
+        self, split: str, examples: Iterable[Tuple[str, Dict]]
+    ) -> Iterator[Tuple[str, Dict]]:
+        statistics = DatasetStatistics.for_features(
+            self.info.features,  # type: ignore
+            self.STATISTICS_LABELS,
+            self.STATISTICS_QUANTILES,
+        )
+        for key, example in examples:
+            images = statistics.decode_images(example)
+            statistics.update(example, images)
+            self._observe_example(split, key, example, images)
+            yield key, example
+
+        metadata = self.info.metadata  # type: ignore
+        metadata.setdefault(STATISTICS_KEY, {})[split] = statistics.to_dict()
+
+    def _observe_example(
+        self, split: str, key, example: Dict, images: Dict[str, List[np.ndarray]]
+    ) -> None:
+        """Receive every generated example, along with its decoded images.
+
+        Override, calling ``super()``, to describe the examples without reading
+        them again, or the images without decoding them again.
+        """
+
+
+def load_statistics(
+    name: str, split: str = "train", data_dir: Optional[str] = None
+) -> Dict:
+    """Load the statistics of a split of a prepared dataset."""
+    builder = tfds.builder(name, data_dir=data_dir)
+    return builder.info.metadata[STATISTICS_KEY][split]
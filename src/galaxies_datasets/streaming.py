@@ -0,0 +1,147 @@
+"""Stream examples straight from the manually downloaded files.
+
+For exploration and smoke tests, examples are generated by the builders'
+own split generators, without the statistics, hashes and sidecar rows
+gathered while preparing, encoded in a thread pool and decoded in parallel by
+tf.data, without preparing any record file.
+"""
+import collections
+import concurrent.futures
+import itertools
+import os
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+import tensorflow as tf
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import datasets  # noqa: F401
+
+
+def download_manager(
+    builder: tfds.core.DatasetBuilder,
+    download_dir: Optional[str] = None,
+    manual_dir: Optional[str] = None,
+) -> tfds.download.DownloadManager:
+    """Download manager of a builder, laid out like ``download_and_prepare``'s.
+
+    ``download_dir`` defaults to ``downloads`` in the data directory of the
+    builder, holding the ``extracted`` and ``manual`` directories.
+    """
+    if download_dir is None:
+        # the data dir of the builder is <root>/<name>[/<config>]/<version>
+        depth = len(builder.info.full_name.split("/"))
+        download_dir = os.path.join(
+            tfds.core.Path(builder.data_dir).parents[depth - 1], "downloads"
+        )
+    return tfds.download.DownloadManager(
+        download_dir=download_dir,
+        extract_dir=os.path.join(download_dir, "extracted"),
+        manual_dir=manual_dir or os.path.join(download_dir, "manual"),
+        manual_dir_instructions=builder.MANUAL_DOWNLOAD_INSTRUCTIONS,
+        dataset_name=builder.name,
+    )
+
+
+def generate_examples(
+    name: str,
+    split: str = "train",
+    manual_dir: Optional[str] = None,
+    limit: Optional[int] = None,
+    data_dir: Optional[str] = None,
+    download_dir: Optional[str] = None,
+) -> Iterator[Tuple[str, Dict]]:
+    """Yield the ``(key, example)`` pairs a builder generates for a split.
+
+    Examples are as generated, before encoding: images are paths, bytes or
+    file objects. See :func:`download_manager` for the default directories.
+    """
+    builder = tfds.builder(name, data_dir=data_dir)
+    dl_manager = download_manager(builder, download_dir, manual_dir)
+    generators = builder.split_generators(dl_manager)
+    if split not in generators:
+        raise ValueError(f"Unknown split {split!r}, expected one of {list(generators)}")
+
+    yield from itertools.islice(generators[split], limit)
+
+
+def serialized_examples(
+    name: str,
+    split: str = "train",
+    manual_dir: Optional[str] = None,
+    limit: Optional[int] = None,
+    num_workers: int = 8,
+    data_dir: Optional[str] = None,
+    download_dir: Optional[str] = None,
+) -> Iterator[bytes]:
+    """Yield serialized examples, encoding up to ``num_workers`` at a time.
+
+    Examples are generated in order and only ``2 * num_workers`` ahead of the
+    consumer, so the first ones come out as soon as they are encoded.
+    """
+    features = tfds.builder(name, data_dir=data_dir).info.features
+    examples = generate_examples(name, split, manual_dir, limit, data_dir, download_dir)
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as pool:
+        pending: collections.deque = collections.deque()
+        for _, example in examples:
+            pending.append(pool.submit(features.serialize_example, example))
+            if len(pending) >= 2 * num_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def stream(
+    name: str,
+    split: str = "train",
+    manual_dir: Optional[str] = None,
+    limit: Optional[int] = None,
+    num_workers: Optional[int] = None,
+    decoders: Optional[Dict] = None,
+    data_dir: Optional[str] = None,
+    download_dir: Optional[str] = None,
+) -> tf.data.Dataset:
+    """Stream the examples of a dataset from its manually downloaded files.
+
+    The dataset yields the same features as ``tfds.load`` would once prepared,
+    in generation order, decoded with autotuned parallelism. ``limit`` keeps
+    only the first examples, ``num_workers`` sets the encoding threads.
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    ds = tf.data.Dataset.from_generator(
+        lambda: serialized_examples(
+            name, split, manual_dir, limit, num_workers, data_dir, download_dir
+        ),
+        output_signature=tf.TensorSpec(shape=(), dtype=tf.string),
+    )
+    features = tfds.builder(name, data_dir=data_dir).info.features
+    return ds.map(
+        lambda x: features.deserialize_example(x, decoders=decoders),
+        num_parallel_calls=tf.data.AUTOTUNE,
+    ).prefetch(tf.data.AUTOTUNE)
+
+
+def iterate(
+    name: str,
+    split: str = "train",
+    manual_dir: Optional[str] = None,
+    limit: Optional[int] = None,
+    num_workers: Optional[int] = None,
+    data_dir: Optional[str] = None,
+    download_dir: Optional[str] = None,
+) -> Iterator[Dict]:
+    """Iterate over decoded numpy examples streamed from the manual files."""
+    ds = stream(
+        name,
+        split,
+        manual_dir,
+        limit,
+        num_workers,
+        data_dir=data_dir,
+        download_dir=download_dir,
+    )
+    return iter(tfds.as_numpy(ds))
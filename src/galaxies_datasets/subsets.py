@@ -0,0 +1,103 @@
+"""Prepare small subsets of the datasets, selected during generation.
+
+Builders take ``fraction``, ``limit`` and ``filter`` options and check each
+catalogue row with :meth:`SubsetMixin._in_subset` before reading its images,
+so that a development sized subset is prepared in minutes::
+
+    builder = tfds.builder("galaxy_zoo2", data_dir="~/gz2_sample", fraction=0.05)
+    builder.download_and_prepare()
+
+Sampling hashes the example keys, so the same subset is selected every time
+and a smaller fraction selects a subset of a larger one. Subsets are
+prepared in the same directories as the full datasets would be, so they need
+their own ``data_dir``.
+"""
+import collections
+import hashlib
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Mapping
+from typing import Optional
+
+SUBSET_KEY = "subset"
+
+Filter = Callable[[Mapping[str, Any]], bool]
+
+
+def hash_fraction(key, seed: int = 0) -> float:
+    """Deterministic pseudo-random number in [0, 1) for an example key."""
+    digest = hashlib.sha256(f"{seed}:{key}".encode()).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+
+class SubsetMixin:
+    """Builder options selecting a subset of the examples.
+
+    ``fraction`` keeps each example with that probability, from a hash of its
+    key and ``seed``. ``filter`` keeps the examples whose catalogue row it
+    accepts: a csv row of strings, or a pandas row for galaxy_zoo2. ``limit``
+    keeps at most that many of the remaining examples of each split, in
+    generation order.
+    The options are recorded in the ``subset`` metadata.
+    """
+
+    def __init__(
+        self,
+        *,
+        fraction: Optional[float] = None,
+        limit: Optional[int] = None,
+        filter: Optional[Filter] = None,
+        seed: int = 0,
+        **kwargs,
+    ):
+        """Set the subset options."""
+        if fraction is not None and not 0 < fraction <= 1:
+            raise ValueError(f"fraction must be in (0, 1], got {fraction}")
+        subset = fraction is not None or limit is not None or filter is not None
+        if subset and kwargs.get("data_dir") is None:
+            raise ValueError("Subsets must be prepared in their own data_dir")
+
+        super().__init__(**kwargs)  # type: ignore
+        self._subset_fraction = fraction
+        self._subset_limit = limit
+        self._subset_filter = filter
+        self._subset_seed = seed
+        self._subset_counts: Dict[str, int] = collections.Counter()
+
+    @property
+    def is_subset(self) -> bool:
+        """Whether only some of the examples are prepared."""
+        return (
+            self._subset_fraction is not None
+            or self._subset_limit is not None
+            or self._subset_filter is not None
+        )
+
+    def _download_and_prepare(self, *args, **kwargs):
+        self._subset_counts.clear()
+        if self.is_subset:
+            self.info.metadata[SUBSET_KEY] = {  # type: ignore
+                "fraction": self._subset_fraction,
+                "limit": self._subset_limit,
+                "filter": getattr(
+                    self._subset_filter, "__name__", repr(self._subset_filter)
+                ),
+                "seed": self._subset_seed,
+            }
+        super()._download_and_prepare(*args, **kwargs)  # type: ignore
+
+    def _in_subset(self, key, row: Mapping[str, Any], split: str = "train") -> bool:
+        """Whether to generate an example, given its key and catalogue row."""
+        count = self._subset_counts[split]
+        if self._subset_limit is not None and count >= self._subset_limit:
+            return False
+        if self._subset_fraction is not None and (
+            hash_fraction(key, self._subset_seed) >= self._subset_fraction
+        ):
+            return False
+        if self._subset_filter is not None and not self._subset_filter(row):
+            return False
+
+        self._subset_counts[split] += 1
+        return True
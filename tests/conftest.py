@@ -0,0 +1,28 @@
+"""Fixtures shared by the test modules."""
+import sys
+
+import pytest
+import tensorflow_datasets as tfds
+
+from galaxies_datasets.datasets.galaxy_zoo_challenge import galaxy_zoo_challenge
+
+# serving needs multiprocessing.shared_memory, new in Python 3.8
+collect_ignore = ["test_serving.py"] if sys.version_info < (3, 8) else []
+
+
+@pytest.fixture(scope="session")
+def challenge_data_dir(tmp_path_factory):
+    """Prepare both galaxy_zoo_challenge configs from their dummy data, once.
+
+    Tests reading the prepared datasets share them, so they must not write to
+    this directory.
+    """
+    data_dir = tmp_path_factory.mktemp("galaxy_zoo_challenge")
+    download_config = tfds.download.DownloadConfig(
+        manual_dir=tfds.core.Path(galaxy_zoo_challenge.__file__).parent / "dummy_data"
+    )
+    for config in ["train", "test"]:
+        builder = tfds.builder(f"galaxy_zoo_challenge/{config}", data_dir=data_dir)
+        builder.download_and_prepare(download_config=download_config)
+
+    return str(data_dir)
@@ -0,0 +1,28 @@
+"""Test the duplicates script."""
+import pandas as pd
+from typer.testing import CliRunner
+
+from galaxies_datasets import __main__
+
+
+def test_cli(challenge_data_dir, tmp_path):
+    """Test that the report is printed and written."""
+    output = tmp_path / "report.csv"
+
+    result = CliRunner().invoke(
+        __main__.app,
+        [
+            "duplicates",
+            "galaxy_zoo_challenge/test",
+            "--data-dir",
+            challenge_data_dir,
+            "--output",
+            str(output),
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "dataset_a" in result.output
+    report = pd.read_csv(output)
+    assert list(report["pairs"]) == [0]
+    assert list(report["examples_a"]) == [0]
@@ -1,5 +1,6 @@
 SELECT
-    tab.*
+    tab.*,
+    ape.Mass_Star as ApertureMass_Star
 FROM
     RecalL0025N0752_SubHalo as gal,
     RecalL0025N0752_Aperture as ape,
@@ -1,22 +1,30 @@
 """Test cases for the download_eagle script."""
 import pathlib
+import re
 
 import pandas as pd
 from eagleSqlTools._eagleSqlTools import _WebDBConnection
 
+from galaxies_datasets.eagle_columns import TABLE_COLUMNS
 from galaxies_datasets.scripts.eagle.download import clean_urls
 from galaxies_datasets.scripts.eagle.download import default_manual_dir
 from galaxies_datasets.scripts.eagle.download import download_and_save_data
+from galaxies_datasets.scripts.eagle.download import download_pages
 from galaxies_datasets.scripts.eagle.download import download_table
 from galaxies_datasets.scripts.eagle.download import download_tables
 from galaxies_datasets.scripts.eagle.download import EagleOrientation
+from galaxies_datasets.scripts.eagle.download import get_cache_path
 from galaxies_datasets.scripts.eagle.download import get_download_path
 from galaxies_datasets.scripts.eagle.download import get_filename_from_url
 from galaxies_datasets.scripts.eagle.download import get_images_path
 from galaxies_datasets.scripts.eagle.download import get_urls
+from galaxies_datasets.scripts.eagle.download import parse_columns
 from galaxies_datasets.scripts.eagle.download import save_dataframe
+from galaxies_datasets.scripts.eagle.download import select_columns
 from galaxies_datasets.scripts.eagle.download import strip_url
 from galaxies_datasets.scripts.eagle.download import table_query
+from galaxies_datasets.scripts.eagle.query_cache import MASS_COLUMN
+from galaxies_datasets.scripts.eagle.query_cache import QueryCache
 
 
 THIS_DIR = pathlib.Path(__file__).parent
@@ -42,6 +50,7 @@ class DummyConnection(_WebDBConnection):
         image_urls = [url, None]
         d = {
             "GalaxyID": galaxy_ids,
+            MASS_COLUMN: [2e8, 3e8],
             f"query_{self.counter}": queries,
         }
         if self.counter == 0:
@@ -54,6 +63,39 @@ class DummyConnection(_WebDBConnection):
         return d
 
 
+class PagedConnection(_WebDBConnection):
+    """Fake database connection honouring GalaxyID ranges and the mass threshold."""
+
+    def __init__(self, n_galaxies):
+        """Override init."""
+        self.galaxy_ids = list(range(100, 100 + 2 * n_galaxies, 2))
+        self.n_rows = []
+        self.queries = []
+
+    def _execute_query(self, query):
+        self.queries.append(query)
+        min_mass_star = float(re.search(r"Mass_Star > (\S+)", query).group(1))
+        ids = [i for i in self.galaxy_ids if 1e7 * i > min_mass_star]
+        galaxy_range = re.search(r"GalaxyID between (\d+) and (\d+)", query)
+        if galaxy_range is not None:
+            low, high = map(int, galaxy_range.groups())
+            ids = [i for i in ids if low <= i <= high]
+        after = re.search(r"GalaxyID > (\d+)", query)
+        if after is not None:
+            ids = [i for i in ids if i > int(after.group(1))]
+        top = re.search(r"SELECT TOP (\d+)", query)
+        if top is not None:
+            ids = ids[: int(top.group(1))]
+        self.n_rows.append(len(ids))
+
+        masses = {MASS_COLUMN: [1e7 * i for i in ids]}
+        if "_SubHalo as tab" in query:
+            url = b"<img src='http://eagle/galface_1.png'>"
+            d = {f"Image_{o.value}": [url] * len(ids) for o in EagleOrientation}
+            return {"GalaxyID": ids, **masses, **d}
+        return {"GalaxyID": ids, **masses, "R_halfmass30": [float(i) for i in ids]}
+
+
 def test_table_query():
     """Test the table query template."""
     path = THIS_DIR / "table_query_test.sql"
@@ -117,9 +159,11 @@ def test_clean_urls():
     )
     data = download_tables(connection, "test_simulation", 27, 1e8)
     clean_urls(data)
+    # outer merges sort their keys since pandas 2.2
+    data = data.set_index("GalaxyID")
     for orientation in EagleOrientation:
-        assert data[f"Image_{orientation.value}"].iloc[0] == expected
-        assert data[f"Image_{orientation.value}"].iloc[1] is None
+        assert data[f"Image_{orientation.value}"].loc[89] == expected
+        assert data[f"Image_{orientation.value}"].loc[45] is None
 
 
 def test_save_dataframe(tmp_path):
@@ -200,3 +244,148 @@ def test_get_filename_from_url():
     expected_filename = "galface_1848107.png"
     filename = get_filename_from_url(url)
     assert filename == expected_filename
+
+
+def test_table_query_max_mass_star():
+    """Test that an upper stellar mass bound is added to the query."""
+    obtained_sql = table_query("RecalL0025N0752", 27, 1e8, "Magnitudes", 1e9)
+    assert "ape.Mass_Star > 1.00e+08 and ape.Mass_Star <= 1.00e+09 and" in obtained_sql
+
+
+def test_download_tables_without_mass():
+    """Test that the stellar mass selected by the queries is not kept."""
+    data = download_tables(DummyConnection(), "test_simulation", 27, 1e8)
+    assert MASS_COLUMN not in data
+
+
+def test_default_cache_path():
+    """Test that the cache is located in the manual_dir."""
+    assert get_cache_path() == default_manual_dir / "eagle_query_cache"
+
+
+def test_select_columns():
+    """Test the column projection."""
+    assert select_columns() == "tab.*"
+    assert select_columns(["GalaxyID", "SnapNum"]) == "tab.GalaxyID,\n    tab.SnapNum"
+    assert select_columns(["SnapNum"]) == "tab.GalaxyID,\n    tab.SnapNum"
+
+
+def test_table_query_columns():
+    """Test that only the requested columns are selected."""
+    obtained_sql = table_query(
+        "RecalL0025N0752", 27, 1e8, "Sizes", columns=["GalaxyID", "R_halfmass30"]
+    )
+    assert obtained_sql.startswith(
+        "SELECT\n    tab.GalaxyID,\n    tab.R_halfmass30,\n"
+        f"    ape.Mass_Star as {MASS_COLUMN}\n"
+    )
+    assert "tab.*" not in obtained_sql
+
+
+def test_download_tables_default_columns():
+    """Test that by default only the columns used by the dataset are selected."""
+    connection = DummyConnection()
+    data = download_tables(connection, "test_simulation", 27, 1e8)
+    for column in TABLE_COLUMNS["Sizes"]:
+        assert f"tab.{column}" in data["query_1"].iloc[0]
+    assert "tab.*" not in data["query_1"].iloc[0]
+
+
+def test_parse_columns():
+    """Test parsing column selections from the command line."""
+    assert parse_columns([]) == TABLE_COLUMNS
+
+    columns = parse_columns(["Sizes=R_halfmass30, R_halfmass100", "SubHalo=*"])
+    assert columns["Sizes"] == ["R_halfmass30", "R_halfmass100"]
+    assert columns["SubHalo"] is None
+
+
+def test_table_query_galaxy_ids():
+    """Test that queries can be restricted to a GalaxyID range."""
+    obtained_sql = table_query("RecalL0025N0752", 27, 1e8, "Sizes", galaxy_ids=(3, 7))
+    assert "ape.Mass_Star > 1.00e+08 and gal.GalaxyID between 3 and 7 and" in (
+        obtained_sql
+    )
+
+
+def test_table_query_keyset():
+    """Test that queries can select the next page of galaxies by key."""
+    obtained_sql = table_query(
+        "RecalL0025N0752", 27, 1e8, "SubHalo", after=7, limit=100
+    )
+    assert obtained_sql.startswith("SELECT TOP 100\n")
+    assert "ape.Mass_Star > 1.00e+08 and gal.GalaxyID > 7 and" in obtained_sql
+    assert obtained_sql.endswith("ORDER BY\n    gal.GalaxyID\n")
+
+
+def test_download_pages():
+    """Test that every page is bounded by the page size."""
+    connection = PagedConnection(n_galaxies=10)
+    pages = list(download_pages(connection, "test_sim", 27, 1e8, page_size=4))
+
+    assert [len(page) for page in pages] == [4, 4, 2]
+    assert max(connection.n_rows) == 4
+    galaxy_ids = pd.concat(pages)["GalaxyID"]
+    assert list(galaxy_ids) == connection.galaxy_ids
+    assert all("R_halfmass30" in page for page in pages)
+
+
+def test_download_and_save_data_paged(tmp_path):
+    """Test that paged downloads are saved as a whole table."""
+    simulation = "test_sim"
+    snap_number = 27
+    path = tmp_path / f"{simulation}/{snap_number}"
+
+    download_and_save_data(
+        PagedConnection(10), simulation, snap_number, 1e8, tmp_path, page_size=3
+    )
+    paged = pd.read_csv(path / "data.csv")
+
+    download_and_save_data(PagedConnection(10), simulation, snap_number, 1e8, tmp_path)
+    whole = pd.read_csv(path / "data.csv")
+
+    assert len(paged) == 10
+    pd.testing.assert_frame_equal(paged, whole)
+    assert paged["Image_face"].iloc[0] == "http://eagle/galface_1.png"
+
+
+def test_download_pages_exact_multiple():
+    """Test that the last full page ends the download without an empty page."""
+    connection = PagedConnection(n_galaxies=8)
+    pages = list(download_pages(connection, "test_sim", 27, 1e8, page_size=4))
+
+    assert [len(page) for page in pages] == [4, 4]
+    assert list(pd.concat(pages)["GalaxyID"]) == connection.galaxy_ids
+
+
+def test_download_and_save_data_paged_empty(tmp_path):
+    """Test that an empty selection still saves the columns, without urls."""
+    download_and_save_data(
+        PagedConnection(0), "test_sim", 27, 1e8, tmp_path, page_size=3
+    )
+    data = pd.read_csv(tmp_path / "test_sim/27/data.csv")
+    assert len(data) == 0
+    assert "R_halfmass30" in data
+
+    for orientation in EagleOrientation:
+        urls = get_urls("test_sim", 27, orientation, tmp_path)
+        assert len(urls) == 0
+
+
+def test_download_pages_from_cache(tmp_path):
+    """Test that pages are read from the cache when it holds the whole tables."""
+    cache = QueryCache(tmp_path)
+    download_tables(PagedConnection(10), "test_sim", 27, 1e8, cache)
+    whole = download_tables(PagedConnection(10), "test_sim", 27, 1.1e9)
+
+    connection = PagedConnection(10)
+    pages = list(download_pages(connection, "test_sim", 27, 1.1e9, 3, cache=cache))
+    assert connection.queries == []
+    assert [len(page) for page in pages] == [3, 1]
+    pd.testing.assert_frame_equal(pd.concat(pages, ignore_index=True), whole)
+
+    connection = PagedConnection(10)
+    pages = list(download_pages(connection, "test_sim", 27, 1e7, 4, cache=cache))
+    assert len(connection.queries) == 6
+    assert len(pd.concat(pages)) == 10
+    assert cache.load("test_sim", "Sizes", 27).min_mass_star == 1e8
@@ -0,0 +1,174 @@
+"""Test cases for the EAGLE query cache."""
+import re
+
+import pandas as pd
+from eagleSqlTools._eagleSqlTools import _WebDBConnection
+
+from galaxies_datasets.scripts.eagle.download import download_pages
+from galaxies_datasets.scripts.eagle.download import download_tables
+from galaxies_datasets.scripts.eagle.query_cache import CacheEntry
+from galaxies_datasets.scripts.eagle.query_cache import MASS_COLUMN
+from galaxies_datasets.scripts.eagle.query_cache import queried_mass
+from galaxies_datasets.scripts.eagle.query_cache import QueryCache
+
+
+class CatalogueConnection(_WebDBConnection):
+    """Fake database connection honouring the stellar mass condition."""
+
+    def __init__(self):
+        """Override init."""
+        self.masses = {1: 5e7, 2: 2e8, 3: 3e9, 4: 4e10}
+        self.queries = []
+
+    def _execute_query(self, query):
+        self.queries.append(query)
+        low = float(re.search(r"Mass_Star > (\S+)", query).group(1))
+        high = re.search(r"Mass_Star <= (\S+)", query)
+        high = float("inf") if high is None else float(high.group(1))
+        ids = [i for i, m in self.masses.items() if low < m <= high]
+
+        table = re.search(r"_(\w+) as tab", query).group(1)
+        columns = re.findall(r"tab\.(\w+)", query.split("FROM")[0])
+        if not columns:
+            columns = ["GalaxyID", f"{table}_value", f"{table}_extra"]
+        data = {
+            c: ids if c == "GalaxyID" else [f"{c}_{i}" for i in ids] for c in columns
+        }
+        return {**data, MASS_COLUMN: [self.masses[i] for i in ids]}
+
+
+def test_queried_mass():
+    """Test that thresholds are rounded as in the sql queries."""
+    assert queried_mass(1.234e8) == 1.23e8
+
+
+def test_save_and_load(tmp_path):
+    """Test that entries are saved and loaded back."""
+    cache = QueryCache(tmp_path)
+    assert cache.load("sim", "SubHalo", 27) is None
+
+    data = pd.DataFrame(
+        {"GalaxyID": [1, 2], "url": [b"a", None], MASS_COLUMN: [2e8, 3e8]}
+    )
+    cache.save("sim", "SubHalo", 27, CacheEntry(data, 1e8))
+    entry = cache.load("sim", "SubHalo", 27)
+
+    pd.testing.assert_frame_equal(entry.data, data)
+    assert entry.min_mass_star == 1e8
+    assert cache.load("sim", "SubHalo", 26) is None
+
+
+def test_load_without_mass(tmp_path):
+    """Test that entries which cannot be filtered by mass are ignored."""
+    cache = QueryCache(tmp_path)
+    data = pd.DataFrame({"GalaxyID": [1, 2]})
+    cache.save("sim", "SubHalo", 27, CacheEntry(data, 1e8))
+    assert cache.load("sim", "SubHalo", 27) is None
+
+
+def test_fetch_reuses_superset(tmp_path):
+    """Test that higher thresholds are served from the cache."""
+    cache = QueryCache(tmp_path)
+    calls = []
+
+    def fetch(low, high):
+        calls.append((low, high))
+        return pd.DataFrame({"GalaxyID": [len(calls)], MASS_COLUMN: [2 * low]})
+
+    cache.fetch(fetch, "sim", "SubHalo", 27, 1e8)
+    data = cache.fetch(fetch, "sim", "SubHalo", 27, 1e9)
+    assert calls == [(1e8, None)]
+    assert len(data) == 0
+
+    data = cache.fetch(fetch, "sim", "SubHalo", 27, 1e7)
+    assert calls == [(1e8, None), (1e7, 1e8)]
+    assert list(data["GalaxyID"]) == [1, 2]
+    assert cache.load("sim", "SubHalo", 27).min_mass_star == 1e7
+
+
+def test_download_tables_with_cache(tmp_path):
+    """Test that cached tables are filtered locally and only deltas queried."""
+    connection = CatalogueConnection()
+    cache = QueryCache(tmp_path)
+
+    data = download_tables(connection, "sim", 27, 1e8, cache)
+    assert sorted(data["GalaxyID"]) == [2, 3, 4]
+    assert MASS_COLUMN not in data
+    n_queries = len(connection.queries)
+    assert n_queries == 2
+
+    data = download_tables(connection, "sim", 27, 1e9, cache)
+    assert sorted(data["GalaxyID"]) == [3, 4]
+    expected = [f"R_halfmass30_{i}" for i in data["GalaxyID"]]
+    assert list(data["R_halfmass30"]) == expected
+    assert len(connection.queries) == n_queries
+
+    data = download_tables(connection, "sim", 27, 1e7, cache)
+    assert sorted(data["GalaxyID"]) == [1, 2, 3, 4]
+    assert all("Mass_Star <= 1.00e+08" in q for q in connection.queries[n_queries:])
+
+    n_queries = len(connection.queries)
+    selected = download_tables(connection, "sim", 27, 1e8, cache)
+    assert sorted(selected["GalaxyID"]) == [2, 3, 4]
+    assert len(connection.queries) == n_queries
+
+    uncached = download_tables(CatalogueConnection(), "sim", 27, 1e7)
+    pd.testing.assert_frame_equal(
+        data.sort_values("GalaxyID", ignore_index=True),
+        uncached.sort_values("GalaxyID", ignore_index=True),
+    )
+
+
+def test_download_tables_new_snapshot(tmp_path):
+    """Test that snapshots are cached independently."""
+    connection = CatalogueConnection()
+    cache = QueryCache(tmp_path)
+
+    download_tables(connection, "sim", 27, 1e8, cache)
+    n_queries = len(connection.queries)
+    download_tables(connection, "sim", 26, 1e8, cache)
+    assert len(connection.queries) == 2 * n_queries
+
+
+def test_entry_covers():
+    """Test that entries only cover the columns they hold."""
+    data = pd.DataFrame({"GalaxyID": [1]})
+    assert CacheEntry(data, 1e8).covers(None)
+    assert CacheEntry(data, 1e8).covers(["a"])
+    assert CacheEntry(data, 1e8, ["a", "b"]).covers(["b"])
+    assert not CacheEntry(data, 1e8, ["a", "b"]).covers(["c"])
+    assert not CacheEntry(data, 1e8, ["a", "b"]).covers(None)
+
+
+def test_download_tables_with_cache_columns(tmp_path):
+    """Test that cached columns are reused and missing columns refetched."""
+    connection = CatalogueConnection()
+    cache = QueryCache(tmp_path)
+    all_columns = {"SubHalo": None, "Sizes": None}
+
+    download_tables(connection, "sim", 27, 1e8, cache, all_columns)
+    n_queries = len(connection.queries)
+
+    columns = {"SubHalo": ["SubHalo_value"], "Sizes": None}
+    data = download_tables(connection, "sim", 27, 1e8, cache, columns)
+    assert len(connection.queries) == n_queries
+    assert "SubHalo_extra" not in data
+    assert "Sizes_extra" in data
+
+    columns = {"SubHalo": ["SubHalo_value"], "Sizes": ["R_halfmass30"]}
+    download_tables(connection, "sim", 27, 1e8, cache, columns)
+    download_tables(connection, "sim", 27, 1e7, cache, columns)
+    sizes_queries = [q for q in connection.queries[n_queries:] if "_Sizes" in q]
+    assert len(sizes_queries) == 1
+    assert "Mass_Star <=" not in sizes_queries[0]
+
+
+def test_download_pages_with_cache(tmp_path):
+    """Test that pages are served from and filtered like the cached tables."""
+    cache = QueryCache(tmp_path)
+    download_tables(CatalogueConnection(), "sim", 27, 1e7, cache)
+
+    connection = CatalogueConnection()
+    pages = download_pages(connection, "sim", 27, 1e9, 1, cache=cache)
+    assert [list(page["GalaxyID"]) for page in pages] == [[3], [4]]
+    assert connection.queries == []
@@ -0,0 +1,92 @@
+"""Test the EAGLE download telemetry."""
+import collections
+import functools
+import http.server
+import json
+import threading
+import urllib.request
+
+import pandas as pd
+import pytest
+
+from galaxies_datasets.scripts.eagle.download import download_images
+from galaxies_datasets.scripts.eagle.download import EagleOrientation
+from galaxies_datasets.scripts.eagle.download import get_download_path
+from galaxies_datasets.scripts.eagle.download import get_images_path
+from galaxies_datasets.scripts.eagle.telemetry import Telemetry
+
+
+def test_metrics():
+    """Rates, percentiles and counts cover the recorded requests."""
+    telemetry = Telemetry()
+    telemetry.start_snapshot(27, 10)
+    telemetry.set_pending(10)
+    for latency in [0.1, 0.2, 0.3, 0.4]:
+        telemetry.record(1000, latency, 200, collections.Counter({"503": 1}))
+    telemetry.record(0, 0.5, 404)
+    telemetry.record(0, 1.0, None)
+
+    metrics = telemetry.metrics()
+    assert metrics["images"] == 4
+    assert metrics["bytes"] == 4000
+    assert metrics["images_per_second"] > 0
+    assert metrics["latency_ms"]["p50"] == pytest.approx(350)
+    assert metrics["retries"] == {"503": 4}
+    assert metrics["errors"] == {"404": 1, "connection": 1}
+    assert metrics["pending"] == 6
+    assert metrics["snapshot_images"] == 4
+    assert metrics["snapshot_eta_seconds"] > 0
+
+    assert telemetry.metrics()["images_per_second"] == 0
+    assert telemetry.metrics()["snapshot_eta_seconds"] is None
+
+
+def test_reports(tmp_path):
+    """Metrics are appended to the file and served over HTTP."""
+    path = tmp_path / "metrics.jsonl"
+    with Telemetry(path, interval=0.01, port=0) as telemetry:
+        telemetry.record(10, 0.1, 200)
+        telemetry.write()
+        with urllib.request.urlopen(f"http://localhost:{telemetry.port}") as r:
+            served = json.load(r)
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(lines) >= 2
+    assert lines[-1]["images"] == 1
+    assert served["images"] == 1
+
+
+def test_download_images(tmp_path):
+    """Downloads record every image and failed request."""
+    served = tmp_path / "served"
+    served.mkdir()
+    (served / "galface_1.png").write_bytes(b"x" * 100)
+    handler = functools.partial(
+        http.server.SimpleHTTPRequestHandler, directory=str(served)
+    )
+    handler.log_message = lambda *args: None
+    server = http.server.ThreadingHTTPServer(("localhost", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://localhost:{server.server_address[1]}"
+
+    manual_dir = tmp_path / "manual"
+    path = get_download_path("Sim", 27, manual_dir)
+    path.mkdir(parents=True)
+    pd.DataFrame(
+        {"Image_face": [f"{url}/galface_1.png", f"{url}/galface_2.png"]}
+    ).to_csv(path / "data.csv", index=False)
+
+    telemetry = Telemetry()
+    try:
+        download_images(
+            "Sim", 27, EagleOrientation.face, manual_dir, telemetry=telemetry
+        )
+    finally:
+        server.shutdown()
+
+    metrics = telemetry.metrics()
+    assert metrics["images"] == 1
+    assert metrics["bytes"] == 100
+    assert metrics["errors"] == {"404": 1}
+    images_path = get_images_path("Sim", 27, manual_dir)
+    assert (images_path / "galface_1.png").read_bytes() == b"x" * 100
@@ -0,0 +1,107 @@
+"""Test prepare."""
+import tensorflow as tf
+import tensorflow_datasets as tfds
+from typer.testing import CliRunner
+
+from galaxies_datasets import __main__
+from galaxies_datasets.datasets.galaxy_zoo_challenge import galaxy_zoo_challenge
+from galaxies_datasets.scripts.prepare import prepare
+
+manual_dir = str(tfds.core.Path(galaxy_zoo_challenge.__file__).parent / "dummy_data")
+
+
+def test_expand_name():
+    """Datasets without config expand to all their configs."""
+    assert prepare.expand_name("galaxy_zoo_challenge") == [
+        "galaxy_zoo_challenge/train",
+        "galaxy_zoo_challenge/test",
+    ]
+    assert prepare.expand_name("eagle/RefL0025N0376") == ["eagle/RefL0025N0376"]
+    assert prepare.expand_name("galaxy_zoo2") == [
+        "galaxy_zoo2/jpeg",
+        "galaxy_zoo2/webp",
+    ]
+
+
+def test_all_configs():
+    """Every config of every dataset is listed."""
+    configs = prepare.all_configs()
+    assert "galaxy_zoo2/webp" in configs
+    assert "galaxy_zoo_decals/auto" in configs
+    assert len([c for c in configs if c.startswith("eagle/")]) == 20
+
+
+def test_plan_jobs():
+    """Jobs are limited by the cores, the memory and the configs."""
+    assert prepare.plan_jobs(10, jobs=4, memory_gb=64) == 4
+    assert prepare.plan_jobs(10, jobs=8, memory_gb=5, memory_per_job_gb=2) == 2
+    assert prepare.plan_jobs(3, jobs=8, memory_gb=64) == 3
+    assert prepare.plan_jobs(3, jobs=8, memory_gb=0.5) == 1
+
+
+def test_unknown_memory(monkeypatch):
+    """Without /proc/meminfo nor sysconf, as on Windows, memory is unknown."""
+
+    def no_meminfo(*args, **kwargs):
+        raise OSError
+
+    monkeypatch.setattr(prepare, "open", no_meminfo, raising=False)
+    monkeypatch.delattr(prepare.os, "sysconf", raising=False)
+
+    assert prepare.available_memory_gb() is None
+    jobs = prepare.DEFAULT_MEMORY_GB // prepare.MEMORY_PER_JOB_GB
+    assert prepare.plan_jobs(10, jobs=8) == jobs
+    assert prepare.plan_jobs(10, jobs=8, memory_gb=64) == 8
+
+
+def test_estimate_memory_gb(tmp_path):
+    """Configs with smaller examples need less memory."""
+    data_dir = str(tmp_path)
+    labels = prepare.estimate_memory_gb(
+        "galaxy_zoo_decals/volunteers_5_labels", data_dir
+    )
+    images = prepare.estimate_memory_gb("galaxy_zoo_decals/volunteers_5", data_dir)
+    assert prepare.BASE_MEMORY_GB < labels < images
+    assert images == prepare.MEMORY_PER_JOB_GB
+    assert (
+        prepare.estimate_memory_gb("eagle/RefL0025N0376", data_dir)
+        == prepare.MEMORY_PER_JOB_GB
+    )
+
+
+def test_example_bytes():
+    """Images count with their decoded size."""
+    features = tfds.features.FeaturesDict(
+        {"image": tfds.features.Image(shape=(4, 4, 3)), "label": {"a": tf.float64}}
+    )
+    assert prepare.example_bytes(features) == 4 * 4 * 3 + 8
+
+
+def test_run_in_pool(tmp_path):
+    """Configs are prepared by worker processes."""
+    names = ["galaxy_zoo_challenge/train", "galaxy_zoo_challenge/test"]
+    results = prepare.run(names, 2, str(tmp_path), manual_dir)
+
+    assert [result.name for result in results] == names
+    assert [result.error for result in results] == [None, None]
+    assert [result.num_examples for result in results] == [3, 3]
+    builder = tfds.builder(names[0], data_dir=str(tmp_path))
+    assert builder.info.splits["train"].num_examples == 3
+
+
+def test_command(tmp_path):
+    """The command prints a summary and fails when a config fails."""
+    runner = CliRunner()
+    args = ["--jobs", "1", "--data_dir", str(tmp_path), "--manual_dir", manual_dir]
+    result = runner.invoke(
+        __main__.app, ["prepare", "galaxy_zoo_challenge/train", *args]
+    )
+    assert result.exit_code == 0, result.output
+    assert "galaxy_zoo_challenge/train  ok" in result.output
+
+    result = runner.invoke(__main__.app, ["prepare", "galaxy_zoo2", *args])
+    assert result.exit_code == 1
+    assert "galaxy_zoo2/jpeg failed" in result.output
+
+    result = runner.invoke(__main__.app, ["prepare"])
+    assert result.exit_code != 0
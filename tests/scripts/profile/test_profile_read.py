@@ -0,0 +1,69 @@
+"""Test profile_read."""
+import json
+
+import pytest
+import tensorflow_datasets as tfds
+from typer.testing import CliRunner
+
+from galaxies_datasets import __main__
+from galaxies_datasets import eagle_columns
+from galaxies_datasets.datasets.eagle import eagle
+from galaxies_datasets.scripts.profile import profile_read
+
+
+@pytest.fixture(scope="module")
+def data_dir(tmp_path_factory):
+    """Prepare the stacked eagle dummy data."""
+    data_dir = tmp_path_factory.mktemp("data")
+    builder = eagle.Eagle(config="RefL0025N0376_stacked", data_dir=data_dir)
+    builder.download_and_prepare(
+        download_config=tfds.download.DownloadConfig(
+            manual_dir=tfds.core.Path(eagle.__file__).parent / "dummy_data"
+        )
+    )
+    return data_dir
+
+
+def test_profile(data_dir):
+    """Test that every stage reads the same examples."""
+    result = profile_read.profile(
+        "eagle/RefL0025N0376_stacked", data_dir=str(data_dir), batch_size=2
+    )
+
+    assert list(result["stages"]) == list(profile_read.STAGES)
+    examples = {stage["examples"] for stage in result["stages"].values()}
+    assert len(examples) == 1 and examples.pop() > 0
+    for stage in result["stages"].values():
+        assert stage["examples_per_second"] > 0
+        assert stage["mb_per_second"] > 0
+    assert "added_latency_ms" in result["stages"]["decode"]
+
+    costs = result["feature_parse_us"]
+    assert set(costs) == {"GalaxyID", "Images", "Snapshot"} | {
+        f"Sizes/{size}" for size in eagle_columns.SIZES
+    }
+    assert list(costs.values()) == sorted(costs.values(), reverse=True)
+
+
+def test_command(data_dir, tmp_path):
+    """Test that the command writes a JSON report."""
+    output = tmp_path / "report.json"
+    result = CliRunner().invoke(
+        __main__.app,
+        [
+            "profile-read",
+            "eagle/RefL0025N0376_stacked",
+            "--data-dir",
+            str(data_dir),
+            "--num-examples",
+            "2",
+            "--no-per-feature",
+            "--output",
+            str(output),
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    report = json.loads(output.read_text())
+    assert report["stages"]["read"]["examples"] == 2
+    assert "feature_parse_us" not in report
@@ -0,0 +1,85 @@
+"""Test cases for the augmentation module."""
+import math
+
+import numpy as np
+import pytest
+import tensorflow as tf
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import augmentation
+from galaxies_datasets import pipelines
+
+
+@pytest.fixture
+def images():
+    """Batch of random non-symmetric images."""
+    return tf.random.uniform((8, 6, 6, 2), seed=0)
+
+
+def test_dihedral(images):
+    """Test that each element matches the equivalent image ops."""
+    result = augmentation.dihedral(images, tf.range(8))
+    for k in range(8):
+        image = images[k]
+        if k >= 4:
+            image = tf.image.flip_left_right(image)
+        np.testing.assert_array_equal(result[k], tf.image.rot90(image, k % 4))
+
+
+def test_dihedral_stacked(images):
+    """Test that all the views of an image share its element."""
+    stacked = tf.stack([images, 2 * images], axis=1)
+    result = augmentation.dihedral(stacked, tf.range(8))
+    np.testing.assert_allclose(
+        result[:, 1], 2 * augmentation.dihedral(images, tf.range(8))
+    )
+
+
+def test_rotate_quarter_turn(images):
+    """Test that rotations are counter clockwise about the center."""
+    angles = tf.fill([8], math.pi / 2)
+    result = augmentation.rotate(images, angles, interpolation="NEAREST")
+    np.testing.assert_allclose(result, tf.image.rot90(images))
+
+
+def test_random_rotation_crop(images):
+    """Test that rotations are cropped to the requested size."""
+    assert augmentation.random_rotation(images, crop_size=4).shape == (8, 4, 4, 2)
+
+
+def test_multi_view():
+    """Test that 16 views are extracted and merged back per image."""
+    views = augmentation.multi_view(tf.random.uniform((2, 69, 69, 3)), 45)
+    assert views.shape == (2, 16, 45, 45, 3)
+
+    flat = augmentation.split_views(views)
+    assert flat.shape == (32, 45, 45, 3)
+    features = tf.reduce_mean(flat, axis=[1, 2])
+    assert augmentation.merge_views(features).shape == (2, 16 * 3)
+
+
+def test_multi_view_centers():
+    """Test that the image center ends up in the corner of every part."""
+    image = np.zeros((1, 9, 9, 1), np.float32)
+    image[0, 4, 4, 0] = 1
+    views = augmentation.multi_view(tf.constant(image), 5)
+    np.testing.assert_array_equal(views[0, :, -1, -1, 0], np.ones(16))
+
+
+def test_benchmark(images):
+    """Test that both strategies are timed."""
+    timings = augmentation.benchmark(augmentation.random_dihedral, images, 2)
+    assert set(timings) == {"batched", "per_image"}
+    assert all(t > 0 for t in timings.values())
+
+
+def test_pipeline_augment():
+    """Test that augmentations are applied to pipeline batches."""
+    with tfds.testing.mock_data(num_examples=4):
+        ds = pipelines.eagle(
+            batch_size=2,
+            augment=lambda images: augmentation.random_rotation(images, 128),
+        )
+        image, label = next(iter(ds))
+    assert image.shape == (2, 128, 128, 3)
+    assert label.shape == (2, 4)
@@ -0,0 +1,130 @@
+"""Test cases for the caching module."""
+import concurrent.futures
+import io
+
+import numpy as np
+import pytest
+import tensorflow_datasets as tfds
+from PIL import Image
+
+from galaxies_datasets import caching
+from galaxies_datasets import pipelines
+
+
+def png(value):
+    """Encode a small constant image."""
+    f = io.BytesIO()
+    Image.fromarray(np.full((4, 4, 3), value, np.uint8)).save(f, format="png")
+    return f.getvalue()
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_partial_caching(shuffle):
+    """Test that repeated scans hit in proportion to the cached fraction."""
+    index = caching.ClockIndex(capacity=250)
+    rng = np.random.default_rng(0)
+    hits = []
+    for _ in range(10):
+        keys = rng.permutation(1000) if shuffle else range(1000)
+        epoch_hits = 0
+        for key in keys:
+            index.record(key)
+            if key in index:
+                index.touch(key)
+                epoch_hits += 1
+            else:
+                index.admit(key, 1)
+        hits.append(epoch_hits)
+
+    assert index.size == 250
+    assert 0.15 < np.mean(hits[1:]) / 1000 < 0.3
+
+
+def test_memory_and_disk(tmp_path):
+    """Test that images spill to disk within its budget and are read back."""
+    images = {key: png(key) for key in range(4)}
+    image_nbytes = 4 * 4 * 3
+    cache = caching.ImageCache(
+        2 * image_nbytes, spill_dir=tmp_path, disk_bytes=image_nbytes
+    )
+
+    for key, image in images.items():
+        decoded = cache.decode(key, image)
+        assert decoded.shape == (4, 4, 3) and decoded[0, 0, 0] == key
+    stats = cache.stats()
+    assert stats.misses == 4 and stats.hit_rate == 0
+    assert stats.memory_bytes == 2 * image_nbytes
+    assert stats.disk_bytes == image_nbytes
+    assert len(list(tmp_path.iterdir())) == 1
+
+    for key, image in images.items():
+        assert cache.decode(key, image)[0, 0, 0] == key
+    stats = cache.stats()
+    assert stats.hits == 2 and stats.disk_hits == 1 and stats.misses == 5
+    assert stats.hit_rate == pytest.approx(3 / 8)
+
+    cache.reset_stats()
+    assert cache.stats().hits == 0
+    cache.clear()
+    assert cache.get(0) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_read_only(tmp_path):
+    """Test that cached images cannot be modified through a lookup."""
+    cache = caching.ImageCache(4 * 4 * 3, spill_dir=tmp_path)
+    image = np.zeros((4, 4, 3), np.uint8)
+    cache.put(0, image)
+    cache.put(1, np.ones((4, 4, 3), np.uint8))
+
+    assert image.flags.writeable
+    for key in [0, 1]:
+        cached = cache.get(key)
+        assert cached[0, 0, 0] == key
+        with pytest.raises(ValueError):
+            cached[0, 0, 0] = 2
+
+
+def test_threads(tmp_path):
+    """Test that concurrent lookups spilling to disk get their own images."""
+    images = {key: png(key) for key in range(32)}
+    cache = caching.ImageCache(4 * 4 * 4 * 3, spill_dir=tmp_path, disk_bytes=1024)
+
+    def decode_all(seed):
+        rng = np.random.default_rng(seed)
+        for key in rng.choice(len(images), 200):
+            assert cache.decode(int(key), images[key])[0, 0, 0] == key
+
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        list(pool.map(decode_all, range(8)))
+
+    stats = cache.stats()
+    assert stats.hits + stats.disk_hits + stats.misses == 8 * 200
+    assert stats.disk_bytes <= 1024
+    spilled = list(tmp_path.glob("*.npy"))
+    assert len(spilled) == stats.disk_bytes // (4 * 4 * 3)
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_pipeline(challenge_data_dir):
+    """Test that pipelines decode images once, with the same results."""
+    name = "galaxy_zoo_challenge/train"
+    builder = tfds.builder(name, data_dir=challenge_data_dir)
+    keys = pipelines.label_keys(builder.info.features["label"])
+    kwargs = dict(
+        label_feature="label", shuffle_buffer=None, data_dir=challenge_data_dir
+    )
+    cache = caching.ImageCache(memory_bytes=10 * 424 * 424 * 3)
+
+    expected = list(pipelines.load(name, "image", keys, **kwargs))
+    ds = pipelines.load(name, "image", keys, image_cache=cache, **kwargs)
+    for epoch in range(2):
+        for (image, label), (expected_image, expected_label) in zip(ds, expected):
+            np.testing.assert_array_equal(image, expected_image)
+            np.testing.assert_array_equal(label, expected_label)
+
+    assert cache.stats().misses == 3
+    assert cache.stats().hits == 3
+
+    with pytest.raises(ValueError):
+        pipelines.load(name, "image", keys, cache="decoded", image_cache=cache)
@@ -0,0 +1,154 @@
+"""Test cases for the checksums module."""
+import hashlib
+import os
+import shutil
+
+import pytest
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import checksums
+from galaxies_datasets.datasets.galaxy_zoo_decals import galaxy_zoo_decals
+
+DUMMY_DATA = tfds.core.Path(galaxy_zoo_decals.__file__).parent / "dummy_data"
+
+
+@pytest.fixture
+def files(tmp_path):
+    """A directory with a few small files."""
+    data_path = tmp_path / "data"
+    (data_path / "images").mkdir(parents=True)
+    for i in range(3):
+        (data_path / "images" / f"{i}.png").write_bytes(bytes([i]) * (1000 + i))
+    (data_path / "table.csv").write_text("a,b\n1,2\n")
+    return data_path
+
+
+def test_file_digest(files):
+    """Test that chunked digests are whole file sha256."""
+    path = files / "images" / "2.png"
+    expected = hashlib.sha256(path.read_bytes()).hexdigest()
+
+    assert checksums.file_digest(path, chunk_size=7) == expected
+
+
+def test_digests_are_cached(files, tmp_path, monkeypatch):
+    """Test that only new or modified files are hashed again."""
+    cache_path = tmp_path / "cache.json"
+    paths = sorted(files.glob("**/*.*"))
+    first = checksums.digests(paths, cache_path, jobs=2)
+
+    hashed = []
+
+    def file_digest(path):
+        hashed.append(path)
+        return hashlib.sha256(open(path, "rb").read()).hexdigest()
+
+    monkeypatch.setattr(checksums, "file_digest", file_digest)
+    assert checksums.digests(paths, cache_path) == first
+    assert not hashed
+
+    modified = files / "table.csv"
+    modified.write_text("a,b\n1,3\n")
+    os.utime(modified, ns=(0, 0))
+    second = checksums.digests(paths, cache_path)
+    assert hashed == [modified]
+    assert second[modified] != first[modified]
+
+
+def test_register_and_verify(files, tmp_path):
+    """Test that registered files verify until one is corrupted."""
+    cache_path = tmp_path / "cache.json"
+    registered = checksums.register(files, cache_path=cache_path, jobs=2)
+
+    assert set(registered) == {"table.csv", *(f"images/{i}.png" for i in range(3))}
+    assert checksums.read_checksums(files / checksums.CHECKSUMS_FILE) == registered
+    checksums.verify(files, registered, cache_path)
+
+    (files / "images" / "0.png").write_bytes(b"\x00" * 999)
+    (files / "images" / "1.png").write_bytes(b"\x02" * 1001)
+    (files / "table.csv").unlink()
+    with pytest.raises(ValueError) as error:
+        checksums.verify(files, registered, cache_path)
+    message = str(error.value)
+    assert "images/0.png: 999 bytes, expected 1000" in message
+    assert "images/1.png: sha256" in message
+    assert "table.csv: missing" in message
+    assert "images/2.png" not in message
+
+
+def test_batch_files():
+    """Test that small files share batches and large ones get their own."""
+    paths = [f"{i}.png" for i in range(6)]
+    batches = checksums.batch_files(paths, [100, 60, 30, 30, 20, 10], batch_bytes=64)
+
+    assert batches == [["0.png"], ["1.png"], ["2.png", "3.png"], ["4.png", "5.png"]]
+
+
+def test_select_checksums(files):
+    """Test that only the files at or under the given paths are selected."""
+    registered = checksums.register(files, cache_path=None)
+    selected = checksums.select_checksums(
+        registered, files, [files / "images", "table.csv"]
+    )
+    assert selected == registered
+    assert set(checksums.select_checksums(registered, files, ["images/1.png"])) == {
+        "images/1.png"
+    }
+    assert not checksums.select_checksums(registered, files, ["image"])
+
+
+@pytest.fixture
+def manual_dir(tmp_path):
+    """Copy of the DECaLS dummy data, with the volunteers_5 csv only."""
+    manual_dir = tmp_path / "manual"
+    shutil.copytree(DUMMY_DATA, manual_dir)
+    for name in ["gz_decals_auto_posteriors.csv", "gz_decals_volunteers_1_and_2.csv"]:
+        (manual_dir / "galaxy_zoo_decals" / name).unlink(missing_ok=True)
+    return manual_dir
+
+
+def prepare(name, manual_dir, data_dir, **kwargs):
+    """Prepare a DECaLS config from a manual directory."""
+    builder = tfds.builder(name, data_dir=str(data_dir), **kwargs)
+    builder.download_and_prepare(
+        download_config=tfds.download.DownloadConfig(manual_dir=str(manual_dir))
+    )
+    return builder
+
+
+def test_builder_gate(manual_dir, tmp_path):
+    """Test that builders verify the files they read only when asked to."""
+    name = "galaxy_zoo_decals/volunteers_5"
+    options = dict(verify_checksums=True, checksum_cache=tmp_path / "cache.json")
+
+    prepare(name, manual_dir, tmp_path / "unverified")
+    # the dummy csv does not match the checksum of the real one, and the csvs
+    # of the other configs are not needed
+    with pytest.raises(ValueError) as error:
+        prepare(name, manual_dir, tmp_path / "mismatch", **options)
+    assert "gz_decals_volunteers_5.csv: " in str(error.value)
+    assert "missing" not in str(error.value)
+
+    # the images have no published checksums
+    with pytest.raises(ValueError, match="No checksums"):
+        prepare("galaxy_zoo_decals/images", manual_dir, tmp_path / "none", **options)
+    checksums.register(manual_dir / "galaxy_zoo_decals", cache_path=None)
+    builder = prepare(
+        "galaxy_zoo_decals/images", manual_dir, tmp_path / "verified", **options
+    )
+    assert builder.info.splits["train"].num_examples == 18
+
+
+def test_builder_conflict(manual_dir, tmp_path):
+    """Test that registered checksums cannot override the published ones."""
+    checksums.register(manual_dir / "galaxy_zoo_decals", cache_path=None)
+
+    with pytest.raises(ValueError, match="disagree") as error:
+        prepare(
+            "galaxy_zoo_decals/volunteers_5",
+            manual_dir,
+            tmp_path / "data",
+            verify_checksums=True,
+            checksum_cache=None,
+        )
+    assert "gz_decals_volunteers_5.csv" in str(error.value)
@@ -0,0 +1,104 @@
+"""Test cases for the codecs module."""
+import io
+
+import numpy as np
+import pytest
+import tensorflow as tf
+import tensorflow_datasets as tfds
+from PIL import Image as PILImage
+
+from galaxies_datasets import codecs
+from galaxies_datasets.datasets.galaxy_zoo_challenge import galaxy_zoo_challenge
+
+
+@pytest.fixture
+def image():
+    """Smooth random image, compressible like galaxy images."""
+    rng = np.random.default_rng(0)
+    noise = rng.uniform(0, 255, (8, 8, 3))
+    return np.kron(noise, np.ones((4, 4, 1))).astype(np.uint8)
+
+
+def roundtrip(image, codec):
+    """Store and read back an image as in a prepared dataset."""
+    features = tfds.features.FeaturesDict(
+        {"image": codecs.image_feature(image.shape, codec)}
+    )
+    serialized = features.serialize_example(
+        {"image": codecs.encode_image(image, codec)}
+    )
+    return features.deserialize_example(serialized)["image"].numpy()
+
+
+@pytest.mark.parametrize("codec", ["png", "webp", "raw"])
+def test_lossless_roundtrip(image, codec):
+    """Test that lossless codecs give back the original pixels."""
+    np.testing.assert_array_equal(roundtrip(image, codec), image)
+
+
+def test_webp_without_tensorflow_decoder(image, monkeypatch):
+    """Test that WebP images are decoded by Pillow before TensorFlow 2.20."""
+    monkeypatch.delattr(tf.io, "decode_webp", raising=False)
+    np.testing.assert_array_equal(roundtrip(image, "webp"), image)
+
+    ds = tf.data.Dataset.from_tensors(codecs.encode_image(image, "webp"))
+    ds = ds.map(codecs.image_feature(image.shape, "webp").decode_example)
+    assert next(iter(ds)).shape == image.shape
+
+
+def test_jpeg_roundtrip():
+    """Test that jpeg images are close to the original."""
+    ramp = np.linspace(0, 255, 32)
+    image = np.stack(np.broadcast_arrays(ramp, ramp[:, None], 128), -1)
+    image = image.astype(np.uint8)
+    decoded = roundtrip(image, "jpeg")
+    assert np.abs(decoded.astype(int) - image).mean() < 5
+
+
+def test_encode_image_sources(image, tmp_path):
+    """Test that paths, files and bytes are transcoded, or kept as they are."""
+    path = tmp_path / "image.png"
+    PILImage.fromarray(image).save(path)
+
+    assert codecs.encode_image(path, "png", source_format="png") == path
+    assert codecs.encode_image(path, None) == path
+    for source in [path, path.read_bytes(), io.BytesIO(path.read_bytes())]:
+        np.testing.assert_array_equal(codecs.encode_image(source, "raw"), image)
+
+
+def test_unknown_codec():
+    """Test that unknown codecs are rejected."""
+    with pytest.raises(ValueError):
+        codecs.image_feature((8, 8, 3), "gif")
+
+
+def test_image_features():
+    """Test that raw images are recognized but need no decoding."""
+    raw = codecs.image_feature((8, 8, 3), "raw")
+    assert codecs.is_image_feature(raw)
+    assert not codecs.is_encoded(raw)
+
+    webp = tfds.features.Sequence(codecs.image_feature((8, 8, 3), "webp"))
+    assert codecs.is_image_feature(webp)
+    assert codecs.is_encoded(webp)
+
+
+def test_with_codec():
+    """Test that derived configs get their own name."""
+    config = galaxy_zoo_challenge.GalaxyZooChallenge.builder_configs["train"]
+
+    webp = codecs.with_codec(config, "webp")
+    assert webp.name == "train_webp"
+    assert webp.codec == "webp"
+    assert codecs.with_codec(config, "jpeg", 80).name == "train_jpeg80"
+    assert config.codec is None
+
+
+def test_benchmark(image):
+    """Test that every codec is measured."""
+    reports = codecs.benchmark([image] * 4, num_iter=1)
+    sizes = {report.codec: report.bytes_per_image for report in reports}
+
+    assert list(sizes) == list(codecs.CODECS)
+    assert sizes["raw"] > sizes["png"]
+    assert all(report.images_per_second > 0 for report in reports)
@@ -0,0 +1,71 @@
+"""Test cases for the distributed module."""
+import dataclasses
+
+import pytest
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import distributed
+from galaxies_datasets.datasets.galaxy_zoo_challenge import galaxy_zoo_challenge
+
+
+def test_assign_shards():
+    """Test that shards are balanced by their number of examples."""
+    workers = distributed.assign_shards([5, 3, 3, 2, 2, 1], 2)
+
+    assert sorted(w.num_examples for w in workers) == [8, 8]
+    assigned = sorted(shard for w in workers for shard in w.shards)
+    assert assigned == list(range(6))
+
+
+def test_assign_shards_too_few():
+    """Test that every worker must get at least one shard."""
+    with pytest.raises(ValueError):
+        distributed.assign_shards([10, 10], 3)
+
+
+def test_read_plan(tmp_path):
+    """Test that workers read disjoint shards covering the whole split."""
+    builder = galaxy_zoo_challenge.GalaxyZooChallenge(
+        config="train", data_dir=tmp_path, num_shards=3
+    )
+    builder.download_and_prepare(
+        download_config=tfds.download.DownloadConfig(
+            manual_dir=tfds.core.Path(galaxy_zoo_challenge.__file__).parent
+            / "dummy_data"
+        )
+    )
+    assert builder.info.splits["train"].num_shards == 3
+
+    plan = distributed.read_plan(
+        "galaxy_zoo_challenge/train", 2, data_dir=str(tmp_path)
+    )
+    assert sorted(w.num_examples for w in plan.workers) == [1, 2]
+    assert plan.imbalance == pytest.approx(2 / 1.5)
+
+    ids = []
+    for worker in plan.workers:
+        instruction = plan.read_instruction(worker.worker)
+        for file in builder.info.splits[instruction].file_instructions:
+            assert file.skip == 0 and file.take == file.examples_in_shard
+
+        ds = builder.as_dataset(split=instruction)
+        worker_ids = [int(e["GalaxyID"]) for e in tfds.as_numpy(ds)]
+        assert len(worker_ids) == worker.num_examples
+        ids.extend(worker_ids)
+
+    full = builder.as_dataset(split="train")
+    assert sorted(ids) == sorted(int(e["GalaxyID"]) for e in tfds.as_numpy(full))
+
+
+def test_old_download_config(tmp_path):
+    """Test that shard layouts fail clearly without tensorflow_datasets 4.8."""
+
+    @dataclasses.dataclass
+    class DownloadConfig:
+        manual_dir: str = ""
+
+    builder = galaxy_zoo_challenge.GalaxyZooChallenge(
+        config="train", data_dir=tmp_path, max_shard_size=1024
+    )
+    with pytest.raises(ValueError, match="max_shard_size, min_shard_size"):
+        builder.download_and_prepare(download_config=DownloadConfig())
@@ -0,0 +1,151 @@
+"""Test cases for the duplicates module."""
+import io
+import shutil
+
+import numpy as np
+import pytest
+import tensorflow_datasets as tfds
+from PIL import Image as PILImage
+
+from galaxies_datasets import duplicates
+from galaxies_datasets import sidecar
+from galaxies_datasets.datasets.galaxy_zoo_challenge import galaxy_zoo_challenge
+
+DUMMY_DATA = (
+    tfds.core.Path(galaxy_zoo_challenge.__file__).parent
+    / "dummy_data"
+    / "galaxy_zoo_challenge"
+)
+
+
+def read_image(path) -> np.ndarray:
+    """Read an image file as an array."""
+    return np.array(PILImage.open(path).convert("RGB"))
+
+
+def recompress(image: np.ndarray, quality: int = 60) -> np.ndarray:
+    """Encode an image as jpeg and decode it again."""
+    buffer = io.BytesIO()
+    PILImage.fromarray(image).save(buffer, format="JPEG", quality=quality)
+    return read_image(buffer)
+
+
+def random_hashes(rng, size):
+    """Uniformly random 64 bit hashes."""
+    return rng.integers(0, 2**64, size, dtype=np.uint64, endpoint=False)
+
+
+def test_hash_is_robust():
+    """Test that edited copies hash close, and other images far."""
+    paths = sorted(DUMMY_DATA.glob("*/*.jpg"))
+    images = np.stack([read_image(path) for path in paths])
+    hashes = duplicates.perceptual_hash(images)
+    image = images[0]
+    edited = np.stack(
+        [
+            recompress(image),
+            np.clip(image * 1.2, 0, 255).astype(np.uint8),
+            np.array(
+                PILImage.fromarray(image).resize((256, 256)).resize(image.shape[:2])
+            ),
+        ]
+    )
+
+    distances = duplicates.hamming(duplicates.perceptual_hash(edited), hashes[0])
+    assert (distances <= duplicates.DEFAULT_RADIUS).all()
+    distances = duplicates.hamming(hashes[:, None], hashes[None, :])
+    others = distances[~np.eye(len(hashes), dtype=bool)]
+    assert (others > duplicates.DEFAULT_RADIUS).all()
+
+
+@pytest.mark.parametrize("chunks,radius", [(4, 6), (4, 9), (8, 9), (2, 1)])
+def test_index_matches_brute_force(chunks, radius):
+    """Test that the multi-index finds every pair within the radius."""
+    rng = np.random.default_rng(0)
+    indexed = random_hashes(rng, 5000)
+    flips = np.array(
+        [
+            sum(1 << int(bit) for bit in rng.choice(64, n, replace=False))
+            for n in rng.integers(0, radius + 3, 1000)
+        ],
+        np.uint64,
+    )
+    queries = np.concatenate([indexed[:1000] ^ flips, random_hashes(rng, 200)])
+
+    matches = duplicates.HashIndex(indexed, chunks).query(queries, radius, block=300)
+    distances = duplicates.hamming(queries[:, None], indexed[None, :])
+    query, index = np.nonzero(distances <= radius)
+
+    assert len(matches.query) == len(query)
+    assert set(zip(matches.query, matches.index)) == set(zip(query, index))
+    assert (matches.distance == distances[matches.query, matches.index]).all()
+    assert len(duplicates.HashIndex(indexed[:0]).query(queries).query) == 0
+
+
+@pytest.fixture(scope="module")
+def data_dir(tmp_path_factory):
+    """Prepare the challenge dummy data, with a recompressed test image copy."""
+    tmp_path = tmp_path_factory.mktemp("duplicates")
+    manual_dir = tmp_path / "manual"
+    shutil.copytree(DUMMY_DATA, manual_dir / "galaxy_zoo_challenge")
+    images_path = manual_dir / "galaxy_zoo_challenge" / "images_test_rev1"
+    copy = recompress(read_image(images_path / "242195.jpg"), quality=80)
+    PILImage.fromarray(copy).save(images_path / "999999.jpg")
+
+    download_config = tfds.download.DownloadConfig(manual_dir=str(manual_dir))
+    for config in ("train", "test"):
+        builder = tfds.builder(
+            f"galaxy_zoo_challenge/{config}", data_dir=str(tmp_path / "data")
+        )
+        builder.download_and_prepare(download_config=download_config)
+
+    return str(tmp_path / "data")
+
+
+def test_prepared_hashes(data_dir):
+    """Test that hashes of the source images follow the sidecar rows.
+
+    Images are hashed as they are generated, decoded from the source files
+    rather than from the records.
+    """
+    name = "galaxy_zoo_challenge/test"
+    hashes = duplicates.load_image_hashes(name, data_dir=data_dir)
+    rows = sidecar.read_sidecar(name, data_dir=data_dir)
+    images_path = tfds.core.Path(data_dir).parent / "manual" / "galaxy_zoo_challenge"
+    images = np.stack(
+        [
+            read_image(images_path / "images_test_rev1" / f"{galaxy_id}.jpg")
+            for galaxy_id in rows["GalaxyID"]
+        ]
+    )
+
+    assert len(hashes) == len(rows) == 4
+    assert (hashes == duplicates.perceptual_hash(images)).all()
+
+
+def test_find_duplicates(data_dir):
+    """Test that the recompressed copy is found within its split only."""
+    name = "galaxy_zoo_challenge/test"
+    pairs = duplicates.find_duplicates(name, data_dir=data_dir)
+
+    assert len(pairs) == 1
+    assert {pairs["a/GalaxyID"][0], pairs["b/GalaxyID"][0]} == {242195, 999999}
+    assert pairs["distance"][0] <= duplicates.DEFAULT_RADIUS
+    assert duplicates.find_duplicates(
+        name, "galaxy_zoo_challenge/train", data_dir=data_dir
+    ).empty
+
+
+def test_duplicate_report(data_dir):
+    """Test that the report counts the pairs of every pair of splits."""
+    names = ["galaxy_zoo_challenge/test", "galaxy_zoo_challenge/train"]
+    report = duplicates.duplicate_report(names, data_dir=data_dir)
+
+    assert list(zip(report["dataset_a"], report["dataset_b"])) == [
+        (names[0], names[0]),
+        (names[0], names[1]),
+        (names[1], names[1]),
+    ]
+    assert list(report["pairs"]) == [1, 0, 0]
+    assert list(report["examples_a"]) == [2, 0, 0]
+    assert report["fraction_a"][0] == 0.5
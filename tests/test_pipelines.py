@@ -0,0 +1,93 @@
+"""Test cases for the pipelines module."""
+import pytest
+import tensorflow as tf
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import pipelines
+
+
+@pytest.fixture
+def mock_data():
+    """Replace prepared datasets with random examples."""
+    with tfds.testing.mock_data(num_examples=10):
+        yield
+
+
+def test_galaxy_zoo_challenge(mock_data):
+    """Test that images and labels are batched as float tensors."""
+    ds = pipelines.galaxy_zoo_challenge(batch_size=4)
+    image, label = next(iter(ds))
+
+    assert image.shape == (4, 424, 424, 3)
+    assert image.dtype == tf.float32
+    assert float(tf.reduce_max(image)) <= 1.0
+    assert label.shape == (4, 37)
+    assert label.dtype == tf.float32
+
+
+def test_label_order(mock_data):
+    """Test that label vectors follow the order of the label keys."""
+    ds = pipelines.load(
+        "galaxy_zoo_challenge/train",
+        "image",
+        ["Class1.2", "Class1.1"],
+        label_feature="label",
+        batch_size=10,
+        shuffle_buffer=None,
+    )
+    _, label = next(iter(ds))
+    raw = next(iter(tfds.load("galaxy_zoo_challenge/train", split="train").batch(10)))
+
+    expected = tf.stack([raw["label"]["Class1.2"], raw["label"]["Class1.1"]], -1)
+    assert label.numpy() == pytest.approx(expected.numpy())
+
+
+@pytest.mark.parametrize("cache", [None, "encoded", "decoded"])
+def test_cache(mock_data, cache):
+    """Test that every cache placement yields all the examples."""
+    ds = pipelines.galaxy_zoo_challenge(batch_size=3, cache=cache)
+    sizes = [int(image.shape[0]) for image, _ in ds]
+    assert sizes == [3, 3, 3, 1]
+
+
+def test_invalid_cache():
+    """Test that unknown cache placements are rejected."""
+    with pytest.raises(ValueError):
+        pipelines.load("galaxy_zoo_challenge/train", "image", [], cache="disk")
+
+
+def test_label_keys():
+    """Test that labels are selected by suffix."""
+    keys = tfds.builder("galaxy_zoo2").info.features["table1"]
+    debiased = pipelines.label_keys(keys, "debiased")
+    assert "t01_smooth_or_features_a01_smooth_debiased" in debiased
+    assert all(key.endswith("_debiased") for key in debiased)
+
+
+def test_galaxy_zoo2_fraction(mock_data):
+    """Test that fractions exclude the weighted fractions."""
+    _, label = next(iter(pipelines.galaxy_zoo2(label="fraction", batch_size=2)))
+    _, debiased = next(iter(pipelines.galaxy_zoo2(batch_size=2)))
+    assert label.shape == debiased.shape
+
+
+def test_eagle(mock_data):
+    """Test that the orientation selects the image feature."""
+    image, label = next(iter(pipelines.eagle(batch_size=2, orientation="edge")))
+    assert image.shape == (2, 256, 256, 3)
+    assert label.shape == (2, 4)
+
+    image, _ = next(iter(pipelines.eagle("RefL0025N0376_stacked", batch_size=2)))
+    assert image.shape == (2, 3, 256, 256, 3)
+
+
+def test_throughput_report(mock_data):
+    """Test that the report counts the measured batches."""
+    ds = pipelines.galaxy_zoo_decals(batch_size=2)
+    report = pipelines.throughput_report(ds, num_batches=3, warmup_batches=1)
+
+    assert report.batches == 3
+    assert report.examples == 6
+    assert report.examples_per_second > 0
+    assert report.cpu_utilization >= 0
+    assert "examples/s" in str(report)
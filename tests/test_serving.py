@@ -0,0 +1,145 @@
+"""Test cases for the serving module."""
+import threading
+import time
+from multiprocessing import shared_memory
+from unittest import mock
+
+import numpy as np
+import pytest
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import serving
+
+
+def test_ring():
+    """Test that batches go through the ring in order, partial ones included."""
+    example = {"image": np.zeros((4, 4, 3), np.uint8), "label": {"a": 0.5}, "id": b"x"}
+    spec = serving.batch_spec(example, batch_size=2)
+    assert list(spec) == ["image", "label/a"]
+
+    size = serving.Ring.nbytes(spec, 2, 2)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        ring = serving.Ring(shm, spec, batch_size=2, num_slots=2)
+        stop = threading.Event()
+        batches = [
+            {
+                "image": np.full((n, 4, 4, 3), i, np.uint8),
+                "label/a": np.full((n,), i, np.float64),
+            }
+            for i, n in enumerate([2, 2, 1])
+        ]
+        assert ring.put(batches[0], stop) and ring.put(batches[1], stop)
+        stop.set()
+        assert not ring.put(batches[2], stop)
+
+        np.testing.assert_equal(ring.get(), batches[0])
+        assert ring.put(batches[2], threading.Event())
+        np.testing.assert_equal(ring.get(), batches[1])
+        np.testing.assert_equal(ring.get(), batches[2])
+        assert ring.get() is None
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_serve(challenge_data_dir, tmp_path):
+    """Test that every client gets every example once per epoch."""
+    name = "galaxy_zoo_challenge/train"
+    builder = tfds.builder(name, data_dir=challenge_data_dir)
+    galaxy_ids = sorted(
+        int(e["GalaxyID"]) for e in tfds.as_numpy(builder.as_dataset(split="train"))
+    )
+
+    server_name = f"galaxies_datasets_test_{tmp_path.name}"
+    process = serving.start(
+        server_name,
+        name,
+        num_consumers=2,
+        batch_size=2,
+        epochs=2,
+        window=2,
+        data_dir=challenge_data_dir,
+    )
+    try:
+        for consumer in range(2):
+            with serving.Client(server_name, consumer, timeout=120) as client:
+                batches = list(client)
+            assert [len(b["GalaxyID"]) for b in batches] == [2, 1, 2, 1]
+            assert batches[0]["image"].shape == (2, 424, 424, 3)
+            for epoch in [batches[:2], batches[2:]]:
+                ids = np.concatenate([b["GalaxyID"] for b in epoch])
+                assert sorted(ids) == galaxy_ids
+        process.join(timeout=60)
+        assert process.exitcode == 0
+    finally:
+        process.terminate()
+
+    with pytest.raises(FileNotFoundError):
+        serving.attach(serving.spec_name(server_name))
+
+
+def test_client_closed_early(challenge_data_dir, tmp_path):
+    """Test that a client closing early does not hold the others back."""
+    server_name = f"galaxies_datasets_test_{tmp_path.name}"
+    process = serving.start(
+        server_name,
+        "galaxy_zoo_challenge/train",
+        num_consumers=2,
+        batch_size=1,
+        epochs=4,
+        window=1,
+        num_slots=1,
+        max_lag=1,
+        data_dir=challenge_data_dir,
+    )
+    try:
+        with serving.Client(server_name, 0, timeout=120) as client:
+            next(client)
+        with serving.Client(server_name, 1, timeout=120) as client:
+            batches = list(client)
+        assert len(batches) == 12
+        process.join(timeout=60)
+        assert process.exitcode == 0
+    finally:
+        process.terminate()
+
+
+def test_dead_consumer():
+    """Test that the ring of a consumer whose heartbeat stopped is dropped."""
+    spec = serving.batch_spec({"id": np.int64(0)}, batch_size=1)
+    shm = shared_memory.SharedMemory(create=True, size=serving.Ring.nbytes(spec, 1, 1))
+    try:
+        ring = serving.Ring(shm, spec, batch_size=1, num_slots=1, timeout=0.2)
+        heartbeat = serving.Heartbeat([ring], serving._CONSUMER_BEAT)
+        time.sleep(1)
+        assert not ring.dropped
+        assert ring.put({"id": np.zeros(1, np.int64)}, threading.Event())
+
+        heartbeat.stop()
+        assert not ring.put({"id": np.zeros(1, np.int64)}, threading.Event())
+        assert ring.dropped
+        assert not ring.producer_stopped
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_shuffled_batches():
+    """Test that batches are gathered from a shared window without copying it."""
+    ring = mock.Mock(batch_size=3)
+    ring.put.return_value = True
+    window = {"id": np.arange(4)}
+    window["id"].flags.writeable = False
+    rng = np.random.default_rng(0)
+
+    published, pending = serving._publish_window(ring, window, None, rng, None)
+    assert published and len(pending["id"]) == 1
+    published, pending = serving._publish_window(ring, window, pending, rng, None)
+    assert published and len(pending["id"]) == 2
+
+    batches = [call.args[0]["id"] for call in ring.put.call_args_list]
+    assert [len(batch) for batch in batches] == [3, 3]
+    ids = np.concatenate([*batches, pending["id"]])
+    assert sorted(ids) == sorted([*range(4), *range(4)])
+    np.testing.assert_array_equal(window["id"], np.arange(4))
@@ -0,0 +1,56 @@
+"""Test cases for the shards module."""
+import tarfile
+
+from galaxies_datasets.shards import get_index_filepath
+from galaxies_datasets.shards import has_shards
+from galaxies_datasets.shards import read_index
+from galaxies_datasets.shards import ShardReader
+from galaxies_datasets.shards import ShardWriter
+
+
+def write_members(path, members, max_shard_size):
+    """Write members into shards."""
+    with ShardWriter(path, "test", max_shard_size) as writer:
+        for name, data in members.items():
+            writer.write(name, data)
+
+
+def test_has_shards(tmp_path):
+    """Test that directories are detected as sharded only with an index."""
+    assert not has_shards(tmp_path)
+    write_members(tmp_path, {"a.png": b"a"}, 1024)
+    assert has_shards(tmp_path)
+
+
+def test_shards_roll_over(tmp_path):
+    """Test that a new shard is started when the current one is full."""
+    members = {f"{i}.png": bytes([i]) * 1000 for i in range(4)}
+    write_members(tmp_path, members, 4000)
+
+    index = read_index(tmp_path)
+    assert len({entry.shard for entry in index.values()}) == 2
+    assert get_index_filepath(tmp_path, "test").exists()
+
+
+def test_shards_are_valid_tar_files(tmp_path):
+    """Test that shards can be read with standard tar tools."""
+    members = {"a.png": b"aaa", "b.png": b"b" * 600}
+    write_members(tmp_path, members, 10000)
+
+    with tarfile.open(tmp_path / "test-00000.tar") as tar:
+        assert tar.getnames() == list(members)
+        assert tar.extractfile("b.png").read() == members["b.png"]
+
+
+def test_shard_reader(tmp_path):
+    """Test that members are read back using the index."""
+    members = {f"{i}.png": bytes([i]) * (100 * i + 1) for i in range(10)}
+    write_members(tmp_path, members, 1500)
+
+    with ShardReader(tmp_path) as reader:
+        assert len(reader) == len(members)
+        assert "3.png" in reader
+        assert "missing.png" not in reader
+        for name, data in members.items():
+            assert reader.read(name) == data
+        assert reader.open("5.png").read() == members["5.png"]
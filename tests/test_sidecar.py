@@ -0,0 +1,113 @@
+"""Test cases for the sidecar module."""
+import pytest
+import tensorflow as tf
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import sidecar
+from galaxies_datasets.datasets.galaxy_zoo_2 import galaxy_zoo_2
+
+
+@pytest.fixture(scope="module")
+def data_dir(tmp_path_factory):
+    """Prepare the galaxy_zoo2 dummy data."""
+    data_dir = tmp_path_factory.mktemp("data")
+    builder = galaxy_zoo_2.GalaxyZoo2(data_dir=data_dir)
+    builder.download_and_prepare(
+        download_config=tfds.download.DownloadConfig(
+            manual_dir=tfds.core.Path(galaxy_zoo_2.__file__).parent / "dummy_data"
+        )
+    )
+    return str(data_dir)
+
+
+def test_record_offsets(data_dir):
+    """Test that offsets point to every record of a shard."""
+    builder = tfds.builder("galaxy_zoo2", data_dir=data_dir)
+    [filename] = builder.info.splits["train"].filenames
+    path = builder.data_path / filename
+
+    offsets = sidecar.record_offsets(path)
+    records = list(sidecar.read_records(path, offsets))
+    expected = list(tfds.as_numpy(tf.data.TFRecordDataset(str(path))))
+
+    assert records == expected
+
+
+def test_read_sidecar(data_dir):
+    """Test that the sidecar holds the non-image features of every example."""
+    df = sidecar.read_sidecar("galaxy_zoo2", data_dir=data_dir)
+
+    assert len(df) == 3
+    assert "image" not in df
+    assert "metadata/ra" in df
+    assert set(df["table1/gz2_class"]) == {"Sc+t", "Sb?m(m)", "Ser"}
+
+
+def test_filter_query(data_dir):
+    """Test that query strings select the matching rows."""
+    df = sidecar.read_sidecar(
+        "galaxy_zoo2", filter="`metadata/ra` > 150", data_dir=data_dir
+    )
+    assert (df["metadata/ra"] > 150).all()
+    assert 0 < len(df) < 3
+
+
+def test_load(data_dir):
+    """Test that only matching examples are read, fully decoded."""
+    ds = sidecar.load(
+        "galaxy_zoo2",
+        filter=lambda df: df["table1/gz2_class"].str.match("S[bc]"),
+        data_dir=data_dir,
+    )
+    examples = list(tfds.as_numpy(ds))
+    classes = sorted(e["table1"]["gz2_class"].decode() for e in examples)
+
+    full = tfds.builder("galaxy_zoo2", data_dir=data_dir).as_dataset(split="train")
+    expected = {
+        int(e["metadata"]["dr7objid"]): e["image"]
+        for e in tfds.as_numpy(full)
+        if e["table1"]["gz2_class"].startswith((b"Sb", b"Sc"))
+    }
+
+    assert classes == ["Sb?m(m)", "Sc+t"]
+    for example in examples:
+        image = expected[int(example["metadata"]["dr7objid"])]
+        assert (example["image"] == image).all()
+
+
+def test_rows_keyed(challenge_data_dir):
+    """Test that every row holds the key of the example at its record."""
+    name = "galaxy_zoo_challenge/train"
+    builder = tfds.builder(name, data_dir=challenge_data_dir)
+    df = sidecar.read_sidecar(name, data_dir=challenge_data_dir)
+    [filename] = builder.info.splits["train"].filenames
+    records = sidecar.read_records(builder.data_path / filename, df["_offset"])
+
+    assert len(df) == 3
+    for key, record in zip(df[sidecar.KEY_COLUMN], records):
+        example = builder.info.features.deserialize_example(record)
+        assert key == str(int(example["GalaxyID"]))
+
+
+def test_join_columns():
+    """Test that rows are told apart by a unique column, else all of them."""
+    rows = [{"id": 1, "ra": 1.5, "name": "a"}, {"id": 2, "ra": 1.5, "name": "a"}]
+    assert sidecar.join_columns(rows) == {"id": tf.int64}
+    rows[1]["id"] = 1
+    assert list(sidecar.join_columns(rows)) == ["id", "ra", "name"]
+
+
+def test_without_locations(tmp_path):
+    """Test that the sidecar has every row without record locations."""
+    builder = galaxy_zoo_2.GalaxyZoo2(data_dir=tmp_path, sidecar_locations=False)
+    builder.download_and_prepare(
+        download_config=tfds.download.DownloadConfig(
+            manual_dir=tfds.core.Path(galaxy_zoo_2.__file__).parent / "dummy_data"
+        )
+    )
+    df = sidecar.read_sidecar("galaxy_zoo2", data_dir=str(tmp_path))
+
+    assert len(df) == 3
+    assert sidecar.SHARD_COLUMN not in df
+    with pytest.raises(ValueError, match="sidecar_locations"):
+        sidecar.load("galaxy_zoo2", data_dir=str(tmp_path))
@@ -0,0 +1,99 @@
+"""Test cases for the sky module."""
+import numpy as np
+import pytest
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import sidecar
+from galaxies_datasets import sky
+from galaxies_datasets.datasets.galaxy_zoo_2 import galaxy_zoo_2
+from galaxies_datasets.datasets.galaxy_zoo_decals import galaxy_zoo_decals
+
+
+def random_positions(rng, n):
+    """Uniformly distributed positions on the sphere."""
+    ra = rng.uniform(0, 360, n)
+    dec = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+    return ra, dec
+
+
+def brute_force(ra_a, dec_a, ra_b, dec_b, radius):
+    """Every pair within the radius, comparing all of them."""
+    vectors_a = sky.unit_vectors(ra_a, dec_a)
+    vectors_b = sky.unit_vectors(ra_b, dec_b)
+    distance = sky.separation(vectors_a[:, None], vectors_b[None])
+    return set(zip(*np.nonzero(distance <= radius)))
+
+
+@pytest.mark.parametrize("radius", [30.0, 600.0, 7200.0])
+def test_query_matches_brute_force(radius):
+    """Test that the zones find exactly the pairs within the radius."""
+    rng = np.random.default_rng(0)
+    ra_b, dec_b = random_positions(rng, 2000)
+    # queries near indexed positions, plus the wrap around and the poles
+    ra_a = np.concatenate([ra_b[:200] + 0.01, [0.0, 359.99, 10.0, 200.0]])
+    dec_a = np.concatenate([dec_b[:200] - 0.01, [0.0, 0.0, 89.99, -89.99]])
+    ra_b = np.concatenate([ra_b, [359.999, 0.001, 190.0, 20.0]])
+    dec_b = np.concatenate([dec_b, [0.001, -0.001, 89.995, -89.995]])
+
+    matches = sky.SkyIndex(ra_b, dec_b, zone_height=0.1).query(ra_a, dec_a, radius)
+
+    assert set(zip(matches.query, matches.index)) == brute_force(
+        ra_a, dec_a, ra_b, dec_b, radius
+    )
+    assert (matches.separation <= radius).all()
+
+
+def test_save_and_load(tmp_path):
+    """Test that a saved index answers the same queries."""
+    ra, dec = random_positions(np.random.default_rng(1), 100)
+    index = sky.SkyIndex(ra, dec)
+    path = tfds.core.Path(tmp_path) / "index.npz"
+    index.save(path)
+
+    loaded = sky.SkyIndex.load(path)
+    assert len(loaded) == len(index)
+    matches = loaded.query(ra, dec, 1.0)
+    np.testing.assert_array_equal(matches.index, np.arange(100))
+
+
+@pytest.fixture(scope="module")
+def data_dir(tmp_path_factory):
+    """Prepare the galaxy_zoo2 and galaxy_zoo_decals dummy data."""
+    data_dir = tmp_path_factory.mktemp("data")
+    for module, builder_class in [
+        (galaxy_zoo_2, galaxy_zoo_2.GalaxyZoo2),
+        (galaxy_zoo_decals, galaxy_zoo_decals.GalaxyZooDecals),
+    ]:
+        builder = builder_class(data_dir=data_dir)
+        builder.download_and_prepare(
+            download_config=tfds.download.DownloadConfig(
+                manual_dir=tfds.core.Path(module.__file__).parent / "dummy_data"
+            )
+        )
+    return str(data_dir)
+
+
+def test_match_catalogue(data_dir):
+    """Test that external positions are matched to sidecar rows."""
+    rows = sidecar.read_sidecar("galaxy_zoo2", data_dir=data_dir)
+    ra = rows["metadata/ra"].to_numpy()[::-1]
+    dec = rows["metadata/dec"].to_numpy()[::-1] + 0.5 / 3600
+
+    matches = sky.match_catalogue("galaxy_zoo2", ra, dec, 1.0, data_dir=data_dir)
+
+    assert list(matches["query"]) == [0, 1, 2]
+    assert list(matches["metadata/ra"]) == list(ra)
+    np.testing.assert_allclose(matches["separation"], 0.5)
+
+
+def test_cross_match(data_dir):
+    """Test that pairs carry the columns of both datasets."""
+    pairs = sky.cross_match(
+        "galaxy_zoo2", "galaxy_zoo_decals", 180 * 3600, data_dir=data_dir
+    )
+    n_decals = len(sidecar.read_sidecar("galaxy_zoo_decals", data_dir=data_dir))
+
+    assert len(pairs) == 3 * n_decals
+    assert "galaxy_zoo2/table1/gz2_class" in pairs
+    assert "galaxy_zoo_decals/metadata/iauname" in pairs
+    assert (pairs["separation"] <= 180 * 3600).all()
@@ -0,0 +1,89 @@
+"""Test cases for the splits module."""
+import collections
+from unittest import mock
+
+import pytest
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import splits
+from galaxies_datasets import subsets
+from galaxies_datasets.datasets.galaxy_zoo_decals import galaxy_zoo_decals
+
+
+def test_assign_split():
+    """Test that splits are deterministic and follow the fractions."""
+    counts = collections.Counter(
+        splits.assign_split(key, splits.DEFAULT_FRACTIONS) for key in range(10000)
+    )
+
+    assert splits.assign_split(123, {"a": 1, "b": 1}) == splits.assign_split(
+        "123", {"a": 1, "b": 1}
+    )
+    assert set(counts) == set(splits.DEFAULT_FRACTIONS)
+    assert abs(counts["train"] / 10000 - 0.8) < 0.02
+    assert abs(counts["validation"] / 10000 - 0.1) < 0.02
+    assert splits.assign_split(123, {"only": 0.5}) == "only"
+
+
+def test_independent_of_subsets():
+    """Test that the splits of a subset are not biased by its sampling."""
+    kept = [key for key in range(10000) if subsets.hash_fraction(key) < 0.5]
+    counts = collections.Counter(
+        splits.assign_split(key, {"a": 0.5, "b": 0.5}) for key in kept
+    )
+    assert abs(counts["a"] / len(kept) - 0.5) < 0.03
+
+
+def test_prepared_splits(tmp_path):
+    """Test that splits are disjoint, physical and cover every example."""
+    name = "galaxy_zoo_decals/volunteers_5"
+    download_config = tfds.download.DownloadConfig(
+        manual_dir=tfds.core.Path(galaxy_zoo_decals.__file__).parent / "dummy_data"
+    )
+    fractions = {"train": 0.5, "test": 0.5}
+
+    def iaunames(builder, split):
+        ds = builder.as_dataset(split=split)
+        return [e["metadata"]["iauname"].decode() for e in tfds.as_numpy(ds)]
+
+    full = tfds.builder(name, data_dir=str(tmp_path / "full"))
+    full.download_and_prepare(download_config=download_config)
+    builder = tfds.builder(
+        name, data_dir=str(tmp_path / "split"), split_fractions=fractions
+    )
+    builder.download_and_prepare(download_config=download_config)
+
+    train, test = iaunames(builder, "train"), iaunames(builder, "test")
+    assert set(builder.info.splits) == {"train", "test"}
+    assert train and test
+    assert not set(train) & set(test)
+    assert sorted(train + test) == sorted(iaunames(full, "train"))
+    assert all(splits.assign_split(key, fractions) == "test" for key in test)
+    assert builder.info.metadata["splits"] == {"fractions": fractions, "seed": 0}
+
+
+def test_single_source_pass(tmp_path):
+    """Test that images are looked up once for every split."""
+    download_config = tfds.download.DownloadConfig(
+        manual_dir=tfds.core.Path(galaxy_zoo_decals.__file__).parent / "dummy_data"
+    )
+    builder = tfds.builder(
+        "galaxy_zoo_decals/volunteers_5",
+        data_dir=str(tmp_path),
+        split_fractions={"train": 0.5, "test": 0.5},
+    )
+    with mock.patch.object(
+        galaxy_zoo_decals,
+        "find_image_path",
+        wraps=galaxy_zoo_decals.find_image_path,
+    ) as find_image_path:
+        builder.download_and_prepare(download_config=download_config)
+
+    iaunames = [call.args[0] for call in find_image_path.call_args_list]
+    assert len(iaunames) == len(set(iaunames))
+
+
+def test_invalid_fractions():
+    """Test that fractions are checked."""
+    with pytest.raises(ValueError):
+        tfds.builder("galaxy_zoo2", split_fractions={"train": 1, "test": 0})
@@ -0,0 +1,124 @@
+"""Test cases for the stats module."""
+import io
+
+import numpy as np
+import pytest
+import tensorflow_datasets as tfds
+from PIL import Image as PILImage
+
+from galaxies_datasets import eagle_columns
+from galaxies_datasets import stats
+from galaxies_datasets.datasets.eagle import eagle
+from galaxies_datasets.datasets.galaxy_zoo_decals import galaxy_zoo_decals
+
+
+def test_moments_match_numpy():
+    """Test that merged batches give the moments of all the values."""
+    rng = np.random.default_rng(0)
+    batches = [rng.normal(10, 3, (n, 3)) for n in [1, 50, 7, 200]]
+    moments = stats.Moments(3)
+    for batch in batches:
+        moments.update(batch)
+
+    values = np.concatenate(batches)
+    np.testing.assert_allclose(moments.mean, values.mean(axis=0))
+    np.testing.assert_allclose(moments.variance, values.var(axis=0))
+    assert moments.count == len(values)
+
+
+def test_quantile_sketch():
+    """Test that quantiles are close in rank, with exact extremes."""
+    values = np.random.default_rng(1).lognormal(size=20000)
+    sketch = stats.QuantileSketch()
+    for value in values:
+        sketch.update(value)
+
+    q = np.linspace(0, 1, 11)
+    estimates = sketch.quantiles(q)
+    ranks = np.searchsorted(np.sort(values), estimates) / len(values)
+    np.testing.assert_allclose(ranks, q, atol=0.02)
+    assert estimates[0] == values.min() and estimates[-1] == values.max()
+    assert sum(len(level) for level in sketch.levels) < 2000
+
+
+def test_feature_statistics():
+    """Test histograms, with missing values left out."""
+    statistics = stats.FeatureStatistics(histogram=True)
+    for value in [0.0, 0.5, 1.0, "nan", 0.52]:
+        statistics.update(value)
+
+    summary = statistics.to_dict()
+    assert summary["missing"] == 1
+    assert summary["mean"] == pytest.approx(0.505)
+    counts = summary["histogram"]["counts"]
+    assert sum(counts) == 4
+    assert counts[0] == 1 and counts[10] == 2 and counts[-1] == 1
+
+
+def test_image_sources():
+    """Test that images are described from arrays, bytes and files alike."""
+    image = np.arange(4 * 4 * 3, dtype=np.uint8).reshape(4, 4, 3)
+    buffer = io.BytesIO()
+    PILImage.fromarray(image).save(buffer, format="PNG")
+    statistics = stats.DatasetStatistics({"image": 3})
+    for source in [image, buffer.getvalue(), io.BytesIO(buffer.getvalue())]:
+        statistics.update({"image": source})
+
+    summary = statistics.to_dict()["images"]["image"]
+    np.testing.assert_allclose(summary["mean"], image.mean(axis=(0, 1)))
+    np.testing.assert_allclose(summary["std"], image.std(axis=(0, 1)))
+
+
+def prepare(builder, module):
+    """Prepare a builder from its dummy data."""
+    builder.download_and_prepare(
+        download_config=tfds.download.DownloadConfig(
+            manual_dir=tfds.core.Path(module.__file__).parent / "dummy_data"
+        )
+    )
+    return builder
+
+
+def test_decals_statistics(tmp_path):
+    """Test that the stored statistics describe the prepared examples."""
+    prepare(galaxy_zoo_decals.GalaxyZooDecals(data_dir=tmp_path), galaxy_zoo_decals)
+    summary = stats.load_statistics("galaxy_zoo_decals", data_dir=str(tmp_path))
+
+    builder = tfds.builder("galaxy_zoo_decals", data_dir=str(tmp_path))
+    examples = list(tfds.as_numpy(builder.as_dataset(split="train")))
+    images = np.stack([e["image"] for e in examples]).reshape(-1, 3)
+    redshift = np.array([e["metadata"]["redshift"] for e in examples])
+    smooth = np.array(
+        [e["morphology"]["smooth-or-featured_smooth_fraction"] for e in examples]
+    )
+
+    assert summary["num_examples"] == len(examples)
+    np.testing.assert_allclose(summary["images"]["image"]["mean"], images.mean(0))
+    np.testing.assert_allclose(summary["images"]["image"]["std"], images.std(0))
+
+    label = summary["labels"]["morphology/smooth-or-featured_smooth_fraction"]
+    assert label["mean"] == pytest.approx(np.nanmean(smooth))
+    assert sum(label["histogram"]["counts"]) == np.isfinite(smooth).sum()
+
+    quantiles = summary["quantiles"]["metadata/redshift"]
+    assert quantiles["min"] == pytest.approx(np.nanmin(redshift))
+    assert quantiles["percentiles"][50] == pytest.approx(
+        np.nanpercentile(redshift, 50, method="lower")
+    )
+    assert "metadata/ra" not in summary["quantiles"]
+
+
+def test_eagle_stacked_statistics(tmp_path):
+    """Test that the orientations of stacked images are described together."""
+    config = eagle.Eagle.builder_configs["RefL0025N0376_stacked"]
+    builder = prepare(eagle.Eagle(config=config, data_dir=tmp_path), eagle)
+    summary = builder.info.metadata["statistics"]["train"]
+
+    images = np.stack(
+        [e["Images"] for e in tfds.as_numpy(builder.as_dataset(split="train"))]
+    )
+    np.testing.assert_allclose(
+        summary["images"]["Images"]["mean"], images.reshape(-1, 3).mean(0)
+    )
+    assert set(summary["quantiles"]) == {f"Sizes/{k}" for k in eagle_columns.SIZES}
+    assert "snapshot_fingerprints" in builder.info.metadata
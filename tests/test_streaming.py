@@ -0,0 +1,91 @@
+"""Test cases for the streaming module."""
+from unittest import mock
+
+import numpy as np
+import pytest
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import stats
+from galaxies_datasets import streaming
+from galaxies_datasets.datasets.eagle import eagle
+from galaxies_datasets.datasets.galaxy_zoo_2 import galaxy_zoo_2
+from galaxies_datasets.datasets.galaxy_zoo_decals import galaxy_zoo_decals
+
+
+def dummy_data(module):
+    """Manual dir holding the dummy data of a dataset."""
+    return str(tfds.core.Path(module.__file__).parent / "dummy_data")
+
+
+def test_matches_prepared(tmp_path):
+    """Test that streamed examples are those of the prepared dataset."""
+    name = "galaxy_zoo_decals/volunteers_5"
+    manual_dir = dummy_data(galaxy_zoo_decals)
+    builder = tfds.builder(name, data_dir=tmp_path)
+    builder.download_and_prepare(
+        download_config=tfds.download.DownloadConfig(manual_dir=manual_dir)
+    )
+    prepared = {
+        e["metadata"]["iauname"]: e
+        for e in tfds.as_numpy(builder.as_dataset(split="train"))
+    }
+
+    streamed = list(streaming.iterate(name, manual_dir=manual_dir, num_workers=2))
+
+    assert len(streamed) == len(prepared)
+    for example in streamed:
+        expected = prepared[example["metadata"]["iauname"]]
+        np.testing.assert_array_equal(example["image"], expected["image"])
+        np.testing.assert_equal(example["morphology"], expected["morphology"])
+
+
+def test_limit():
+    """Test that only the first examples are generated."""
+    manual_dir = dummy_data(eagle)
+    keys = [
+        key
+        for key, _ in streaming.generate_examples(
+            "eagle/RefL0025N0376_face", manual_dir=manual_dir, limit=2
+        )
+    ]
+    assert len(keys) == 2
+
+    ds = streaming.stream("eagle/RefL0025N0376_face", manual_dir=manual_dir, limit=2)
+    examples = list(tfds.as_numpy(ds))
+    assert [str(e["GalaxyID"]) for e in examples] == keys
+    assert examples[0]["Image_face"].shape == (256, 256, 3)
+
+
+def test_unknown_split():
+    """Test that splits are checked."""
+    with pytest.raises(ValueError):
+        next(
+            streaming.generate_examples(
+                "galaxy_zoo2", split="test", manual_dir=dummy_data(galaxy_zoo_2)
+            )
+        )
+
+
+def test_not_observed():
+    """Test that streamed examples are neither described nor decoded."""
+    with mock.patch.object(
+        stats.DatasetStatistics, "decode_images", side_effect=AssertionError
+    ):
+        examples = list(
+            streaming.generate_examples(
+                "galaxy_zoo2", manual_dir=dummy_data(galaxy_zoo_2)
+            )
+        )
+    assert len(examples) == 3
+
+
+def test_download_manager(tmp_path):
+    """Test that downloads default to the data directory of the builder."""
+    manual_dir = tmp_path / "downloads" / "manual"
+    manual_dir.mkdir(parents=True)
+    (manual_dir / "file").touch()
+    builder = tfds.builder("galaxy_zoo2/webp", data_dir=tmp_path)
+    dl_manager = streaming.download_manager(builder)
+
+    assert dl_manager.download_dir == tmp_path / "downloads"
+    assert dl_manager.manual_dir == manual_dir
@@ -0,0 +1,87 @@
+"""Test cases for the subsets module."""
+import numpy as np
+import pytest
+import tensorflow_datasets as tfds
+
+from galaxies_datasets import subsets
+from galaxies_datasets.datasets.eagle import eagle
+from galaxies_datasets.datasets.galaxy_zoo_2 import galaxy_zoo_2
+from galaxies_datasets.datasets.galaxy_zoo_decals import galaxy_zoo_decals
+
+
+def prepare(module, name, data_dir, **kwargs):
+    """Prepare a subset of the dummy data."""
+    builder = tfds.builder(name, data_dir=data_dir, **kwargs)
+    builder.download_and_prepare(
+        download_config=tfds.download.DownloadConfig(
+            manual_dir=tfds.core.Path(module.__file__).parent / "dummy_data"
+        )
+    )
+    return builder
+
+
+def test_hash_fraction():
+    """Test that hashes are deterministic and uniform."""
+    values = np.array([subsets.hash_fraction(key) for key in range(10000)])
+
+    assert subsets.hash_fraction(123) == subsets.hash_fraction("123")
+    assert subsets.hash_fraction(123, seed=1) != subsets.hash_fraction(123)
+    assert ((values >= 0) & (values < 1)).all()
+    assert abs((values < 0.1).mean() - 0.1) < 0.01
+
+
+def test_fraction_is_deterministic(tmp_path):
+    """Test that the same fraction selects the same, nested examples."""
+    name = "eagle/RefL0025N0376_face"
+
+    def galaxy_ids(data_dir, fraction):
+        builder = prepare(eagle, name, str(tmp_path / data_dir), fraction=fraction)
+        ds = builder.as_dataset(split="train")
+        return {int(e["GalaxyID"]) for e in tfds.as_numpy(ds)}
+
+    full = galaxy_ids("full", 1.0)
+    part = galaxy_ids("part", 0.8)
+    assert part == galaxy_ids("part_again", 0.8)
+    assert part < full
+    assert part == {
+        galaxy_id for galaxy_id in full if subsets.hash_fraction(galaxy_id) < 0.8
+    }
+
+
+def test_limit_and_filter(tmp_path):
+    """Test that filters apply to the catalogue rows, before the limit."""
+
+    def has_redshift(row):
+        return row["redshift"] != ""
+
+    builder = prepare(
+        galaxy_zoo_decals,
+        "galaxy_zoo_decals/volunteers_5",
+        str(tmp_path),
+        filter=has_redshift,
+        limit=2,
+    )
+
+    examples = list(tfds.as_numpy(builder.as_dataset(split="train")))
+    assert len(examples) == 2
+    assert all(np.isfinite(e["metadata"]["redshift"]) for e in examples)
+    assert builder.info.metadata["subset"] == {
+        "fraction": None,
+        "limit": 2,
+        "filter": "has_redshift",
+        "seed": 0,
+    }
+
+
+def test_galaxy_zoo2_limit(tmp_path):
+    """Test subsets of the builder without configs."""
+    builder = prepare(galaxy_zoo_2, "galaxy_zoo2", str(tmp_path), limit=1)
+    assert builder.info.splits["train"].num_examples == 1
+
+
+def test_needs_data_dir():
+    """Test that subsets are not prepared where the full datasets go."""
+    with pytest.raises(ValueError):
+        tfds.builder("galaxy_zoo2", limit=10)
+    with pytest.raises(ValueError):
+        tfds.builder("galaxy_zoo2", data_dir="/tmp", fraction=1.5)